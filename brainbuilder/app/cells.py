@@ -40,53 +40,42 @@ Based on:
 
 import logging
 import numbers
+import tempfile
 from collections.abc import Mapping
+from pathlib import Path
 
 import click
+import h5py
 import numpy as np
 import pandas as pd
-from voxcell import (
-    CellCollection,
-    ROIMask,
-    VoxelData,
-    values_to_hemisphere,
-    values_to_region_attribute,
-)
-from voxcell.nexus.voxelbrain import Atlas
+from joblib import Parallel, delayed
+from voxcell import CellCollection, VoxelData
 
-from brainbuilder import BrainBuilderError
+from brainbuilder import BrainBuilderError, placement
 from brainbuilder.app._utils import REQUIRED_PATH
-from brainbuilder.cell_positions import create_cell_positions
-from brainbuilder.utils import bbp, deprecate, load_yaml
-from brainbuilder.utils.bbp import load_cell_composition
+from brainbuilder.cell_group_cache import DEFAULT_MAX_SIZE
+from brainbuilder.cell_positions import iter_cell_positions
+from brainbuilder.density_cache import DensityCache, check_density_values
+from brainbuilder.utils import bbp, load_yaml, make_categorical, shared_arrays
+from brainbuilder.utils.sonata.write_nodes import (
+    NodePopulationWriter,
+    load_libraries,
+    read_cells,
+)
 
 L = logging.getLogger("brainbuilder")
 
+# approximate number of cells generated and written at once by `positions-and-orientations`
+ATLAS_CELLS_CHUNK_SIZE = 1000000
+
 
 @click.group()
 def app():
     """Building CellCollection"""
 
 
-def load_mtype_taxonomy(filepath):
-    """
-    Load mtype taxonomy from TSV file.
-
-    TODO: link to spec
-    """
-    # TODO: validate
-    return pd.read_csv(filepath, sep=r"\s+", index_col="mtype")
-
-
-def load_mini_frequencies(filepath):
-    """
-    Load mini frequencies from a TSV file.
-    """
-    return pd.read_csv(filepath, sep=r"\s+", index_col="layer", dtype={"layer": str})
-
-
 def _load_density(value, mask, atlas):
-    """Load density as 3D numpy array.
+    """Load density as 3D numpy array, see `DensityCache`.
 
     Args:
         value: one of
@@ -99,208 +88,66 @@ def _load_density(value, mask, atlas):
     `value` of form '{name}' is recognized as atlas dataset 'name'.
 
     Returns:
-        3D float32 numpy array of same shape as `mask`.
+        3D float64 numpy array of same shape as `mask`, with 0 outside of the mask (NaNs are
+        fine there).
     """
     if isinstance(value, numbers.Number):
         result = np.zeros_like(mask, dtype=np.float64)
         result[mask] = float(value)
-    elif value.startswith("{"):
-        assert value.endswith("}")
-        dataset = value[1:-1]
-        L.info("Loading 3D density profile from '%s' atlas dataset...", dataset)
-        result = atlas.load_data(dataset, cls=VoxelData).raw.astype(np.float64)
-    elif value.endswith(".nrrd"):
-        L.info("Loading 3D density profile from '%s'...", value)
-        result = VoxelData.load_nrrd(value).raw.astype(np.float64)
     else:
-        raise BrainBuilderError(f"Unexpected density value: '{value}'")
+        result = DensityCache(atlas).get(value).raw.astype(np.float64)
 
     # Mask away density values outside region mask (NaNs are fine there)
     result[~mask] = 0
 
-    if np.any(np.isnan(result)):
-        raise BrainBuilderError("NaN density values within region mask")
-
-    # Densities smaller than 1e-7 per mm3 correspond to less than 1 cell for the whole brain.
-    # For example, mouse brain volume is ~600 mm3 and human brain ~1260000 mm3.
-    # Allowing extremely small numbers introduces noise into the placement and should be ideally
-    # addressed at the density generation stage. However, given that this is not always the case,
-    # the near zero values will be zeroed to ensure the correct behavior of the algorithm.
-    mask = np.isclose(result, 0.0, atol=1e-7, rtol=0.0) & (result != 0.0)
-    if mask.any():
-        L.warning("{mask.sum()} Near zero values smaller than 1e-7 found and wil be zeroed.")
-        result[mask] = 0.0
+    check_density_values(result)
 
     return result
 
 
-def _create_cell_group(conf, atlas, root_mask, density_factor, soma_placement):
-    region_mask = atlas.get_region_mask(conf["region"], with_descendants=True, memcache=True)
-    if root_mask is not None:
-        region_mask.raw &= root_mask.raw
-    if not np.any(region_mask.raw):
-        raise BrainBuilderError(f"Empty region mask for region: '{conf['region']}'")
-
-    density = region_mask.with_data(_load_density(conf["density"], region_mask.raw, atlas))
+def _is_mvd3(filepath):
+    return filepath is not None and str(filepath).lower().endswith("mvd3")
 
-    pos = create_cell_positions(density, density_factor=density_factor, method=soma_placement)
-    result = pd.DataFrame(pos, columns=["x", "y", "z"])
-
-    for prop, value in conf["traits"].items():
-        if isinstance(value, Mapping):
-            values, probs = zip(*value.items())
-            if not np.allclose(np.sum(probs), 1.0):
-                L.warning("Weights don't sum up to 1.0 for %s; renormalizing them", str(value))
-                probs = probs / np.sum(probs)
-            result[prop] = np.random.choice(values, size=len(pos), p=probs)
-        else:
-            result[prop] = value
-
-    L.info("%s... [%d cells]", conf["traits"], len(result))
-    return result
 
+def _parse_shard(value):
+    """Returns the (index, count) pair of a 'i/N' shard, with 0 <= i < N."""
+    try:
+        index, count = (int(v) for v in value.split("/"))
+    except ValueError as e:
+        raise BrainBuilderError(f"Invalid shard: '{value}', expected 'i/N'") from e
+    if not 0 <= index < count:
+        raise BrainBuilderError(f"Invalid shard: '{value}', expected 0 <= i < N")
+    return index, count
 
-def _assign_subregions(cells, brain_regions, region_map):
-    cell_coordinates = cells[["x", "y", "z"]].to_numpy()
-    subregion_index = brain_regions.lookup(cell_coordinates)
-    subregion_index_to_acronym = region_map.as_dataframe()["acronym"]
-    _assign_property(cells, "subregion", subregion_index_to_acronym[subregion_index].to_numpy())
 
+def _load_variants(variant_pairs=(), sweep_path=None):
+    """Returns the (seed, density_factor) pairs of the variants of a placement.
 
-def _assign_property(cells, prop, values):
-    if prop in cells:
-        raise BrainBuilderError(f"Duplicate property: '{prop}'")
-    cells[prop] = values
-
-
-def _assign_mtype_traits(cells, mtype_taxonomy):
-    traits = mtype_taxonomy.loc[cells["mtype"]]
-    _assign_property(cells, "morph_class", traits["mClass"].values)
-    _assign_property(cells, "synapse_class", traits["sClass"].values)
-
+    Args:
+        variant_pairs: (seed, density_factor) pairs
+        sweep_path: optional YAML sweep spec, with the values of `seed` and of `density_factor`
+            (a value or a list of values each); all their combinations are variants
 
-def _assign_mini_frequencies(cells, mini_frequencies):
-    """
-    Add the mini_frequency column to `cells`.
+    Raises:
+        BrainBuilderError if the sweep spec is invalid.
     """
-    if "layer" in cells:
-        idx = cells.layer.to_numpy()
-    else:
-        # fallback to subregion; this requires that the mini_frequencies file uses subregions,
-        # and not layer names
-        idx = cells.subregion.to_numpy()
-
-    mfreqs_cells = mini_frequencies.loc[idx]
-
-    _assign_property(cells, "exc_mini_frequency", mfreqs_cells.exc_mini_frequency.to_numpy())
-    _assign_property(cells, "inh_mini_frequency", mfreqs_cells.inh_mini_frequency.to_numpy())
-
-
-def _assign_atlas_property(cells, prop, atlas, dset):
-    xyz = cells[["x", "y", "z"]].values
-    if dset == "FAST-HEMISPHERE":
-        # TODO: remove as soon as "slow" way of assigning hemisphere
-        # (with a volumetric dataset) is available
-        deprecate.warn("`FAST-HEMISPHERE` is deprecated, use a volumetric dataset")
-        values = np.where(xyz[:, 2] < 5700, "left", "right")
-    elif prop == "hemisphere":
-        values = values_to_hemisphere(atlas.load_data(dset).lookup(xyz))
-    elif dset.startswith("~"):
-        dset = dset[1:]
-        values = values_to_region_attribute(
-            atlas.load_data(dset).lookup(xyz),
-            region_map=atlas.load_region_map(),
-            attr="acronym",
+    result = [(int(seed), float(density_factor)) for seed, density_factor in variant_pairs]
+    if sweep_path is not None:
+        sweep = load_yaml(sweep_path)
+        if not isinstance(sweep, Mapping) or set(sweep) - {"seed", "density_factor"}:
+            raise BrainBuilderError(
+                f"Invalid sweep spec: {sweep_path}, expected 'seed' and 'density_factor' values"
+            )
+        seeds, density_factors = (
+            value if isinstance(value, list) else [value]
+            for value in (sweep.get("seed", 0), sweep.get("density_factor", 1.0))
         )
-    else:
-        values = atlas.load_data(dset).lookup(xyz)
-
-    _assign_property(cells, prop, values)
-
-
-def _place(
-    input_path,
-    composition_path,
-    mtype_taxonomy_path,
-    atlas_url,
-    mini_frequencies_path=None,
-    atlas_cache=None,
-    region=None,
-    mask_dset=None,
-    soma_placement="basic",
-    density_factor=1.0,
-    atlas_properties=None,
-    sort_by=None,
-    append_hemisphere=False,
-):
-    # pylint: disable=too-many-arguments, too-many-locals
-    atlas = Atlas.open(atlas_url, cache_dir=atlas_cache)
-
-    recipe = load_cell_composition(composition_path)
-    mtype_taxonomy = load_mtype_taxonomy(mtype_taxonomy_path)
-
-    # Cache frequently used atlas data
-    atlas.load_data("brain_regions", memcache=True)
-    atlas.load_region_map(memcache=True)
-
-    if mask_dset is None:
-        root_mask = None
-    else:
-        root_mask = atlas.load_data(mask_dset, cls=ROIMask)
-
-    if region is not None:
-        region_mask = atlas.get_region_mask(region, with_descendants=True)
-        if root_mask is None:
-            root_mask = region_mask
-        else:
-            root_mask.raw &= region_mask.raw
-
-    L.info("Creating cell groups...")
-    groups = [
-        _create_cell_group(conf, atlas, root_mask, density_factor, soma_placement)
-        for conf in recipe["neurons"]
-    ]
-
-    L.info("Merging into single CellCollection...")
-    result = pd.concat(groups)
-
-    L.info("Total cell count: %d", len(result))
-
-    L.info("Assigning 'subregion'")
-    _assign_subregions(
-        result,
-        atlas.load_data("brain_regions"),
-        atlas.load_region_map(),
-    )
-
-    L.info("Assigning 'morph_class' / 'synapse_class'...")
-    _assign_mtype_traits(result, mtype_taxonomy)
-
-    if mini_frequencies_path is not None:
-        mini_frequencies = load_mini_frequencies(mini_frequencies_path)
-        L.info("Assigning mini-frequencies")
-        _assign_mini_frequencies(result, mini_frequencies)
-
-    for prop, dset in atlas_properties or []:
-        L.info("Assigning '%s'...", prop)
-        _assign_atlas_property(result, prop, atlas, dset)
-
-    if append_hemisphere:
-        result["region"] = result["region"] + "@" + result["hemisphere"]
-
-    if sort_by:
-        L.info("Sorting CellCollection...")
-        result.sort_values(sort_by, inplace=True)
-
-    L.info("Done!")
-
-    result.index = 1 + np.arange(len(result))
-    if input_path is None:
-        return CellCollection.from_dataframe(result)
-    input_cells = CellCollection.load(input_path)
-    out_cells = CellCollection.from_dataframe(pd.concat([input_cells.as_dataframe(), result]))
-    out_cells.population_name = input_cells.population_name
-    return out_cells
+        result.extend(
+            (int(seed), float(density_factor))
+            for seed in seeds
+            for density_factor in density_factors
+        )
+    return result
 
 
 @app.command(short_help="Initialize cell collection")
@@ -332,11 +179,74 @@ def init(population_name, output):
 @click.option(
     "--atlas-property", type=(str, str), multiple=True, help="Property based on atlas dataset"
 )
-@click.option("--sort-by", help="Sort by properties (comma-separated)", default=None)
+@click.option(
+    "--sort-by",
+    help="Sort by properties (comma-separated); 'hilbert' / 'morton' sort by the index of the"
+    " voxel of the cells along this space-filling curve, which is recorded as a property",
+    default=None,
+)
 @click.option(
     "--append-hemisphere", is_flag=True, help="Append hemisphere to region name", default=False
 )
 @click.option("--seed", help="Pseudo-random generator seed", type=int, default=0, show_default=True)
+@click.option(
+    "--jobs",
+    help="Number of processes placing the cell groups in parallel (-1: all CPUs)",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--density-dtype",
+    help="Load the density volumes with this dtype (default: the dtype of their file)",
+    type=click.Choice(["float32", "float64"]),
+    default=None,
+)
+@click.option(
+    "--mmap-densities",
+    is_flag=True,
+    help="Memory-map the uncompressed NRRD density volumes instead of loading them",
+    default=False,
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report the expected cell count, memory and runtime of each group, without"
+    " placing the cells nor writing the output",
+    default=False,
+)
+@click.option(
+    "--shard",
+    help="Only place the cell groups of shard 'i/N' (0 <= i < N), balanced by expected cell"
+    " count, into a partial SONATA file; see `merge-shards`",
+    default=None,
+)
+@click.option(
+    "--variant",
+    type=(int, float),
+    multiple=True,
+    help="(seed, density factor) of a variant of the placement, replacing --seed and"
+    " --density-factor; the atlas and the densities are loaded once for all the variants,"
+    " written to the --output path formatted with their {seed} and {density_factor}",
+)
+@click.option(
+    "--sweep",
+    help="YAML sweep spec of the variants of the placement: all the combinations of its 'seed'"
+    " and 'density_factor' values (see --variant)",
+    default=None,
+)
+@click.option(
+    "--cell-group-cache",
+    help="Directory caching the cells of the groups; unchanged groups are not placed again",
+    default=None,
+)
+@click.option(
+    "--cell-group-cache-size",
+    help="Maximum size of the cell group cache in MB, the least recently used groups are evicted",
+    type=int,
+    default=DEFAULT_MAX_SIZE >> 20,
+    show_default=True,
+)
 @click.option(
     "-o",
     "--output",
@@ -364,6 +274,15 @@ def place_cli(
     sort_by,
     append_hemisphere,
     seed,
+    jobs,
+    density_dtype,
+    mmap_densities,
+    dry_run,
+    shard,
+    variant,
+    sweep,
+    cell_group_cache,
+    cell_group_cache_size,
     output,
     input_path,
 ):
@@ -385,6 +304,15 @@ def place_cli(
         seed,
         output,
         input_path,
+        jobs=jobs,
+        density_dtype=density_dtype,
+        mmap_densities=mmap_densities,
+        cell_group_cache=cell_group_cache,
+        cell_group_cache_size=cell_group_cache_size << 20,
+        dry_run=dry_run,
+        shard=shard,
+        variants=variant,
+        sweep=sweep,
     )
 
 
@@ -404,34 +332,136 @@ def place(
     seed,
     output,
     input_path,
+    jobs=1,
+    density_dtype=None,
+    mmap_densities=False,
+    cell_group_cache=None,
+    cell_group_cache_size=DEFAULT_MAX_SIZE,
+    dry_run=False,
+    shard=None,
+    variants=(),
+    sweep=None,
 ):
-    """Places new cells into an existing cells or creates new cells if no existing were provided."""
+    """Places new cells into an existing cells or creates new cells if no existing were provided.
+
+    Every cell group of the composition has its own random generator, spawned from `seed`:
+    the result is the same whatever the number of parallel `jobs`.
+
+    Without `sort_by`, the SONATA output is written batch of cell groups by batch: the cells are
+    never all held in memory.
+
+    Every density volume is loaded once, whatever the number of groups using it; its memory
+    footprint can be reduced with `density_dtype` (e.g. float32) or `mmap_densities`.
+
+    With a `cell_group_cache` directory, the groups whose definition, voxels, densities and
+    random generator did not change since a previous run are read from it instead of being
+    placed again; it is limited to `cell_group_cache_size` bytes.
+
+    With `dry_run`, the cell count, memory and runtime of every group are estimated on the atlas
+    and reported, and nothing is written.
+
+    With a 'i/N' `shard`, only the groups of this shard are placed into a partial SONATA file;
+    the N partial files are merged by `merge-shards` into the output of a single placement.
+
+    With `variants` (seed, density_factor) pairs or the combinations of the values of a
+    `sweep` spec, one SONATA output is written per variant, at the `output` path formatted with
+    its `seed` and `density_factor`; the atlas, the recipe and the densities are loaded and
+    indexed once, and the voxels and the densities of each group are gathered once.
+    """
     # pylint: disable=too-many-arguments, too-many-locals
-    np.random.seed(seed)
+    if dry_run:
+        groups, total = placement.estimate_placement(
+            composition,
+            atlas,
+            atlas_cache=atlas_cache,
+            region=region,
+            mask_dset=mask,
+            soma_placement=soma_placement,
+            density_factor=density_factor,
+            jobs=jobs,
+            density_dtype=density_dtype,
+            mmap_densities=mmap_densities,
+        )
+        groups = groups.assign(memory=groups["memory"] / 2**20)
+        click.echo(
+            groups.rename(columns={"memory": "memory_mb", "runtime": "runtime_s"}).to_string()
+        )
+        click.echo(
+            f"Total: {total['cell_count']} cells, peak memory ~{total['memory'] / 2**20:.1f} MB, "
+            f"runtime ~{total['runtime']:.1f} s ({soma_placement} soma placement)"
+        )
+        return
 
     if sort_by is not None:
         sort_by = sort_by.split(",")
 
-    cells = _place(
-        input_path,
-        composition,
-        mtype_taxonomy,
-        atlas,
-        mini_frequencies_path=mini_frequencies,
-        atlas_cache=atlas_cache,
-        region=region,
-        mask_dset=mask,
-        density_factor=density_factor,
-        soma_placement=soma_placement,
-        atlas_properties=atlas_property,
-        sort_by=sort_by,
-        append_hemisphere=append_hemisphere,
-    )
+    kwargs = {
+        "composition_path": composition,
+        "mtype_taxonomy_path": mtype_taxonomy,
+        "atlas_url": atlas,
+        "mini_frequencies_path": mini_frequencies,
+        "atlas_cache": atlas_cache,
+        "region": region,
+        "mask_dset": mask,
+        "density_factor": density_factor,
+        "soma_placement": soma_placement,
+        "atlas_properties": atlas_property,
+        "append_hemisphere": append_hemisphere,
+        "seed": seed,
+        "jobs": jobs,
+        "density_dtype": density_dtype,
+        "mmap_densities": mmap_densities,
+        "cache_dir": cell_group_cache,
+        "cache_max_size": cell_group_cache_size,
+    }
+
+    variants = _load_variants(variants, sweep)
+    if variants:
+        if sort_by is not None or shard is not None or _is_mvd3(output) or _is_mvd3(input_path):
+            raise BrainBuilderError(
+                "Variants are streamed to SONATA files, they cannot be sorted nor sharded"
+            )
+        del kwargs["seed"], kwargs["density_factor"]
+        placement.place_variants_to_sonata(output, variants, input_path=input_path, **kwargs)
+        return
+
+    if shard is not None:
+        if sort_by is not None or input_path is not None or _is_mvd3(output):
+            raise BrainBuilderError(
+                "Shards are partial SONATA files, they cannot be sorted nor extend input cells"
+            )
+        L.info("Placing shard %s to %s", shard, output)
+        placement.place_to_sonata(output, shard=_parse_shard(shard), **kwargs)
+        return
+
+    if sort_by is None and not _is_mvd3(output) and not _is_mvd3(input_path):
+        L.info("Streaming to %s", output)
+        placement.place_to_sonata(output, input_path=input_path, **kwargs)
+        return
+
+    cells = placement.place(input_path, sort_by=sort_by, **kwargs)
 
     L.info("Export to %s", output)
     cells.save(output)
 
 
+@app.command(short_help="Merge the shards of cells place", name="merge-shards")
+@click.argument("shard_paths", nargs=-1, required=True)
+@click.option("-o", "--output", help="Path to output SONATA", required=True)
+@click.option(
+    "--input",
+    "input_path",
+    default=None,
+    help="Existing cells which are extended with the merged cells",
+)
+def merge_shards(shard_paths, output, input_path):
+    """Merges the partial SONATA files of all the shards of `cells place --shard`.
+
+    The cells are ordered as if all the groups were placed by a single `cells place`.
+    """
+    placement.merge_shards(shard_paths, output, input_path=input_path)
+
+
 @app.command()
 @click.argument("cells-path")
 @click.option("--morphdb", help="Path to extNeuronDB.dat", required=True)
@@ -445,15 +475,112 @@ def place(
 )
 def assign_emodels(cells_path, morphdb, seed, output):
     """Assign 'me_combo' property"""
-    np.random.seed(seed)
-
     cells = CellCollection.load(cells_path)
     morphdb = bbp.load_extneurondb(morphdb)
-    result = bbp.assign_emodels(cells, morphdb)
+    result = bbp.assign_emodels(cells, morphdb, rng=np.random.default_rng(seed))
 
     result.save(output)
 
 
+def _make_atlas_cells(positions, orientations, region_ids, cell_type, cell_types):
+    """Helper function that returns the DataFrame of a chunk of `positions-and-orientations` cells.
+
+    The `cell_type` is categorical, with all the `cell_types` as categories.
+    """
+    result = pd.DataFrame(
+        np.hstack([positions, orientations]).astype(np.float32),
+        columns=[
+            "x",
+            "y",
+            "z",
+            # We assume quaternions to be under the form [w, x, y, z]
+            "orientation_w",
+            "orientation_x",
+            "orientation_y",
+            "orientation_z",
+        ],
+    )
+    result["region_id"] = region_ids
+    result["cell_type"] = make_categorical(
+        np.full(len(result), cell_types.index(cell_type)), cell_types
+    )
+    return result
+
+
+def _iter_atlas_cells(cell_type, density_path, annotation, orientation, cell_types, rng):
+    """Generates the cells of a cell type of `positions-and-orientations`, in chunks of about
+    `ATLAS_CELLS_CHUNK_SIZE` cells (see `iter_cell_positions`).
+
+    Yields:
+        DataFrames of the cells of each chunk, see `_make_atlas_cells`.
+
+    Raises:
+        BrainBuilderError if the density volume is not in the frame of the annotation volume.
+    """
+    # pylint: disable=too-many-arguments
+    L.info("Loading density file %s ...", density_path)
+    density_voxel_data = VoxelData.load_nrrd(density_path)
+    if not np.allclose(density_voxel_data.offset, annotation.offset):
+        raise BrainBuilderError(
+            f"The input density file {density_path} and the input annotation file "
+            f"have different offsets: {density_voxel_data.offset} != {annotation.offset}"
+        )
+    if not np.allclose(density_voxel_data.voxel_dimensions, annotation.voxel_dimensions):
+        raise BrainBuilderError(
+            f"The input density file {density_path} and the input annotation file "
+            f"have different voxel dimensions: "
+            f"{density_voxel_data.voxel_dimensions} != {annotation.voxel_dimensions}"
+        )
+
+    # Microglia cell density can take negative values, see
+    # https://bbpteam.epfl.ch/project/issues/browse/NSETM-1260.
+    # As a temporary fix, negative values are zeroed. Hence -S extra cells
+    # are created where S is the sum of negative values.
+    # TODO: implement a long term solution in atlas-building-tools
+    negative_mask = density_voxel_data.raw < 0.0
+    if np.any(negative_mask):
+        L.warning(
+            "Negative density values in %s summing up to %f. Zeroing negative values.",
+            density_path,
+            np.sum(density_voxel_data.raw[negative_mask]),
+        )
+        density_voxel_data.raw[negative_mask] = 0.0
+    del negative_mask
+
+    L.info('Creating cell positions for the cell type "%s" ...', cell_type)
+    yield _make_atlas_cells(
+        np.empty((0, 3)),
+        np.empty((0, 4)),
+        np.empty(0, dtype=annotation.raw.dtype),
+        cell_type,
+        cell_types,
+    )
+    for positions, voxels in iter_cell_positions(
+        density_voxel_data, chunk_size=ATLAS_CELLS_CHUNK_SIZE, rng=rng, return_voxels=True
+    ):
+        voxel_indices = np.unravel_index(voxels, density_voxel_data.shape)
+        yield _make_atlas_cells(
+            positions,
+            orientation.raw[voxel_indices],
+            annotation.raw[voxel_indices],
+            cell_type,
+            cell_types,
+        )
+
+
+def _save_atlas_cells(filepath, *args):
+    """Helper function that writes the cells of a cell type (see `_iter_atlas_cells`) to the
+    SONATA file `filepath`, chunk by chunk.
+
+    Returns:
+        `filepath`
+    """
+    with NodePopulationWriter(filepath, "atlas_cells") as writer:
+        for cells in _iter_atlas_cells(*args):
+            writer.append(cells)
+    return filepath
+
+
 @app.command(
     short_help="Generate cell positions and save them together with orientations,"
     " region annotations and cell types"
@@ -501,7 +628,17 @@ def assign_emodels(cells_path, morphdb, seed, output):
     required=True,
     help="Path where to write the cell positions and orientations (a single sonata .h5 file).",
 )
-def positions_and_orientations(annotation_path, orientation_path, config_path, output_path):
+@click.option("--seed", help="Pseudo-random generator seed", type=int, default=0, show_default=True)
+@click.option(
+    "--jobs",
+    help="Number of processes generating the cell types in parallel (-1: all CPUs)",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def positions_and_orientations(
+    annotation_path, orientation_path, config_path, output_path, seed, jobs
+):
     """Generate 3D cell positions and store the corresponding cell orientations.\n
 
     See https://bbpteam.epfl.ch/project/issues/browse/BBPP82-499 for the full context.
@@ -510,13 +647,15 @@ def positions_and_orientations(annotation_path, orientation_path, config_path, o
     - the BBP web Cell Atlas (https://bbpcode.epfl.ch/code/#/admin/projects/nexus/cell-atlas)\n
     - the point neuron whole brain workflow\n
 
-    Cell positions of the form (x, y, z) are generated by means of an acceptance-rejection method
-    based on prescribed cell densities.
-    The algorithm is described in the section "Computing Cell Positions" of
+    Cell positions of the form (x, y, z) are generated based on prescribed cell densities,
+    as described in the section "Computing Cell Positions" of
     "A Cell Atlas for the Mouse Brain" by C. Eroe et al. (2018),
     https://www.frontiersin.org/articles/10.3389/fninf.2018.00084/full.
-    See np.random.choice and its p parameter for its implementation:
-    https://docs.scipy.org/doc//numpy-1.10.4/reference/generated/numpy.random.choice.html\n
+    The cell counts of the voxels are drawn from a multinomial distribution, then the float32
+    positions are generated and written chunk by chunk (see
+    brainbuilder.cell_positions.iter_cell_positions), so that the cells of a whole brain are
+    never all held in memory. Every cell type has its own random generator spawned from `seed`,
+    and the cell types are generated in `jobs` parallel processes.\n
 
 
     The inputs are:
@@ -622,82 +761,46 @@ def positions_and_orientations(annotation_path, orientation_path, config_path, o
         annotation.voxel_dimensions, orientation.voxel_dimensions
     ), "The annotation and orientation files have different voxel dimensions."
 
-    # The columns to be populated
-    positions = []
-    orientations = []
-    region_ids = []
-    cell_types = []
-
-    for cell_type, density_path in config["inputDensityVolumePath"].items():
-        L.info("Loading density file %s ...", density_path)
-        density_voxel_data = VoxelData.load_nrrd(density_path)
-        if not np.allclose(density_voxel_data.offset, annotation.offset):
-            raise BrainBuilderError(
-                f"The input density file {density_path} and the input annotation file "
-                f"{annotation_path} have different offsets: "
-                f"{density_voxel_data.offset} != {annotation.offset}"
-            )
-        if not np.allclose(density_voxel_data.voxel_dimensions, annotation.voxel_dimensions):
-            raise BrainBuilderError(
-                f"The input density file {density_path} and the input annotation file "
-                f"{annotation_path} have different voxel dimensions: "
-                f"{density_voxel_data.voxel_dimensions} != {annotation.voxel_dimensions}"
-            )
-
-        # Microglia cell density can take negative values, see
-        # https://bbpteam.epfl.ch/project/issues/browse/NSETM-1260.
-        # As a temporary fix, negative values are zeroed. Hence -S extra cells
-        # are created where S is the sum of negative values.
-        # TODO: implement a long term solution in atlas-building-tools
-        negative_mask = density_voxel_data.raw < 0.0
-        if np.any(negative_mask):
-            L.warning(
-                "Negative density values in %s summing up to %f. Zeroing negative values.",
-                density_path,
-                np.sum(density_voxel_data.raw[negative_mask]),
-            )
-            density_voxel_data.raw[negative_mask] = 0.0
-
-        L.info('Creating cell positions for the cell type "%s" ...', cell_type)
-        positions_ = create_cell_positions(density_voxel_data, seed=0)
-        positions.append(positions_)
-
-        L.info('Retrieving voxel indices for the cell type "%s\n" ...', cell_type)
-        voxel_indices = annotation.positions_to_indices(positions_)
-        voxel_indices = tuple(voxel_indices.T)
-        orientations.append(orientation.raw[voxel_indices])
-        region_ids.append(annotation.raw[voxel_indices])
-        cell_types += [cell_type] * len(voxel_indices[0])
-
-    L.info(
-        "Creation of the cell collection dataframe."
-        " \n Setting positions, orientations, region ids and cell types ..."
-    )
-    datasets = np.hstack(
-        [
-            np.asarray(np.concatenate(positions), dtype=np.float32),
-            np.asarray(np.concatenate(orientations), dtype=np.float32),
-        ]
-    )
-    df = pd.DataFrame(
-        datasets,
-        columns=[
-            "x",
-            "y",
-            "z",
-            # We assume quaternions to be under the form [w, x, y, z]
-            "orientation_w",
-            "orientation_x",
-            "orientation_y",
-            "orientation_z",
-        ],
-    )
-    df["region_id"] = np.concatenate(region_ids)
-    df["cell_type"] = cell_types
-    df.index = 1 + np.arange(len(df))  # CellCollection has a 1-based index
-    L.info("Building a voxcell.CellCollection ...")
-    cells = CellCollection.from_dataframe(df)
-    cells.population_name = "atlas_cells"
+    cell_types = sorted(config["inputDensityVolumePath"])
+    # every cell type has its own generator, whatever the number of processes; the paths are
+    # absolute, the workers do not share the working directory of the main process
+    args = [
+        (
+            cell_type,
+            str(Path(density_path).absolute()),
+            annotation,
+            orientation,
+            cell_types,
+            np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i,))),
+        )
+        for i, (cell_type, density_path) in enumerate(config["inputDensityVolumePath"].items())
+    ]
 
     L.info("Saving %s to sonata format ...", output_path)
-    cells.save_sonata(output_path)
+    with NodePopulationWriter(output_path, "atlas_cells") as writer:
+        if jobs == 1:
+            for args_ in args:
+                for cells in _iter_atlas_cells(*args_):
+                    writer.append(cells)
+            return
+
+        # the cells of every type are written to a temporary file by their worker, and copied
+        # to the output in config order, chunk by chunk
+        with tempfile.TemporaryDirectory(
+            prefix="brainbuilder-", dir=Path(output_path).absolute().parent
+        ) as tmpdir, shared_arrays((annotation, "raw"), (orientation, "raw")):
+            filepaths = Parallel(n_jobs=jobs, backend="loky", return_as="generator")(
+                delayed(_save_atlas_cells)(Path(tmpdir, f"{i}.h5"), *args_)
+                for i, args_ in enumerate(args)
+            )
+            for filepath in filepaths:
+                with h5py.File(filepath, "r") as h5f:
+                    population = h5f["nodes/atlas_cells"]
+                    libraries = load_libraries(population)
+                    size = len(population["node_type_id"])
+                    # the output datasets are created even if there are no cells at all
+                    writer.append(read_cells(population, 0, 0, libraries))
+                    for start in range(0, size, ATLAS_CELLS_CHUNK_SIZE):
+                        stop = min(start + ATLAS_CELLS_CHUNK_SIZE, size)
+                        writer.append(read_cells(population, start, stop, libraries))
+                Path(filepath).unlink()
@@ -9,6 +9,7 @@ import numpy as np
 import pandas as pd
 from voxcell import CellCollection, VoxelData
 
+from brainbuilder.atlas_lookup import AtlasLookup
 from brainbuilder.utils import bbp
 
 
@@ -44,7 +45,7 @@ def add_property(mvd3, prop, voxel_data, output):
         if choice.lower() not in ("y", "yes"):
             return
     voxel_data = VoxelData.load_nrrd(voxel_data)
-    cells.properties[prop] = voxel_data.lookup(cells.positions)
+    cells.properties[prop] = AtlasLookup(cells.positions).lookup(voxel_data)
     cells.save_mvd3(output)
 
 
@@ -9,6 +9,7 @@ import voxcell
 
 import brainbuilder
 import brainbuilder.targets
+from brainbuilder.atlas_lookup import AtlasLookup
 from brainbuilder.exceptions import BrainBuilderError
 from brainbuilder.utils import bbp, dump_json
 
@@ -79,9 +80,9 @@ def from_input(cells_path, atlas, atlas_cache, targets, allow_empty, output):
                 write_query_targets(query_based, circuit, f, allow_empty=allow_empty)
             if atlas_based is not None:
                 atlas = brainbuilder.targets.load_atlas(atlas, atlas_cache)
-                xyz = cells[["x", "y", "z"]].to_numpy()
+                atlas_lookup = AtlasLookup(cells[["x", "y", "z"]].to_numpy(), atlas)
                 for name, dset in atlas_based.items():
-                    mask = atlas.load_data(dset, cls=voxcell.ROIMask).lookup(xyz)
+                    mask = atlas_lookup.lookup(dset, cls=voxcell.ROIMask)
                     bbp.write_target(f, name, cells.index[mask])
 
 
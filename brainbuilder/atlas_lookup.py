@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Lookup of atlas values at the positions of cells."""
+
+import numpy as np
+import pandas as pd
+from voxcell import VoxelData
+
+from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.utils import make_categorical
+
+# number of positions converted to voxel indices at once
+LOOKUP_CHUNK_SIZE = 1000000
+
+HEMISPHERES = ("undefined", "left", "right")
+
+
+def get_region_attribute_table(region_map, attr="acronym"):
+    """Returns the table mapping the region ids of a hierarchy to one of their attributes.
+
+    Returns:
+        tuple of the sorted region ids, of the attribute code of each of them, and of the
+        attribute values.
+    """
+    values = region_map.as_dataframe()[attr]
+    order = np.argsort(values.index.to_numpy(), kind="stable")
+    codes, categories = pd.factorize(values.to_numpy()[order])
+    return values.index.to_numpy()[order], codes, categories
+
+
+def region_ids_to_attribute(ids, table):
+    """Returns the categorical of the region attribute of the given region ids.
+
+    Args:
+        ids: numpy array of region ids
+        table: see `get_region_attribute_table`
+
+    Raises:
+        BrainBuilderError if some ids are not in the hierarchy.
+    """
+    region_ids, codes, categories = table
+    pos = np.minimum(np.searchsorted(region_ids, ids), len(region_ids) - 1)
+    missing = region_ids[pos] != ids
+    if np.any(missing):
+        raise BrainBuilderError(f"Region ids not in the hierarchy: {np.unique(ids[missing])}")
+    return make_categorical(codes[pos], categories).remove_unused_categories()
+
+
+class AtlasLookup:
+    """Values of atlas datasets at the positions of cells.
+
+    The voxel indices of the positions are computed once for all the datasets with the same
+    voxel geometry (as the datasets of an atlas usually are), chunk by chunk; every dataset is
+    then gathered from them. Region attributes are mapped through tables of the hierarchy
+    instead of cell by cell.
+    """
+
+    def __init__(self, positions, atlas=None, chunk_size=LOOKUP_CHUNK_SIZE):
+        """Constructor
+
+        Args:
+            positions: numpy array of the (x, y, z) positions of the cells
+            atlas: optional Atlas the datasets given by name are loaded from
+            chunk_size: number of positions converted to voxel indices at once
+        """
+        self.positions = positions
+        self.atlas = atlas
+        self.chunk_size = chunk_size
+        self._indices = {}
+        self._datasets = {}
+        self._tables = {}
+
+    def with_positions(self, positions):
+        """Returns the lookup of other positions, sharing the datasets and the region tables
+        loaded by this one."""
+        result = AtlasLookup(positions, self.atlas, chunk_size=self.chunk_size)
+        result._datasets = self._datasets  # pylint: disable=protected-access
+        result._tables = self._tables  # pylint: disable=protected-access
+        return result
+
+    def get_voxel_data(self, dataset, cls=VoxelData):
+        """Returns the VoxelData of `dataset`, loaded from the atlas once if it is a name."""
+        if isinstance(dataset, VoxelData):
+            return dataset
+        if (dataset, cls) not in self._datasets:
+            self._datasets[dataset, cls] = self.atlas.load_data(dataset, cls=cls)
+        return self._datasets[dataset, cls]
+
+    def get_indices(self, voxel_data):
+        """Returns the (i, j, k) index arrays of the voxels of the positions in `voxel_data`.
+
+        Raises:
+            VoxcellError if some positions are out of bounds.
+        """
+        key = (voxel_data.shape, tuple(voxel_data.voxel_dimensions), tuple(voxel_data.offset))
+        if key not in self._indices:
+            result = np.empty((voxel_data.ndim, len(self.positions)), dtype=np.int32)
+            for start in range(0, len(self.positions), self.chunk_size):
+                ijk = voxel_data.positions_to_indices(
+                    self.positions[start : start + self.chunk_size]
+                )
+                result[:, start : start + len(ijk)] = ijk.T
+            self._indices[key] = tuple(result)
+        return self._indices[key]
+
+    def lookup(self, dataset, cls=VoxelData):
+        """Returns the values of `dataset` (VoxelData or atlas dataset name) at the positions."""
+        voxel_data = self.get_voxel_data(dataset, cls=cls)
+        return voxel_data.raw[self.get_indices(voxel_data)]
+
+    def lookup_region_attribute(self, dataset, attr="acronym", region_map=None):
+        """Returns the categorical of the region attribute at the positions of the region ids
+        of `dataset` (e.g. 'brain_regions').
+
+        Args:
+            dataset: VoxelData or atlas dataset name of region ids
+            attr: region attribute
+            region_map: hierarchy of the regions (default: the one of the atlas, whose tables
+                are kept)
+        """
+        if region_map is not None:
+            table = get_region_attribute_table(region_map, attr)
+        else:
+            if attr not in self._tables:
+                self._tables[attr] = get_region_attribute_table(self.atlas.load_region_map(), attr)
+            table = self._tables[attr]
+        return region_ids_to_attribute(self.lookup(dataset), table)
+
+    def lookup_hemisphere(self, dataset):
+        """Returns the categorical of the hemisphere at the positions of the values 0, 1, 2
+        (undefined, left, right) of `dataset`."""
+        values = self.lookup(dataset)
+        if np.any((values < 0) | (values >= len(HEMISPHERES))):
+            raise BrainBuilderError(f"Invalid hemisphere values, only {[0, 1, 2]} are allowed")
+        return make_categorical(values.astype(np.int64), HEMISPHERES).remove_unused_categories()
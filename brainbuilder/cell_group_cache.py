@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: Apache-2.0
+"""On-disk cache of the cells of the cell groups of a recipe."""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from brainbuilder.utils import make_categorical
+
+L = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 1024**3
+
+
+def _save_cells(filepath, cells):
+    """Helper function that saves the columns of `cells` to a NumPy .npz file, the categorical
+    columns as codes and categories.
+
+    Returns:
+        False if some columns cannot be saved (e.g. mixed object values), True otherwise.
+    """
+    arrays = {"columns": np.array(cells.columns, dtype=str)}
+    for i, (name, series) in enumerate(cells.items()):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[f"{i}.codes"] = series.cat.codes.to_numpy()
+            arrays[f"{i}.categories"] = np.array(series.cat.categories, dtype=str)
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            arrays[str(i)] = series.to_numpy()
+        else:
+            L.debug("Cannot cache the '%s' values of '%s'", series.dtype, name)
+            return False
+
+    # the file is written under a temporary name first, so that it is never read half-written
+    with tempfile.NamedTemporaryFile(dir=filepath.parent, suffix=".tmp", delete=False) as fd:
+        np.savez(fd, **arrays)
+    os.replace(fd.name, filepath)
+    return True
+
+
+def _load_cells(filepath):
+    """Helper function that loads the cells saved by `_save_cells`."""
+    with np.load(filepath, allow_pickle=False) as data:
+        columns = {}
+        for i, name in enumerate(data["columns"]):
+            if f"{i}.codes" in data:
+                columns[name] = make_categorical(data[f"{i}.codes"], data[f"{i}.categories"])
+            else:
+                columns[name] = data[str(i)]
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(next(iter(columns.values()), []))))
+
+
+class CellGroupCache:
+    """Directory of the cells of cell groups, keyed by a hash of everything they depend on.
+
+    Every entry is a columnar NumPy .npz file; when the total size of the entries exceeds
+    `max_size`, the least recently used ones are evicted (see `evict`).
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """Constructor
+
+        Args:
+            directory(str|Path): cache directory, created if needed
+            max_size(int): maximum total size of the entries, in bytes
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def _get_path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def __contains__(self, key):
+        filepath = self._get_path(key)
+        if not filepath.exists():
+            return False
+        # mark the entry as recently used
+        os.utime(filepath)
+        return True
+
+    def get(self, key):
+        """Returns the DataFrame of the cells of `key`, None if they are not cached."""
+        filepath = self._get_path(key)
+        try:
+            result = _load_cells(filepath)
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(filepath)
+        return result
+
+    def put(self, key, cells):
+        """Stores the DataFrame of the cells of `key`."""
+        _save_cells(self._get_path(key), cells)
+
+    def evict(self):
+        """Removes the least recently used entries until their total size is below `max_size`.
+
+        Returns:
+            the number of removed entries.
+        """
+        entries = []
+        for filepath in self.directory.glob("*.npz"):
+            try:
+                stat = filepath.stat()
+            except FileNotFoundError:  # pragma: no cover
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+        entries.sort()
+
+        total_size = sum(size for _, size, _ in entries)
+        count = 0
+        for _, size, filepath in entries:
+            if total_size <= self.max_size:
+                break
+            filepath.unlink(missing_ok=True)
+            total_size -= size
+            count += 1
+        if count:
+            L.info("Evicted %d cell groups from the cache", count)
+        return count
@@ -0,0 +1,709 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Creation of the cells of the cell groups of a recipe, in batches and in parallel."""
+
+import hashlib
+import json
+import logging
+import numbers
+import zlib
+from collections import Counter
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+
+from brainbuilder import __version__, poisson_disc_sampling
+from brainbuilder.cell_positions import create_cell_positions
+from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.utils import make_categorical, shared_arrays
+from brainbuilder.utils.random import get_rng
+
+L = logging.getLogger(__name__)
+
+# rough cost of placing one cell with each soma placement method, in seconds on a single core,
+# and of gathering the density of one voxel of a cell group; see `_estimate_cell_group`
+PLACEMENT_SECONDS_PER_CELL = {
+    "basic": 5e-7,
+    "multinomial": 4e-7,
+    "stratified": 7e-7,
+    "poisson_disc": 3e-3,
+    "poisson_disc_vectorized": 4e-4,
+    "poisson_disc_adaptive": 2e-3,
+    "poisson_disc_parallel": 4e-4,
+    "poisson_disc_pattern": 4e-4,
+}
+PLACEMENT_SECONDS_PER_VOXEL = 5e-8
+
+# maximum number of cell groups created at once, see `iter_cell_groups`
+CELL_GROUP_BATCH_SIZE = 256
+
+
+def _get_trait_distribution(value):
+    """Helper function that returns the values of a trait of a cell group, with their
+    probabilities (None for a constant trait)."""
+    if not isinstance(value, Mapping):
+        return [value], None
+    values, probs = zip(*value.items())
+    if not np.allclose(np.sum(probs), 1.0):
+        L.warning("Weights don't sum up to 1.0 for %s; renormalizing them", str(value))
+    return list(values), np.asarray(probs, dtype=np.float64)
+
+
+def _search_cdfs(cdfs, group_ids, uniforms):
+    """Helper function that draws from the discrete distributions of several groups at once.
+
+    The normalized distribution of the i-th group is shifted to [i, i + 1], so that all the
+    draws are made with a single search.
+
+    Args:
+        cdfs: list of the (unnormalized) cumulative distributions of the groups
+        group_ids: group of each draw
+        uniforms: uniform sample in [0, 1) of each draw
+
+    Returns:
+        the index of each draw in the concatenation of the distributions.
+    """
+    sizes = np.array([len(cdf) for cdf in cdfs], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    flat = np.concatenate([cdf / cdf[-1] + i for i, cdf in enumerate(cdfs)])
+    result = np.searchsorted(flat, uniforms + group_ids, side="right")
+    return np.clip(result, starts[group_ids], starts[group_ids + 1] - 1)
+
+
+def _get_basic_support(voxels, values, density_factor, region_index):
+    """Helper function that returns the cell count of a cell group with the `basic` soma
+    placement, and the (voxels, cumulative distribution, offset) its cells are drawn from.
+
+    The voxels are relative to the bounding box of the region, see `to_voxel_data`.
+
+    Raises:
+        ValueError if some densities are negative, as `create_cell_positions`.
+    """
+    if np.count_nonzero(values < 0) != 0:
+        raise ValueError("Found negative densities, aborting")
+    brain_regions = region_index.brain_regions
+    cell_count_per_voxel = values * density_factor * brain_regions.voxel_volume / 1e9
+    nonzero = cell_count_per_voxel > 0
+    ijk = np.stack(np.unravel_index(voxels[nonzero], region_index.shape), axis=1)
+    start = np.min(ijk, axis=0) if len(ijk) else np.zeros(3, dtype=int)
+    cdf = np.cumsum(cell_count_per_voxel[nonzero] / np.sum(cell_count_per_voxel))
+    support = (ijk - start, cdf, brain_regions.indices_to_positions(start))
+    return int(np.round(np.sum(cell_count_per_voxel))), support
+
+
+def _get_group_density(conf, density_cache, region_index, voxel_density=None):
+    """Helper function that returns the voxels of a cell group and their densities, unless
+    already gathered in `voxel_density`."""
+    if voxel_density is None:
+        voxels, values = region_index.get_voxels(conf["region"], with_descendants=True), None
+    else:
+        voxels, values = voxel_density
+    if len(voxels) == 0:
+        raise BrainBuilderError(f"Empty region mask for region: '{conf['region']}'")
+    if values is None:
+        values = density_cache.get_values(conf["density"], voxels)
+    return voxels, values
+
+
+def _get_group_positions(
+    voxels, values, region_index, density_factor, soma_placement, rng, sampling_stats
+):
+    """Helper function that returns the positions of the cells of a cell group with the soma
+    placements other than `basic`, and appends the SamplingStats of the poisson disc ones to
+    `sampling_stats`."""
+    # pylint: disable=too-many-arguments
+    stats = poisson_disc_sampling.SamplingStats()
+    result = create_cell_positions(
+        region_index.to_voxel_data(voxels, values),
+        density_factor=density_factor,
+        method=soma_placement,
+        rng=rng,
+        stats=stats,
+    )
+    if soma_placement.startswith("poisson_disc"):
+        sampling_stats.append(stats)
+    return result
+
+
+def _get_group_supports(
+    conf_list, density_cache, region_index, density_factor, soma_placement, rngs, voxel_densities
+):
+    """Helper function that gathers the voxels and the densities of a batch of cell groups.
+
+    Returns:
+        tuple of the cell count of each group, of what its cells are drawn from (see
+        `_get_basic_support`) or of its positions with the other soma placements, and of the
+        SamplingStats of the groups with a poisson disc soma placement.
+    """
+    # pylint: disable=too-many-arguments
+    counts = np.zeros(len(conf_list), dtype=np.int64)
+    supports = []
+    sampling_stats = []
+    for i, conf in enumerate(conf_list):
+        voxels, values = _get_group_density(
+            conf,
+            density_cache,
+            region_index,
+            None if voxel_densities is None else voxel_densities[i],
+        )
+        if soma_placement == "basic":
+            counts[i], support = _get_basic_support(voxels, values, density_factor, region_index)
+        else:
+            support = _get_group_positions(
+                voxels,
+                values,
+                region_index,
+                density_factor,
+                soma_placement,
+                rngs[i],
+                sampling_stats,
+            )
+            counts[i] = len(support)
+        supports.append(support)
+        if counts[i] == 0:
+            L.warning("Density resulted in zero cell counts.")
+    return counts, supports, sampling_stats
+
+
+def _draw_group_traits(conf, i, rng, cells, traits, trait_uniforms):
+    """Helper function that assigns the constant traits of the i-th group of a batch to its
+    `cells`, and draws the uniform samples of the others from its generator."""
+    # pylint: disable=too-many-arguments
+    for prop, value in conf["traits"].items():
+        codes, cell_codes, group_codes = traits[prop]
+        values, probs = _get_trait_distribution(value)
+        value_codes = [codes.setdefault(v, len(codes)) for v in values]
+        if probs is None:
+            cell_codes[cells] = value_codes[0]
+        else:
+            rng.random(out=trait_uniforms[prop][cells])
+            group_codes[i] = (np.array(value_codes), np.cumsum(probs))
+
+
+def _init_traits(conf_list, nb_cells):
+    """Helper function that returns the (trait values, trait value codes, codes per group) of
+    each trait of a batch of cell groups in recipe order, and their uniform samples."""
+    traits = {}
+    for conf in conf_list:
+        for prop in conf["traits"]:
+            traits.setdefault(prop, ({}, np.full(nb_cells, -1, dtype=np.int64), {}))
+    return traits, {prop: np.empty(nb_cells) for prop in traits}
+
+
+def _draw_uniforms(conf_list, rngs, counts, supports, soma_placement, sampling_stats):
+    """Helper function that draws the uniform samples of the cells of a batch of cell groups,
+    from the generator of their group, into preallocated columns.
+
+    Returns:
+        tuple of the positions of the cells (uniform in their voxel with the `basic` soma
+        placement), of the uniform samples choosing their voxel, of the (trait values, trait
+        value codes, codes per group) of each trait in recipe order, and of the uniform samples
+        drawing each trait.
+    """
+    # pylint: disable=too-many-arguments
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    positions = np.empty((bounds[-1], 3), dtype=np.float64)
+    voxel_uniforms = np.empty(bounds[-1] if soma_placement == "basic" else 0)
+    traits, trait_uniforms = _init_traits(conf_list, bounds[-1])
+
+    for i, (conf, rng) in enumerate(zip(conf_list, rngs)):
+        cells = slice(bounds[i], bounds[i + 1])
+        if soma_placement == "basic":
+            rng.random(out=voxel_uniforms[cells])
+            rng.random(out=positions[cells])
+        else:
+            positions[cells] = supports[i]
+        _draw_group_traits(conf, i, rng, cells, traits, trait_uniforms)
+        if sampling_stats:
+            L.info("%s... [%d cells] %s", conf["traits"], counts[i], sampling_stats[i])
+        else:
+            L.info("%s... [%d cells]", conf["traits"], counts[i])
+    return positions, voxel_uniforms, traits, trait_uniforms
+
+
+def _place_in_voxels(positions, voxel_uniforms, supports, counts, group_ids, voxel_dimensions):
+    """Helper function that moves the cells with the `basic` soma placement, uniform in a
+    voxel, to the voxels chosen by `voxel_uniforms`, in place."""
+    # pylint: disable=too-many-arguments
+    # the groups without cells are left out, so that all the distributions are non-empty
+    nonempty = np.flatnonzero(counts)
+    ijk, cdfs, offsets = zip(*(supports[i] for i in nonempty))
+    ranks = np.searchsorted(nonempty, group_ids)
+    chosen = _search_cdfs(cdfs, ranks, voxel_uniforms)
+    positions += np.concatenate(ijk)[chosen]
+    positions *= voxel_dimensions
+    positions += np.stack(offsets)[ranks]
+
+
+def _draw_trait_columns(result, traits, trait_uniforms, group_ids):
+    """Helper function that draws the traits of the cells of a batch of cell groups, and adds
+    them to `result` in place; the string traits are categorical."""
+    for prop, (codes, cell_codes, group_codes) in traits.items():
+        if group_codes:
+            drawn = np.isin(group_ids, list(group_codes))
+            value_codes, cdfs = zip(*group_codes.values())
+            # the groups are renumbered, so that their distributions are contiguous
+            ranks = np.searchsorted(list(group_codes), group_ids[drawn])
+            chosen = _search_cdfs(cdfs, ranks, trait_uniforms[prop][drawn])
+            cell_codes[drawn] = np.concatenate(value_codes)[chosen]
+        if all(isinstance(value, str) for value in codes):
+            result[prop] = make_categorical(cell_codes, list(codes))
+        else:
+            # the code -1 of the cells without the trait picks the last value: NaN
+            table = np.empty(len(codes) + 1, dtype=object)
+            table[:-1] = list(codes)
+            table[-1] = np.nan
+            result[prop] = table[cell_codes]
+
+
+def _create_cell_groups_batch(
+    conf_list,
+    density_cache,
+    region_index,
+    density_factor,
+    soma_placement,
+    rngs,
+    return_counts=False,
+    voxel_densities=None,
+):
+    """Creates the cells of a batch of cell groups of the recipe at once.
+
+    The voxels and the densities of all the groups are gathered first, then the uniform samples
+    of the cells are drawn from the generator of their group into preallocated columns. With
+    the `basic` soma placement, the voxels of the cells (same distribution as
+    `create_cell_positions`) and their traits are then drawn for all the groups in single
+    vectorized passes; the other soma placements generate the positions group by group.
+
+    Args:
+        voxel_densities: optional list of the (voxels, densities) of the groups already
+            gathered, see `get_voxel_densities`
+
+    Returns:
+        pandas.DataFrame of the cells of the groups, in recipe order; the string traits are
+        categorical. With a poisson disc soma placement, its ``sampling_stats`` attribute is
+        the list of the SamplingStats of the groups. With `return_counts`, tuple of this
+        DataFrame and of the cell count of each group.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    counts, supports, sampling_stats = _get_group_supports(
+        conf_list,
+        density_cache,
+        region_index,
+        density_factor,
+        soma_placement,
+        rngs,
+        voxel_densities,
+    )
+    positions, voxel_uniforms, traits, trait_uniforms = _draw_uniforms(
+        conf_list, rngs, counts, supports, soma_placement, sampling_stats
+    )
+    group_ids = np.repeat(np.arange(len(conf_list)), counts)
+    if soma_placement == "basic" and len(positions) > 0:
+        voxel_dimensions = region_index.brain_regions.voxel_dimensions
+        _place_in_voxels(positions, voxel_uniforms, supports, counts, group_ids, voxel_dimensions)
+
+    result = pd.DataFrame(positions, columns=["x", "y", "z"])
+    _draw_trait_columns(result, traits, trait_uniforms, group_ids)
+    result = result.infer_objects()
+    if sampling_stats:
+        result.attrs["sampling_stats"] = sampling_stats
+    return (result, counts) if return_counts else result
+
+
+def _create_cell_group(conf, density_cache, region_index, density_factor, soma_placement, rng=None):
+    """Creates the cells of a single cell group of the recipe, see `_create_cell_groups_batch`."""
+    return _create_cell_groups_batch(
+        [conf], density_cache, region_index, density_factor, soma_placement, [get_rng(rng)]
+    )
+
+
+def get_voxel_densities(conf_list, indices, density_cache, region_index, result):
+    """Helper function that gathers the voxels and the densities of the cell groups of the
+    recipe with the given `indices`, missing from `result`.
+
+    The densities do not depend on the seed nor on the density factor: they are gathered once
+    for all the variants of a placement. The groups of the same region share its voxels.
+
+    Args:
+        result: dict of the (voxels, densities) of the groups by index, updated in place
+    """
+    region_voxels = {}
+    for i in indices:
+        if i in result:
+            continue
+        conf = conf_list[i]
+        key = json.dumps(conf["region"], sort_keys=True, default=str)
+        if key not in region_voxels:
+            region_voxels[key] = region_index.get_voxels(conf["region"], with_descendants=True)
+        voxels = region_voxels[key]
+        result[i] = (voxels, density_cache.get_values(conf["density"], voxels))
+
+
+def _get_group_key(conf):
+    """Returns an integer key identifying a cell group of the recipe by its content."""
+    return zlib.crc32(json.dumps(conf, sort_keys=True, default=str).encode())
+
+
+def _get_group_rngs(seed, conf_list):
+    """Returns the random generators of the cell groups of the recipe.
+
+    The generators are spawned from `seed`, keyed on the content of the groups (identical
+    groups are told apart by their rank): a group gets the same generator whatever its
+    position in the recipe, so that the groups can be placed in any order, in parallel, or
+    regenerated alone.
+    """
+    ranks = Counter()
+    result = []
+    for conf in conf_list:
+        key = _get_group_key(conf)
+        seed_seq = np.random.SeedSequence(seed, spawn_key=(key, ranks[key]))
+        result.append(np.random.default_rng(seed_seq))
+        ranks[key] += 1
+    return result
+
+
+def split_batches(indices, jobs):
+    """Helper function that splits the indices of the groups to place into batches of at most
+    `CELL_GROUP_BATCH_SIZE` groups, several per process to balance the load."""
+    nb_batches = -(-len(indices) // CELL_GROUP_BATCH_SIZE)
+    if jobs != 1:
+        nb_batches = max(nb_batches, min(len(indices), 4 * effective_n_jobs(jobs)))
+    return np.array_split(np.asarray(indices, dtype=np.int64), max(nb_batches, 1))
+
+
+def _share_placement_data(indices, conf_list, density_cache, region_index):
+    """Helper function that loads the densities of the groups with the given `indices` in the
+    main process and returns a context in which, along with the atlas data used by every group,
+    they are shared read-only with the workers, see `shared_arrays`."""
+    for i in indices:
+        if not isinstance(conf_list[i]["density"], numbers.Number):
+            density_cache.get(conf_list[i]["density"])
+    return shared_arrays(
+        (region_index.brain_regions, "raw"),
+        (region_index, "voxels"),
+        *(
+            (volume, "raw")
+            for volume in density_cache.volumes
+            if not isinstance(volume.raw, np.memmap)
+        ),
+    )
+
+
+def _iter_cell_group_batches(
+    indices,
+    conf_list,
+    rngs,
+    density_cache,
+    region_index,
+    density_factor,
+    soma_placement,
+    jobs,
+    voxel_densities=None,
+):
+    """Helper function that creates the cells of the groups of the recipe with the given
+    `indices`, in batches of at most `CELL_GROUP_BATCH_SIZE` groups (see
+    `_create_cell_groups_batch`) placed in `jobs` parallel processes.
+
+    With `voxel_densities`, the dict of the (voxels, densities) of the groups by index, they are
+    not gathered again.
+
+    Yields:
+        tuple of the indices of the groups of each batch, of the DataFrame of their cells and
+        of the cell count of each group, in the order of `indices`.
+    """
+    # pylint: disable=too-many-arguments
+    batches = split_batches(indices, jobs)
+
+    def _get_args(batch):
+        return (
+            [conf_list[i] for i in batch],
+            density_cache,
+            region_index,
+            density_factor,
+            soma_placement,
+            [rngs[i] for i in batch],
+            True,
+            None if voxel_densities is None else [voxel_densities[i] for i in batch],
+        )
+
+    if jobs == 1:
+        for batch in batches:
+            yield (batch, *_create_cell_groups_batch(*_get_args(batch)))
+        return
+
+    with _share_placement_data(indices, conf_list, density_cache, region_index):
+        results = Parallel(n_jobs=jobs, backend="loky", return_as="generator")(
+            delayed(_create_cell_groups_batch)(*_get_args(batch)) for batch in batches
+        )
+        for batch, result in zip(batches, results):
+            yield (batch, *result)
+
+
+def _get_group_cache_key(conf, rng, density_cache, region_index, density_factor, soma_placement):
+    """Returns the key of the cells of a cell group in a `CellGroupCache`.
+
+    It is a hash of the group, of its voxels and of their densities, of the placement
+    parameters and of the state of the random generator of the group.
+    """
+    # pylint: disable=too-many-arguments
+    brain_regions = region_index.brain_regions
+    voxels = region_index.get_voxels(conf["region"], with_descendants=True)
+    params = [
+        __version__,
+        conf,
+        density_factor,
+        soma_placement,
+        rng.bit_generator.state,
+        brain_regions.shape,
+        brain_regions.voxel_dimensions.tolist(),
+        brain_regions.offset.tolist(),
+    ]
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(voxels.astype(np.int64).tobytes())
+    digest.update(density_cache.get_values(conf["density"], voxels).tobytes())
+    return digest.hexdigest()
+
+
+def _split_cell_groups(cells, conf_list, counts):
+    """Helper function that splits the cells of a batch of groups into the cells of each group,
+    with the columns of its own traits only."""
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    for i, conf in enumerate(conf_list):
+        columns = [name for name in cells if name in ("x", "y", "z") or name in conf["traits"]]
+        group = cells.iloc[bounds[i] : bounds[i + 1]][columns].reset_index(drop=True)
+        group = group.infer_objects()
+        for name, dtype in group.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                group[name] = group[name].cat.remove_unused_categories()
+        yield group
+
+
+def iter_cell_groups(
+    conf_list,
+    density_cache,
+    region_index,
+    density_factor,
+    soma_placement,
+    seed,
+    jobs,
+    cache=None,
+    indices=None,
+    voxel_densities=None,
+):
+    """Generates the cells of the groups of the recipe, in batches of at most
+    `CELL_GROUP_BATCH_SIZE` groups (see `_create_cell_groups_batch`) placed in `jobs` parallel
+    processes.
+
+    Every group has its own random generator (see `_get_group_rngs`) and the batches are
+    generated in recipe order: the result does not depend on the number of processes, nor on
+    the other groups placed.
+
+    With a `CellGroupCache`, the groups found in it are not placed again, and the cells of
+    the placed ones are stored in it.
+
+    Args:
+        indices: optional sorted indices of the groups to place (default: all of them)
+        voxel_densities: optional dict of the (voxels, densities) of the groups by index,
+            already gathered (see `get_voxel_densities`)
+
+    Yields:
+        tuple of the indices of the groups of each batch, of the DataFrame of their cells and of
+        the cell count of each group.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    rngs = _get_group_rngs(seed, conf_list)
+    indices = list(range(len(conf_list)) if indices is None else indices)
+    if not indices:
+        return
+    args = (conf_list, rngs, density_cache, region_index, density_factor, soma_placement, jobs)
+    if cache is None:
+        yield from _iter_cell_group_batches(indices, *args, voxel_densities=voxel_densities)
+        return
+
+    keys = {
+        i: _get_group_cache_key(
+            conf_list[i], rngs[i], density_cache, region_index, density_factor, soma_placement
+        )
+        for i in indices
+    }
+    missing = [i for i in indices if keys[i] not in cache]
+    L.info("Cell groups found in the cache: %d / %d", len(indices) - len(missing), len(indices))
+
+    placed = {}
+
+    def _get_groups(start, stop):
+        """Yields the batches of the groups of `indices[start:stop]`, placed or cached."""
+        for batch in np.array_split(
+            indices[start:stop], -(-(stop - start) // CELL_GROUP_BATCH_SIZE)
+        ):
+            groups = []
+            for i in batch:
+                group = placed.pop(i) if i in placed else cache.get(keys[i])
+                if group is None:
+                    # the entry was evicted meanwhile; the generator of the group is unused
+                    group = _create_cell_group(
+                        conf_list[i],
+                        density_cache,
+                        region_index,
+                        density_factor,
+                        soma_placement,
+                        rngs[i],
+                    )
+                groups.append(group)
+            yield batch, concat_cells(groups), np.array([len(group) for group in groups])
+
+    start = 0
+    batches = (
+        _iter_cell_group_batches(missing, *args, voxel_densities=voxel_densities) if missing else []
+    )
+    for batch, cells, counts in batches:
+        for i, group in zip(
+            batch, _split_cell_groups(cells, [conf_list[i] for i in batch], counts)
+        ):
+            cache.put(keys[i], group)
+            placed[i] = group
+        stop = indices.index(batch[-1]) + 1
+        yield from _get_groups(start, stop)
+        start = stop
+    if start < len(indices):
+        yield from _get_groups(start, len(indices))
+
+    cache.evict()
+
+
+def _estimate_poisson_grid(brain_regions, cell_count_per_voxel, shape, nb_nonzero):
+    """Helper function that estimates the poisson disc sampling grid of a cell group, the same
+    grid as `LocalDistanceField` and `poisson_disc_sampling.create_grid`.
+
+    Args:
+        shape: shape of the bounding box of the voxels with a nonzero density
+
+    Returns:
+        tuple of the shape of the grid and of its size (bytes).
+    """
+    voxel_size = float(np.abs(brain_regions.voxel_dimensions[0]))
+    min_distance = 0.84 * voxel_size / np.power(np.max(cell_count_per_voxel), 1.0 / 3)
+    domain = np.array([np.zeros(3), shape * voxel_size])
+    grid_shape = poisson_disc_sampling.get_grid_shape(domain, min_distance / np.sqrt(3))
+    grid_bytes = float(np.prod(grid_shape, dtype=np.float64)) * 4
+    nonzero_fraction = nb_nonzero / np.prod(shape)
+    if (
+        grid_bytes > poisson_disc_sampling.DENSE_GRID_MAX_BYTES
+        or nonzero_fraction < poisson_disc_sampling.SPARSE_GRID_MAX_NONZERO_FRACTION
+    ):
+        # the blocks of a sparse grid are only allocated where there are points
+        grid_bytes *= nonzero_fraction
+    return tuple(int(n) for n in grid_shape), int(grid_bytes)
+
+
+def _estimate_memory(
+    soma_placement, cell_count_per_voxel, shape, nb_nonzero, cell_count, nb_traits, brain_regions
+):
+    """Helper function that estimates the peak memory (bytes) of the temporaries of
+    `_create_cell_groups_batch` and `create_cell_positions` for a cell group.
+
+    Args:
+        shape: shape of the bounding box of the voxels with a nonzero density
+
+    Returns:
+        tuple of the memory and of the shape of the poisson disc sampling grid (if any).
+    """
+    # pylint: disable=too-many-arguments
+    if soma_placement == "basic":
+        memory = nb_nonzero * 32 + cell_count * (56 + 24 * nb_traits)
+    else:
+        memory = int(np.prod(shape)) * 24 + cell_count * (32 + 24 * nb_traits)
+    grid_shape = None
+    if soma_placement.startswith("poisson_disc"):
+        grid_shape, grid_bytes = _estimate_poisson_grid(
+            brain_regions, cell_count_per_voxel, shape, nb_nonzero
+        )
+        memory += grid_bytes + np.prod(shape) * 12
+    return int(memory), grid_shape
+
+
+def _estimate_cell_group(conf, density_cache, region_index, density_factor, soma_placement):
+    """Helper function that estimates the placement of a cell group without sampling it.
+
+    Returns:
+        dict of the expected cell count (as `_get_cell_count`), of the count and bounding box of
+        the voxels with a nonzero density, of the shape of the poisson disc sampling grid (if
+        any), and of the rough peak memory (bytes) and runtime (seconds) of the placement.
+    """
+    brain_regions = region_index.brain_regions
+    voxels = region_index.get_voxels(conf["region"], with_descendants=True)
+    cell_count_per_voxel = density_cache.get_values(conf["density"], voxels)
+    cell_count_per_voxel *= density_factor * brain_regions.voxel_volume / 1e9
+    nonzero = cell_count_per_voxel > 0
+
+    result = {
+        "region": conf["region"],
+        "density": conf["density"],
+        "cell_count": int(np.round(np.sum(cell_count_per_voxel))),
+        "nonzero_voxels": int(np.count_nonzero(nonzero)),
+        "bbox_min": None,
+        "bbox_max": None,
+        "grid_shape": None,
+    }
+    runtime = len(voxels) * PLACEMENT_SECONDS_PER_VOXEL
+    runtime += result["cell_count"] * PLACEMENT_SECONDS_PER_CELL.get(soma_placement, np.nan)
+    if result["nonzero_voxels"] == 0:
+        return {**result, "memory": 0, "runtime": runtime}
+
+    ijk = np.unravel_index(voxels[nonzero], region_index.shape)
+    start = np.array([np.min(idx) for idx in ijk])
+    stop = np.array([np.max(idx) for idx in ijk]) + 1
+    result["bbox_min"] = tuple(brain_regions.indices_to_positions(start).tolist())
+    result["bbox_max"] = tuple(brain_regions.indices_to_positions(stop).tolist())
+    memory, result["grid_shape"] = _estimate_memory(
+        soma_placement,
+        cell_count_per_voxel,
+        stop - start,
+        result["nonzero_voxels"],
+        result["cell_count"],
+        len(conf["traits"]),
+        brain_regions,
+    )
+    return {**result, "memory": memory, "runtime": runtime}
+
+
+def estimate_cell_groups(conf_list, density_cache, region_index, density_factor, soma_placement):
+    """Estimates the placement of the groups of the recipe without sampling them, see
+    `_estimate_cell_group`.
+
+    Returns:
+        pandas.DataFrame with the estimates of each group.
+    """
+    return pd.DataFrame(
+        [
+            _estimate_cell_group(conf, density_cache, region_index, density_factor, soma_placement)
+            for conf in conf_list
+        ]
+    )
+
+
+def concat_cells(frames):
+    """Helper function that concatenates DataFrames of cells, keeping their categorical columns
+    categorical, with the union of the categories."""
+    frames = list(frames)
+    categorical = {
+        name: None
+        for frame in frames
+        for name, dtype in frame.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+    for name in categorical:
+        categories = set()
+        for frame in frames:
+            if name in frame:
+                categories.update(pd.Categorical(frame[name]).categories)
+        dtype = pd.CategoricalDtype(sorted(categories))
+        for i, frame in enumerate(frames):
+            if name in frame:
+                column = frame[name].astype(dtype)
+            else:
+                column = pd.Categorical([None] * len(frame), dtype=dtype)
+            frames[i] = frame.assign(**{name: column})
+    return pd.concat(frames, ignore_index=True)
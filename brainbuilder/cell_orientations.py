@@ -24,7 +24,7 @@ def apply_rotation(A, angles, axis):
     return np.einsum("...ij,...jk->...ik", A, rotations)
 
 
-def apply_random_rotation(A, axis, distr):
+def apply_random_rotation(A, axis, distr, rng=None):
     """
     Apply random rotation around given `axis`.
 
@@ -33,9 +33,11 @@ def apply_random_rotation(A, axis, distr):
         axis: one of ('x', 'y', 'z')
         distr: a pair of distribution name and dict of parameters, for instance:
             ('uniform', {'low': -np.pi, 'high': +np.pi})
+        rng: (optional) numpy.random.Generator used to draw the angles; the global numpy
+            random state is used by default.
 
     Returns:
         (N, 3, 3) array of mutated rotation matrices
     """
-    angles = parse_distr(distr).rvs(size=A.shape[0])
+    angles = parse_distr(distr).rvs(size=A.shape[0], random_state=rng)
     return apply_rotation(A, angles, axis)
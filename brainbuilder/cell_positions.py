@@ -1,14 +1,27 @@
 # SPDX-License-Identifier: Apache-2.0
-""" Algorithms to create cell positions. """
+"""Algorithms to create cell positions."""
 
 import logging
+import os
+from functools import partial
 
 import numpy as np
+from joblib import Parallel, delayed
 
 from brainbuilder import poisson_disc_sampling
+from brainbuilder.utils.random import get_rng
 
 L = logging.getLogger(__name__)
 
+# minimum size, in voxels, of the tiles of the parallel poisson disc sampling
+POISSON_DISC_TILE_SIZE = 16
+
+# minimum number of voxels of the constant density region filled with a periodic pattern
+POISSON_DISC_PATTERN_MIN_VOXELS = 64
+
+# environment variable with the directory where the periodic poisson disc patterns are cached
+POISSON_DISC_PATTERN_CACHE_ENV = "BRAINBUILDER_POISSON_PATTERN_CACHE"
+
 
 def _assert_cubic_voxels(voxel_data):
     """Helper function that verifies whether the voxels of given voxel data are
@@ -37,7 +50,7 @@ def _get_seed(cell_count_per_voxel, voxel_data):
     http://devmag.org.za/2009/05/03/poisson-disk-sampling/.
     """
     assert np.all(cell_count_per_voxel >= 0)
-    positives = np.ma.masked_values(cell_count_per_voxel, 0)
+    positives = np.where(cell_count_per_voxel > 0, cell_count_per_voxel, np.inf)
     idcs = np.unravel_index(np.argmin(positives), cell_count_per_voxel.shape)
     return voxel_data.indices_to_positions(idcs) + voxel_data.voxel_dimensions / 2.0
 
@@ -70,7 +83,7 @@ def get_bbox_nonzero_entries(data, bbox, voxel_dimensions):
     return bbox_nonzero
 
 
-def _create_cell_positions_uniform(density, density_factor):
+def _create_cell_positions_uniform(density, density_factor, rng=None):
     """Create cell positions given cell density volumetric data (using uniform distribution).
 
     Within voxels, samples are created according to a uniform distribution.
@@ -81,6 +94,8 @@ def _create_cell_positions_uniform(density, density_factor):
         density(VoxelData): cell density (count / mm^3)
         density_factor(float): reduce / increase density proportionally for all
             voxels. Default is 1.0.
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
 
     Returns:
         numpy.array: array of positions of shape (cell_count, 3) where each row
@@ -95,15 +110,196 @@ def _create_cell_positions_uniform(density, density_factor):
     voxel_ijk = np.nonzero(cell_count_per_voxel > 0)
     voxel_idx = np.arange(len(voxel_ijk[0]))
 
+    rng = get_rng(rng)
     probs = 1.0 * cell_count_per_voxel[voxel_ijk] / np.sum(cell_count_per_voxel)
-    chosen = np.random.choice(voxel_idx, cell_count, replace=True, p=probs)
+    chosen = rng.choice(voxel_idx, cell_count, replace=True, p=probs)
     chosen_idx = np.stack(voxel_ijk).transpose()[chosen]
 
     # get random positions within chosen voxels
-    return density.indices_to_positions(chosen_idx + np.random.random(np.shape(chosen_idx)))
+    return density.indices_to_positions(chosen_idx + rng.random(np.shape(chosen_idx)))
+
+
+def _get_voxel_cell_counts(cell_count_per_voxel, cell_count, rng):
+    """Helper function that draws the integer number of cells of each nonzero voxel.
+
+    The `cell_count` cells are distributed over the voxels with a single multinomial draw, with
+    probabilities proportional to the expected counts.
+
+    Returns:
+        tuple of the flat indices of the nonzero voxels and of their cell counts.
+    """
+    voxels = np.flatnonzero(cell_count_per_voxel)
+    weights = cell_count_per_voxel.flat[voxels].astype(np.float64)
+    counts = rng.multinomial(cell_count, weights / np.sum(weights))
+    nonempty = counts > 0
+    return voxels[nonempty], counts[nonempty]
+
+
+def _iter_voxel_blocks(counts, chunk_size):
+    """Helper function that splits the voxels into consecutive blocks with about `chunk_size`
+    cells each (a voxel is never split)."""
+    cumulative = np.cumsum(counts)
+    splits = np.searchsorted(cumulative, np.arange(chunk_size, cumulative[-1], chunk_size))
+    bounds = np.unique(np.concatenate([[0], splits + 1, [len(counts)]]))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _get_voxel_positions(density, voxels, counts, rng):
+    """Helper function that generates the float32 positions of `counts` cells uniformly within
+    each of the `voxels` (flat indices), in voxel order."""
+    ijk = np.column_stack(np.unravel_index(voxels, density.shape))
+    ijk = np.repeat(ijk.astype(np.float32), counts, axis=0)
+    ijk += rng.random(ijk.shape, dtype=np.float32)
+    return ijk * density.voxel_dimensions.astype(np.float32) + density.offset.astype(np.float32)
+
+
+def iter_cell_positions(
+    density, chunk_size=1000000, density_factor=1.0, seed=None, rng=None, return_voxels=False
+):
+    """Given cell density volumetric data, generate cell positions chunk by chunk.
+
+    The number of cells in each voxel is drawn at once (multinomial distribution), then the
+    positions are generated uniformly within the voxels, voxel block by voxel block, so that
+    the positions do not need to be held in memory all at once.
+
+    Args:
+        density(VoxelData): cell density (count / mm^3)
+        chunk_size(int): approximate number of positions in each chunk
+        density_factor(float): reduce / increase density proportionally for all
+            voxels. Default is 1.0.
+        seed(int): (optional) the numpy random seed to be used.
+        rng(numpy.random.Generator): (optional) random generator, used instead of `seed`.
+        return_voxels(bool): whether to yield the flat indices of the voxels of the cells too.
+
+    Yields:
+        numpy.array: float32 arrays of positions of shape (N, 3), in voxel order, where each
+        row represents a cell and the columns correspond to (x, y, z). With `return_voxels`,
+        tuples of these positions and of the flat indices of their voxels.
+    """
+    if np.count_nonzero(density.raw < 0) != 0:
+        raise ValueError("Found negative densities, aborting")
+
+    rng = get_rng(seed if rng is None else rng)
+
+    cell_count_per_voxel, cell_count = _get_cell_count(density, density_factor)
+    if cell_count == 0:
+        L.warning("Density resulted in zero cell counts.")
+        return
+
+    voxels, counts = _get_voxel_cell_counts(cell_count_per_voxel, cell_count, rng)
+    for start, stop in _iter_voxel_blocks(counts, chunk_size):
+        positions = _get_voxel_positions(density, voxels[start:stop], counts[start:stop], rng)
+        if return_voxels:
+            yield positions, np.repeat(voxels[start:stop], counts[start:stop])
+        else:
+            yield positions
+
+
+def _create_cell_positions_multinomial(density, density_factor, rng=None):
+    """Create cell positions given cell density volumetric data (using uniform distribution).
+
+    Same as ``_create_cell_positions_uniform``, but the cell counts of the voxels are drawn
+    from a multinomial distribution, and the float32 positions are generated voxel block by
+    voxel block, which avoids the large temporaries of ``numpy.random.choice``.
+
+    Args:
+        density(VoxelData): cell density (count / mm^3)
+        density_factor(float): reduce / increase density proportionally for all
+            voxels. Default is 1.0.
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
+
+    Returns:
+        numpy.array: float32 array of positions of shape (cell_count, 3) where each row
+        represents a cell and the columns correspond to (x, y, z).
+    """
+    chunks = list(iter_cell_positions(density, density_factor=density_factor, rng=rng))
+    if not chunks:
+        return np.empty((0, 3), dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+def _get_systematic_cell_counts(cell_count_per_voxel, cell_count, rng):
+    """Helper function that rounds the expected cell counts of the nonzero voxels to integers
+    summing up to `cell_count`, with systematic sampling: every voxel gets the floor or the
+    ceiling of its expected count.
+
+    Returns:
+        tuple of the flat indices of the nonzero voxels and of their cell counts.
+    """
+    voxels = np.flatnonzero(cell_count_per_voxel)
+    cumulative = np.cumsum(cell_count_per_voxel.flat[voxels], dtype=np.float64)
+    cumulative *= cell_count / cumulative[-1]
+    cumulative[-1] = cell_count
+    cumulative = np.floor(cumulative + rng.random()).astype(np.int64)
+    counts = np.diff(cumulative, prepend=0)
+    nonempty = counts > 0
+    return voxels[nonempty], counts[nonempty]
+
+
+def _draw_strata(counts, nb_strata, rng):
+    """Helper function that draws `counts` distinct strata among the `nb_strata` of each voxel:
+    the strata of each voxel are shuffled, the first ones are kept.
+
+    Returns:
+        tuple of the voxel (index in `counts`) and of the stratum of each cell.
+    """
+    stratum_voxel = np.repeat(np.arange(len(counts)), nb_strata)
+    first_stratum = np.cumsum(nb_strata) - nb_strata
+    order = np.lexsort((rng.random(len(stratum_voxel)), stratum_voxel))
+    rank = np.arange(len(stratum_voxel)) - first_stratum[stratum_voxel]
+    selected = rank < counts[stratum_voxel]
+    cell_voxel = stratum_voxel[selected]
+    return cell_voxel, order[selected] - first_stratum[cell_voxel]
+
+
+def _create_cell_positions_stratified(density, density_factor, rng=None):
+    """Create cell positions given cell density volumetric data (using stratified sampling).
+
+    The expected cell counts are rounded to an integer count `n` per voxel (systematic
+    sampling). Each voxel is then split into `m**3` strata, with `m = ceil(n**(1/3))`; the
+    cells are placed in `n` distinct random strata, at a uniformly jittered position within
+    each stratum.
+
+    This spreads apart the cells of the same voxel, so it reduces the clustering of ``basic``
+    when the voxels hold several cells each. With about one cell per voxel, every voxel is a
+    single stratum and the cells are about as clustered as with ``basic``, since the cells of
+    neighboring voxels are not spread apart; the Poisson disc methods are needed there.
+
+    Args:
+        density(VoxelData): cell density (count / mm^3)
+        density_factor(float): reduce / increase density proportionally for all
+            voxels. Default is 1.0.
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
+
+    Returns:
+        numpy.array: float32 array of positions of shape (cell_count, 3) where each row
+        represents a cell and the columns correspond to (x, y, z).
+    """
+    cell_count_per_voxel, cell_count = _get_cell_count(density, density_factor)
+
+    if cell_count == 0:
+        L.warning("Density resulted in zero cell counts.")
+        return np.empty((0, 3), dtype=np.float32)
 
+    rng = get_rng(rng)
+    voxels, counts = _get_systematic_cell_counts(cell_count_per_voxel, cell_count, rng)
+    strata_per_axis = np.ceil(np.cbrt(counts) - 1e-9).astype(np.int64)
 
-def _create_cell_positions_poisson_disc(density, density_factor):
+    cell_voxel, stratum = _draw_strata(counts, strata_per_axis**3, rng)
+
+    m = strata_per_axis[cell_voxel]
+    stratum_ijk = np.column_stack([stratum // (m * m), (stratum // m) % m, stratum % m])
+    jitter = (stratum_ijk + rng.random(stratum_ijk.shape)) / m[:, np.newaxis]
+    ijk = np.column_stack(np.unravel_index(voxels[cell_voxel], density.shape)) + jitter
+
+    return density.indices_to_positions(ijk).astype(np.float32)
+
+
+def _create_cell_positions_poisson_disc(
+    density, density_factor, vectorized=False, adaptive=False, rng=None, stats=None
+):
     """Create cell positions given cell density volumetric data (using poisson disc sampling).
 
     The upper limit of the total cell count is calculated based on cell density
@@ -115,6 +311,15 @@ def _create_cell_positions_poisson_disc(density, density_factor):
         density(VoxelData): cell density (count / mm^3)
         density_factor(float): reduce / increase density proportionally for all
             voxels. Default is 1.0.
+        vectorized(bool): if True, the candidates around each active point are generated
+            and checked as one batch.
+        adaptive(bool): if True, the number of trials around each point and the reseeding
+            are adapted to the local acceptance rate, see
+            `poisson_disc_sampling.generate_points`.
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
+        stats(poisson_disc_sampling.SamplingStats): (optional) statistics of the sampling,
+            added to by the run.
 
     Returns:
         numpy.array: array of positions of shape (nb_points, 3) where each row
@@ -130,37 +335,362 @@ def _create_cell_positions_poisson_disc(density, density_factor):
         L.warning("Density resulted in zero cell counts.")
         return np.empty((0, 3), dtype=np.float32)
 
-    _assert_cubic_voxels(density)
-    voxel_size = np.abs(density.voxel_dimensions[0])
+    return _generate_poisson_disc_positions(
+        density,
+        cell_count_per_voxel,
+        cell_count,
+        vectorized=vectorized,
+        adaptive=adaptive,
+        stats=stats,
+        rng=rng,
+    )
+
 
-    cell_cnt_masked = np.ma.masked_values(cell_count_per_voxel, 0)
-    tmp = np.divide(voxel_size, np.power(cell_cnt_masked, 1.0 / density.ndim))
-    too_large_distance = 2 * np.max(np.abs(density.bbox[1, :] - density.bbox[0, :]))
-    local_distance = 0.84 * tmp.filled(too_large_distance)  # pylint: disable=no-member
-    min_distance = np.min(local_distance)
+class LocalDistanceField:
+    """Minimum distance between cell positions in each voxel, based on the expected number of
+    positions in the voxel.
+
+    The distances are stored as a float32 volume cropped to the bounding box of the voxels with
+    nonzero cell counts, and are looked up for whole arrays of points at once. The distance is
+    infinite in the voxels without cells, so that the samplers reject the points there up front.
+    """
 
-    def _min_distance_func(point=None):
-        """Helper function that makes the connection between input densities
-        and distances between generated cell positions.
+    def __init__(self, density, cell_count_per_voxel):
+        """Constructor
+
+        Args:
+            density(VoxelData): cell density, defining the voxel grid
+            cell_count_per_voxel: numpy.array of expected cell counts, with the shape of density
+        """
+        _assert_cubic_voxels(density)
+        voxel_size = float(np.abs(density.voxel_dimensions[0]))
+
+        bbox_idx = get_bbox_indices_nonzero_entries(cell_count_per_voxel)
+        counts = cell_count_per_voxel[tuple(slice(a, b + 1) for a, b in zip(*bbox_idx))]
+        nonzero = counts > 0
+
+        #: cropped cell counts, as a VoxelData in the frame of `density`
+        self.counts = density.with_data(counts)
+        self.counts.offset = density.indices_to_positions(bbox_idx[0])
+        self.nonzero_fraction = np.count_nonzero(nonzero) / nonzero.size
+
+        self.distances = np.full(counts.shape, np.inf, dtype=np.float32)
+        distances = 0.84 * voxel_size / np.power(counts[nonzero], 1.0 / counts.ndim)
+        # round up to float32, so that the minimum distances are never underestimated
+        rounded = distances.astype(np.float32)
+        self.distances[nonzero] = np.where(
+            rounded < distances, np.nextafter(rounded, np.float32(np.inf)), rounded
+        )
+        self.min_distance = float(np.min(self.distances[nonzero]))
+        self.max_distance = float(np.max(self.distances[nonzero]))
+
+    def lookup(self, points):
+        """Returns the minimum distances at given (N, dim) points, or at a single point;
+        `np.inf` where no cell is expected.
+
+        Points are expected to lie within the bounding box of the field.
+        """
+        counts = self.counts
+        idx = np.floor((points - counts.offset) / counts.voxel_dimensions).astype(np.intp)
+        idx = np.clip(idx, 0, np.array(counts.shape) - 1)
+        return self.distances[tuple(idx.T)]
+
+    def __call__(self, points=None):
+        """Returns the minimum distances at given points or, if no points are passed, the
+        absolute minimum distance; this is the `min_distance` function used by
+        `poisson_disc_sampling.generate_points`.
         """
-        if point is None:
+        if points is None:
             # minimum distance, used for the spatial index
-            return min_distance
-        else:
-            voxel = density.positions_to_indices(point)
-            return local_distance[tuple(voxel)]
+            return self.min_distance
+        return self.lookup(points)
+
+
+def _generate_poisson_disc_positions(
+    density,
+    cell_count_per_voxel,
+    cell_count,
+    vectorized=False,
+    existing_points=None,
+    display_progress=True,
+    adaptive=False,
+    stats=None,
+    rng=None,
+):
+    """Helper function that runs the poisson disc sampling over the nonzero entries of
+    `cell_count_per_voxel`; the statistics of the run are added to `stats`, if given.
+    """
+    # pylint: disable=too-many-arguments
+    local_distance = LocalDistanceField(density, cell_count_per_voxel)
+    counts = local_distance.counts
+    run_stats = poisson_disc_sampling.SamplingStats()
 
-    seed = _get_seed(cell_count_per_voxel, density)
-    bbox_nonzero = get_bbox_nonzero_entries(
-        cell_count_per_voxel, density.bbox, density.voxel_dimensions
-    )
     points = poisson_disc_sampling.generate_points(
-        bbox_nonzero, cell_count, _min_distance_func, seed
+        counts.bbox,
+        cell_count,
+        local_distance,
+        _get_seed(counts.raw, counts),
+        display_progress=display_progress,
+        vectorized=vectorized,
+        nonzero_fraction=local_distance.nonzero_fraction,
+        existing_points=existing_points,
+        adaptive=adaptive,
+        stats=run_stats,
+        rng=rng,
     )
+    L.debug("Poisson disc sampling: %s", run_stats)
+    if stats is not None:
+        stats.update(run_stats)
     return np.array(points)
 
 
-def create_cell_positions(density, density_factor=1.0, method="basic", seed=None):
+def _generate_poisson_disc_tile_positions(tile_density, cell_count, existing_points, seed):
+    """Helper function that generates the positions of one tile of the parallel poisson
+    disc sampling; it is run in a worker process, with its own random generator.
+
+    Returns:
+        the positions and the SamplingStats of the tile
+    """
+    stats = poisson_disc_sampling.SamplingStats()
+    positions = _generate_poisson_disc_positions(
+        tile_density,
+        tile_density.raw,
+        cell_count,
+        vectorized=True,
+        existing_points=existing_points,
+        display_progress=False,
+        stats=stats,
+        rng=np.random.default_rng(seed),
+    )
+    return positions, stats
+
+
+def _distribute_cell_count(expected_counts, cell_count):
+    """Helper function that rounds the expected cell counts so that they sum up to `cell_count`
+    (largest remainder method).
+    """
+    result = np.floor(expected_counts).astype(np.int64)
+    remainder = cell_count - np.sum(result)
+    if remainder > 0:
+        order = np.argsort(result - expected_counts, kind="stable")
+        result[order[:remainder]] += 1
+    return result
+
+
+def _create_cell_positions_poisson_disc_parallel(
+    density, density_factor, tile_size=POISSON_DISC_TILE_SIZE, n_jobs=-1, rng=None, stats=None
+):
+    """Create cell positions given cell density volumetric data, using parallel poisson disc
+    sampling.
+
+    The nonzero bounding box is split into cubic tiles of `tile_size` voxels, or wider if
+    needed: tiles are wider than the maximum local distance between points. The tiles are
+    processed in 2**dim phases, such that the tiles of a phase are not adjacent and can be
+    sampled in parallel. The points of the adjacent tiles sampled in previous phases are passed
+    to each tile, so that the minimum distance is kept across tile borders.
+
+    Every tile has its own random generator, spawned from `rng` and keyed on the tile index:
+    the result is reproducible for a given seed, whatever the number of workers.
+
+    Args:
+        density(VoxelData): cell density (count / mm^3)
+        density_factor(float): reduce / increase density proportionally for all
+            voxels. Default is 1.0.
+        tile_size(int): minimum size of the tiles, in voxels
+        n_jobs(int): number of worker processes, as in joblib.Parallel
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
+        stats(poisson_disc_sampling.SamplingStats): (optional) statistics of the sampling,
+            added to by the tiles.
+
+    Returns:
+        numpy.array: array of positions of shape (nb_points, 3) where each row
+        represents a cell and the columns correspond to (x, y, z).
+    """
+    # pylint: disable=too-many-locals
+    cell_count_per_voxel, cell_count = _get_cell_count(density, density_factor)
+
+    if cell_count == 0:
+        L.warning("Density resulted in zero cell counts.")
+        return np.empty((0, 3), dtype=np.float32)
+
+    _assert_cubic_voxels(density)
+    voxel_size = np.abs(density.voxel_dimensions[0])
+    max_distance = LocalDistanceField(density, cell_count_per_voxel).max_distance
+    tile_size = max(tile_size, int(np.floor(max_distance / voxel_size)) + 1)
+
+    bbox_idx = get_bbox_indices_nonzero_entries(cell_count_per_voxel)
+    nb_tiles = (bbox_idx[1] - bbox_idx[0]) // tile_size + 1
+    tiles = {}
+    for tile_idx in np.ndindex(*nb_tiles):
+        start = bbox_idx[0] + np.array(tile_idx) * tile_size
+        stop = np.minimum(start + tile_size, bbox_idx[1] + 1)
+        tiles[tile_idx] = tuple(slice(a, b) for a, b in zip(start, stop))
+
+    expected_counts = np.array([np.sum(cell_count_per_voxel[sl]) for sl in tiles.values()])
+    tile_counts = dict(zip(tiles, _distribute_cell_count(expected_counts, cell_count)))
+    base_seed = get_rng(rng).integers(np.iinfo(np.int64).max)
+
+    results = {}
+    parallel = Parallel(n_jobs=n_jobs, backend="loky")
+    for phase in np.ndindex(*(2,) * density.ndim):
+        phase_tiles = [
+            tile_idx
+            for tile_idx in tiles
+            if tile_counts[tile_idx] > 0 and tuple(np.mod(tile_idx, 2)) == phase
+        ]
+        jobs = []
+        for tile_idx in phase_tiles:
+            slices = tiles[tile_idx]
+            tile_density = density.with_data(cell_count_per_voxel[slices])
+            tile_density.offset = density.indices_to_positions(
+                np.array([sl.start for sl in slices])
+            )
+            jobs.append(
+                delayed(_generate_poisson_disc_tile_positions)(
+                    tile_density,
+                    tile_counts[tile_idx],
+                    _get_neighbour_tile_points(results, tile_idx, tile_density, max_distance),
+                    np.random.SeedSequence(base_seed, spawn_key=tile_idx),
+                )
+            )
+        for tile_idx, (positions, tile_stats) in zip(phase_tiles, parallel(jobs)):
+            results[tile_idx] = positions
+            if stats is not None:
+                stats.update(tile_stats)
+
+    return np.concatenate([results[tile_idx] for tile_idx in sorted(results)])
+
+
+def _get_neighbour_tile_points(results, tile_idx, tile_density, max_distance):
+    """Helper function that collects the points of the tiles adjacent to `tile_idx` that are
+    closer than `max_distance` to the tile."""
+    neighbours = [
+        results[neighbour_idx]
+        for offset in np.ndindex(*(3,) * len(tile_idx))
+        if (neighbour_idx := tuple(np.add(tile_idx, offset) - 1)) in results
+    ]
+    if not neighbours:
+        return np.empty((0, 3))
+    points = np.concatenate(neighbours)
+    bbox = np.sort(tile_density.bbox, axis=0)
+    inside = np.all((points >= bbox[0] - max_distance) & (points <= bbox[1] + max_distance), axis=1)
+    return points[inside]
+
+
+def _get_constant_density_mask(cell_count_per_voxel):
+    """Helper function that returns the most frequent nonzero cell count per voxel and the mask
+    of the voxels that have this cell count."""
+    values, nb_voxels = np.unique(
+        cell_count_per_voxel[cell_count_per_voxel > 0], return_counts=True
+    )
+    if len(values) == 0:
+        return 0.0, np.zeros_like(cell_count_per_voxel, dtype=bool)
+    value = values[np.argmax(nb_voxels)]
+    return value, cell_count_per_voxel == value
+
+
+def _tile_periodic_pattern(pattern, side, mask, rng):
+    """Helper function that translates the periodic `pattern` by a random offset, tiles it over
+    the bounding box of `mask`, and keeps the points in the voxels of `mask`.
+
+    The pattern and the returned points are in voxel index coordinates.
+    """
+    bbox_idx = get_bbox_indices_nonzero_entries(mask)
+    offset = rng.random(3) * side
+    first = np.floor((bbox_idx[0] - offset) / side).astype(int)
+    last = np.floor((bbox_idx[1] + 1 - offset) / side).astype(int)
+    chunks = []
+    for tile_idx in np.ndindex(*(last - first + 1)):
+        points = pattern + offset + (first + tile_idx) * side
+        idx = np.floor(points).astype(int)
+        inside = np.all((idx >= bbox_idx[0]) & (idx <= bbox_idx[1]), axis=1)
+        points, idx = points[inside], idx[inside]
+        chunks.append(points[mask[tuple(idx.T)]])
+    return np.concatenate(chunks)
+
+
+def _create_cell_positions_poisson_disc_pattern(density, density_factor, rng=None, stats=None):
+    """Create cell positions given cell density volumetric data, filling the constant density
+    region with a precomputed periodic poisson disc pattern.
+
+    The voxels that share the most frequent cell count (e.g. a region with a scalar density) are
+    filled by translating and clipping a tileable pattern built, or loaded from a cache, by
+    `poisson_disc_sampling.get_periodic_pattern`. The remaining voxels are sampled with
+    ``poisson_disc_vectorized``, keeping the minimum distance to the points of the pattern.
+    The patterns are cached on disk if the environment variable
+    ``BRAINBUILDER_POISSON_PATTERN_CACHE`` is set to a directory.
+
+    Args:
+        density(VoxelData): cell density (count / mm^3)
+        density_factor(float): reduce / increase density proportionally for all
+            voxels. Default is 1.0.
+        rng(numpy.random.Generator): (optional) random generator, see
+            `brainbuilder.utils.random.get_rng`.
+        stats(poisson_disc_sampling.SamplingStats): (optional) statistics of the sampling
+            outside of the pattern, added to by the run.
+
+    Returns:
+        numpy.array: array of positions of shape (nb_points, 3) where each row
+        represents a cell and the columns correspond to (x, y, z).
+    """
+    cell_count_per_voxel, cell_count = _get_cell_count(density, density_factor)
+
+    if cell_count == 0:
+        L.warning("Density resulted in zero cell counts.")
+        return np.empty((0, 3), dtype=np.float32)
+
+    rng = get_rng(rng)
+    value, constant = _get_constant_density_mask(cell_count_per_voxel)
+    if np.count_nonzero(constant) < POISSON_DISC_PATTERN_MIN_VOXELS:
+        return _generate_poisson_disc_positions(
+            density, cell_count_per_voxel, cell_count, vectorized=True, stats=stats, rng=rng
+        )
+
+    _assert_cubic_voxels(density)
+    # same minimum distance as LocalDistanceField, in voxel units
+    pattern, side = poisson_disc_sampling.get_periodic_pattern(
+        value,
+        np.nextafter(0.84 / np.cbrt(value), np.inf),
+        cache_dir=os.environ.get(POISSON_DISC_PATTERN_CACHE_ENV),
+    )
+    points = _tile_periodic_pattern(pattern, side, constant, rng)
+    constant_count = int(np.round(value * np.count_nonzero(constant)))
+    if len(points) > constant_count:
+        points = points[np.sort(rng.choice(len(points), constant_count, replace=False))]
+    elif len(points) < constant_count:
+        L.info(
+            "The pattern fills the constant density region with %d cells out of %d",
+            len(points),
+            constant_count,
+        )
+    points = density.indices_to_positions(points)
+
+    # the shortfall of the pattern is not moved to the other voxels, it would raise their density
+    varying = np.where(constant, 0.0, cell_count_per_voxel)
+    varying_count = int(np.round(np.sum(varying)))
+    if varying_count <= 0 or not np.any(varying > 0):
+        return points
+    L.debug("Sampling %d cells outside of the constant density region", varying_count)
+    return np.concatenate(
+        [
+            points,
+            _generate_poisson_disc_positions(
+                density,
+                varying,
+                varying_count,
+                vectorized=True,
+                existing_points=points,
+                stats=stats,
+                rng=rng,
+            ),
+        ]
+    )
+
+
+def create_cell_positions(
+    density, density_factor=1.0, method="basic", seed=None, rng=None, stats=None
+):
     """Given cell density volumetric data, create cell positions.
 
     Total cell count is calculated based on cell density values.
@@ -173,12 +703,31 @@ def create_cell_positions(density, density_factor=1.0, method="basic", seed=None
             Default is ``basic`` and the possible values are:
 
             - ``basic``: generated positions may collide or form clusters
+            - ``multinomial``: same as ``basic``, but the cell count of each voxel is drawn
+              at once and the positions are generated block by block, as float32
+            - ``stratified``: the cells of each voxel are placed in distinct random strata
+              of the voxel, which gives fewer collisions than ``basic`` at a similar cost
+              when the voxels hold several cells each (not at about one cell per voxel)
             - ``poisson_disc``: positions are created with poisson disc sampling algorithm
               where minimum distance between points is modulated based on density values
+            - ``poisson_disc_vectorized``: same as ``poisson_disc``, but the candidates around
+              each point are generated and checked for collisions in batches
+            - ``poisson_disc_adaptive``: same as ``poisson_disc``, but fewer candidates are
+              tried where they are seldom accepted (the remaining ones are only tried if the
+              sampling runs out of points), and the reseeding goes on in the regions where it
+              still succeeds
+            - ``poisson_disc_parallel``: same as ``poisson_disc_vectorized``, but the domain is
+              split into tiles that are sampled in parallel processes
+            - ``poisson_disc_pattern``: same as ``poisson_disc_vectorized``, but the region of
+              constant density is filled with a precomputed tileable poisson disc pattern
 
         seed(int): (optional) the numpy random seed to be used.
             Defaults to None, in which case the seed is not set and the outcome
             cannot be predicted.
+        rng(numpy.random.Generator): (optional) random generator, used instead of `seed`.
+            If neither is given, a generator is seeded from the global numpy random state.
+        stats(poisson_disc_sampling.SamplingStats): (optional) statistics of the poisson disc
+            methods, added to by the run; ignored by the other methods.
 
     Returns:
         numpy.array: array of positions of shape (cell_count, 3) where each row represents
@@ -187,12 +736,19 @@ def create_cell_positions(density, density_factor=1.0, method="basic", seed=None
     if np.count_nonzero(density.raw < 0) != 0:
         raise ValueError("Found negative densities, aborting")
 
-    if seed is not None:
-        np.random.seed(seed)  # make the output reproducible
+    rng = get_rng(seed if rng is None else rng)
 
     position_generators = {
         "basic": _create_cell_positions_uniform,
+        "multinomial": _create_cell_positions_multinomial,
+        "stratified": _create_cell_positions_stratified,
         "poisson_disc": _create_cell_positions_poisson_disc,
+        "poisson_disc_vectorized": partial(_create_cell_positions_poisson_disc, vectorized=True),
+        "poisson_disc_adaptive": partial(_create_cell_positions_poisson_disc, adaptive=True),
+        "poisson_disc_parallel": _create_cell_positions_poisson_disc_parallel,
+        "poisson_disc_pattern": _create_cell_positions_poisson_disc_pattern,
     }
 
-    return position_generators[method](density, density_factor)
+    if method.startswith("poisson_disc"):
+        return position_generators[method](density, density_factor, rng=rng, stats=stats)
+    return position_generators[method](density, density_factor, rng=rng)
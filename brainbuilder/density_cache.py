@@ -0,0 +1,201 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Density volumes of the cell groups of a recipe, loaded once per source."""
+
+import logging
+import numbers
+
+import nrrd
+import numpy as np
+from voxcell import VoxelData
+
+from brainbuilder.exceptions import BrainBuilderError
+
+L = logging.getLogger(__name__)
+
+# number of density values validated at once, see `check_density_values`
+DENSITY_CHECK_CHUNK_SIZE = 1 << 20
+
+
+def _get_density_path(value, atlas):
+    """Helper function that returns the path of the density volume of a recipe entry, from an
+    '{dataset}' atlas dataset or a NRRD file."""
+    if value.startswith("{"):
+        assert value.endswith("}")
+        dataset = value[1:-1]
+        L.info("Loading 3D density profile from '%s' atlas dataset...", dataset)
+        return atlas.fetch_data(dataset)
+    elif value.endswith(".nrrd"):
+        L.info("Loading 3D density profile from '%s'...", value)
+        return value
+    else:
+        raise BrainBuilderError(f"Unexpected density value: '{value}'")
+
+
+def _mmap_nrrd(filepath):
+    """Helper function that memory-maps a NRRD file.
+
+    Only 3D float volumes with raw encoding and an attached header are supported.
+
+    Returns:
+        VoxelData with a read-only memmap as raw data, or None if the file is not supported.
+    """
+    with open(filepath, "rb") as fh:
+        header = nrrd.read_header(fh)
+        data_offset = fh.tell()
+
+    dtype = {"float": "f4", "double": "f8"}.get(header["type"])
+    if (
+        dtype is None
+        or header["encoding"] != "raw"
+        or len(header["sizes"]) != 3
+        or any(key in header for key in ("data file", "datafile", "line skip", "byte skip"))
+    ):
+        return None
+
+    if "space directions" in header:
+        directions = np.array(header["space directions"], dtype=np.float32)
+        if np.count_nonzero(directions - np.diag(directions.diagonal())):
+            return None
+        spacings = directions.diagonal()
+    elif "spacings" in header:
+        spacings = np.array(header["spacings"], dtype=np.float32)
+    else:
+        return None
+
+    offset = None
+    if "space origin" in header:
+        offset = np.array(header["space origin"], dtype=np.float32)
+
+    endian = ">" if header.get("endian") == "big" else "<"
+    raw = np.memmap(
+        filepath,
+        dtype=np.dtype(endian + dtype),
+        mode="r",
+        offset=data_offset,
+        shape=tuple(header["sizes"]),
+        order="F",
+    )
+    return VoxelData(raw, spacings, offset)
+
+
+def check_density_values(result):
+    """Validates the density values within the region mask, and zeroes the near zero values in
+    place.
+
+    The values are processed in chunks of `DENSITY_CHECK_CHUNK_SIZE`, in a single pass.
+    """
+    # a view of the values, in memory order, as long as they are contiguous
+    flat = result.ravel(order="K")
+    nb_zeroed = 0
+    for start in range(0, len(flat), DENSITY_CHECK_CHUNK_SIZE):
+        chunk = flat[start : start + DENSITY_CHECK_CHUNK_SIZE]
+        if np.isnan(chunk).any():
+            raise BrainBuilderError("NaN density values within region mask")
+
+        # Densities smaller than 1e-7 per mm3 correspond to less than 1 cell for the whole
+        # brain. For example, mouse brain volume is ~600 mm3 and human brain ~1260000 mm3.
+        # Allowing extremely small numbers introduces noise into the placement and should be
+        # ideally addressed at the density generation stage. However, given that this is not
+        # always the case, the near zero values will be zeroed to ensure the correct behavior
+        # of the algorithm.
+        near_zero = (np.abs(chunk) <= 1e-7) & (chunk != 0.0)
+        if near_zero.any():
+            nb_zeroed += np.count_nonzero(near_zero)
+            chunk[near_zero] = 0.0
+
+    if nb_zeroed:
+        L.warning("%d Near zero values smaller than 1e-7 found and will be zeroed.", nb_zeroed)
+        if not np.shares_memory(flat, result):
+            result[...] = np.where(np.abs(result) <= 1e-7, 0.0, result)
+
+
+def get_roi(mask):
+    """Returns the slices of the bounding box of a boolean mask."""
+    result = []
+    for axis in range(mask.ndim):
+        other_axes = tuple(i for i in range(mask.ndim) if i != axis)
+        idx = np.flatnonzero(np.any(mask, axis=other_axes))
+        if len(idx) == 0:
+            raise BrainBuilderError("Empty region of interest")
+        result.append(slice(int(idx[0]), int(idx[-1]) + 1))
+    return tuple(result)
+
+
+def crop(voxel_data, roi):
+    """Crops a VoxelData to the `roi` slices, keeping it in place in the global frame.
+
+    Memory-mapped data is cropped to a memmap view; loaded data is copied, so that the full
+    volume can be released.
+    """
+    raw = voxel_data.raw[roi]
+    if not isinstance(raw, np.memmap):
+        raw = raw.copy()
+    result = voxel_data.with_data(raw)
+    result.offset = voxel_data.indices_to_positions(np.array([s.start for s in roi]))
+    return result
+
+
+class DensityCache:
+    """Density volumes of the recipe, loaded once per source and shared by the cell groups.
+
+    The volumes are kept in the dtype of their file (or cast to `dtype`), and optionally
+    memory-mapped when the NRRD file allows it; the cell groups only read the density values
+    at their voxels.
+    """
+
+    def __init__(self, atlas, dtype=None, mmap=False, roi=None):
+        """Constructor
+
+        Args:
+            atlas: Atlas to use for loading atlas datasets
+            dtype: optional dtype of the loaded volumes (e.g. float32 to halve their memory)
+            mmap: whether to memory-map the uncompressed NRRD files instead of loading them
+            roi: optional slices of the region of interest (see `get_roi`) the volumes are
+                cropped to
+        """
+        self.atlas = atlas
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.mmap = mmap
+        self.roi = roi
+        self._volumes = {}
+
+    def __len__(self):
+        return len(self._volumes)
+
+    @property
+    def volumes(self):
+        """Loaded density volumes."""
+        return list(self._volumes.values())
+
+    def get(self, value):
+        """Returns the density VoxelData of the '{dataset}' or NRRD path `value`."""
+        if value not in self._volumes:
+            filepath = _get_density_path(value, self.atlas)
+            result = _mmap_nrrd(filepath) if self.mmap else None
+            if result is None:
+                result = VoxelData.load_nrrd(filepath)
+            if self.roi is not None:
+                result = crop(result, self.roi)
+            if self.dtype is not None and result.raw.dtype != self.dtype:
+                result = result.with_data(result.raw.astype(self.dtype))
+            self._volumes[value] = result
+        return self._volumes[value]
+
+    def get_values(self, value, voxels):
+        """Returns the validated densities of `value` at the given flat voxel indices.
+
+        `value` is a constant density, a NRRD path or a '{dataset}' of the atlas; the near zero
+        densities are zeroed, see `check_density_values`.
+
+        Returns:
+            float64 numpy array of the same length as `voxels`.
+        """
+        if isinstance(value, numbers.Number):
+            result = np.full(len(voxels), float(value))
+        else:
+            raw = self.get(value).raw
+            result = raw[np.unravel_index(voxels, raw.shape)].astype(np.float64)
+
+        check_density_values(result)
+
+        return result
@@ -0,0 +1,734 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Placement of the cells of a recipe in an atlas, with the properties derived from the atlas and
+from the mtypes, in memory or to SONATA files, in shards or in variants."""
+
+import hashlib
+import json
+import logging
+import shutil
+from contextlib import ExitStack
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+from joblib import effective_n_jobs
+from voxcell import CellCollection, ROIMask
+from voxcell.nexus.voxelbrain import Atlas
+
+from brainbuilder.atlas_lookup import (
+    AtlasLookup,
+    get_region_attribute_table,
+    region_ids_to_attribute,
+)
+from brainbuilder.cell_group_cache import DEFAULT_MAX_SIZE, CellGroupCache
+from brainbuilder.cell_groups import (
+    concat_cells,
+    estimate_cell_groups,
+    get_voxel_densities,
+    iter_cell_groups,
+    split_batches,
+)
+from brainbuilder.density_cache import DensityCache, crop, get_roi
+from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.region_index import RegionIndex
+from brainbuilder.space_filling_curves import CURVES
+from brainbuilder.utils import deprecate, make_categorical
+from brainbuilder.utils.bbp import load_cell_composition
+from brainbuilder.utils.sonata.curate import get_population_name
+from brainbuilder.utils.sonata.write_nodes import (
+    NodePopulationWriter,
+    load_libraries,
+    read_cells,
+)
+
+L = logging.getLogger(__name__)
+
+# number of cells copied at once by `merge_shards`
+MERGE_CHUNK_SIZE = 1 << 20
+
+
+def load_mtype_taxonomy(filepath):
+    """
+    Load mtype taxonomy from TSV file.
+
+    The file has one row per mtype, with its 'mtype', morphological class ('mClass', e.g. PYR /
+    INT) and synapse class ('sClass', e.g. EXC / INH).
+
+    Raises:
+        BrainBuilderError if the columns are missing or if an mtype is duplicated.
+    """
+    result = pd.read_csv(filepath, sep=r"\s+", index_col="mtype")
+    missing = sorted({"mClass", "sClass"} - set(result.columns))
+    if missing:
+        raise BrainBuilderError(f"Missing columns {missing} in mtype taxonomy: {filepath}")
+    duplicated = sorted(set(result.index[result.index.duplicated()]))
+    if duplicated:
+        raise BrainBuilderError(f"Duplicate mtypes {duplicated} in mtype taxonomy: {filepath}")
+    return result
+
+
+def load_mini_frequencies(filepath):
+    """
+    Load mini frequencies from a TSV file.
+    """
+    return pd.read_csv(filepath, sep=r"\s+", index_col="layer", dtype={"layer": str})
+
+
+def _get_category_rows(values, table, name):
+    """Helper function that looks up `table` once per category of the values of the cells.
+
+    Returns:
+        tuple of the category code of each cell, and of the rows of `table` of the categories.
+    """
+    values = pd.Categorical(values).remove_unused_categories()
+    if np.any(values.codes < 0):
+        raise BrainBuilderError(f"Missing '{name}' values")
+    return values.codes, table.loc[values.categories]
+
+
+def _take_categories(values, codes):
+    """Helper function that takes the values of the categories of the cells; string values are
+    returned as a categorical."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy()[codes]
+    value_codes, uniques = pd.factorize(values)
+    return make_categorical(value_codes[codes], uniques)
+
+
+def _join_categorical(left, right, sep):
+    """Helper function that joins the string values of two columns with `sep`, as a
+    categorical built from the pairs of codes."""
+    left, right = pd.Categorical(left), pd.Categorical(right)
+    pairs = left.codes.astype(np.int64) * len(right.categories) + right.codes
+    valid = (left.codes >= 0) & (right.codes >= 0)
+    codes = np.full(len(pairs), -1, dtype=np.int64)
+    codes[valid], uniques = pd.factorize(pairs[valid])
+    n = len(right.categories)
+    categories = [f"{left.categories[u // n]}{sep}{right.categories[u % n]}" for u in uniques]
+    return make_categorical(codes, categories)
+
+
+def _assign_subregions(cells, brain_regions, region_map, atlas_lookup=None):
+    if atlas_lookup is None:
+        subregion_index = brain_regions.lookup(cells[["x", "y", "z"]].to_numpy())
+    else:
+        subregion_index = atlas_lookup.lookup(brain_regions)
+    _assign_property(
+        cells,
+        "subregion",
+        region_ids_to_attribute(subregion_index, get_region_attribute_table(region_map)),
+    )
+
+
+def _assign_property(cells, prop, values):
+    if prop in cells:
+        raise BrainBuilderError(f"Duplicate property: '{prop}'")
+    cells[prop] = values
+
+
+def _assign_mtype_traits(cells, mtype_taxonomy):
+    codes, traits = _get_category_rows(cells["mtype"], mtype_taxonomy, "mtype")
+    _assign_property(cells, "morph_class", _take_categories(traits["mClass"], codes))
+    _assign_property(cells, "synapse_class", _take_categories(traits["sClass"], codes))
+
+
+def _assign_mini_frequencies(cells, mini_frequencies):
+    """
+    Add the mini_frequency column to `cells`.
+    """
+    if "layer" in cells:
+        name = "layer"
+    else:
+        # fallback to subregion; this requires that the mini_frequencies file uses subregions,
+        # and not layer names
+        name = "subregion"
+
+    codes, mfreqs = _get_category_rows(cells[name], mini_frequencies, name)
+
+    _assign_property(
+        cells, "exc_mini_frequency", _take_categories(mfreqs.exc_mini_frequency, codes)
+    )
+    _assign_property(
+        cells, "inh_mini_frequency", _take_categories(mfreqs.inh_mini_frequency, codes)
+    )
+
+
+def _assign_atlas_property(cells, prop, atlas_lookup, dset):
+    if dset == "FAST-HEMISPHERE":
+        # deprecated: the hemisphere is looked up in a volumetric dataset instead, see below
+        deprecate.warn("`FAST-HEMISPHERE` is deprecated, use a volumetric dataset")
+        values = make_categorical(
+            (cells["z"].to_numpy() >= 5700).astype(np.int64), ["left", "right"]
+        )
+    elif prop == "hemisphere":
+        values = atlas_lookup.lookup_hemisphere(dset)
+    elif dset.startswith("~"):
+        values = atlas_lookup.lookup_region_attribute(dset[1:], attr="acronym")
+    else:
+        values = atlas_lookup.lookup(dset)
+
+    _assign_property(cells, prop, values)
+
+
+def _assign_cell_properties(
+    cells,
+    atlas,
+    atlas_lookup,
+    mtype_taxonomy,
+    mini_frequencies,
+    atlas_properties,
+    append_hemisphere,
+    curves=(),
+):
+    """Assigns the properties derived from the atlas and from the mtypes to a batch of cells,
+    and the indices of their voxels along the given space-filling `curves`."""
+    # pylint: disable=too-many-arguments
+    L.debug("Assigning 'subregion'")
+    _assign_subregions(
+        cells,
+        atlas.load_data("brain_regions"),
+        atlas.load_region_map(),
+        atlas_lookup=atlas_lookup,
+    )
+
+    L.debug("Assigning 'morph_class' / 'synapse_class'...")
+    _assign_mtype_traits(cells, mtype_taxonomy)
+
+    if mini_frequencies is not None:
+        L.debug("Assigning mini-frequencies")
+        _assign_mini_frequencies(cells, mini_frequencies)
+
+    for prop, dset in atlas_properties or []:
+        L.debug("Assigning '%s'...", prop)
+        _assign_atlas_property(cells, prop, atlas_lookup, dset)
+
+    if append_hemisphere:
+        cells["region"] = _join_categorical(cells["region"], cells["hemisphere"], "@")
+
+    for curve in curves:
+        L.debug("Assigning '%s'...", curve)
+        brain_regions = atlas.load_data("brain_regions")
+        indices = np.stack(atlas_lookup.get_indices(brain_regions), axis=1)
+        _assign_property(cells, curve, CURVES[curve](indices, brain_regions.shape))
+
+
+def _load_placement_volumes(atlas, region, mask_dset, density_dtype, mmap_densities):
+    """Helper function that indexes the voxels of the regions where the cells are placed.
+
+    Returns:
+        tuple of the RegionIndex, cropped to the `region` / `mask_dset` filter, and of the
+        DensityCache of the density volumes.
+    """
+    # Cache frequently used atlas data
+    atlas.load_data("brain_regions", memcache=True)
+    atlas.load_region_map(memcache=True)
+
+    if mask_dset is None:
+        root_mask = None
+    else:
+        root_mask = atlas.load_data(mask_dset, cls=ROIMask)
+
+    if region is not None:
+        region_mask = atlas.get_region_mask(region, with_descendants=True)
+        if root_mask is None:
+            root_mask = region_mask
+        else:
+            root_mask.raw &= region_mask.raw
+
+    # with a region / mask filter, all the atlas data is cropped to its bounding box
+    brain_regions = atlas.load_data("brain_regions", memcache=True)
+    if root_mask is None:
+        roi = None
+    else:
+        roi = get_roi(root_mask.raw)
+        L.info("Cropping to region of interest: %s", [(s.start, s.stop) for s in roi])
+        brain_regions = crop(brain_regions, roi)
+        root_mask = root_mask.raw[roi]
+
+    L.info("Indexing region voxels...")
+    region_index = RegionIndex(brain_regions, atlas.load_region_map(memcache=True), mask=root_mask)
+    density_cache = DensityCache(atlas, dtype=density_dtype, mmap=mmap_densities, roi=roi)
+
+    return region_index, density_cache
+
+
+def _iter_placed_variants(
+    variants,
+    composition_path,
+    mtype_taxonomy_path,
+    atlas_url,
+    mini_frequencies_path=None,
+    atlas_cache=None,
+    region=None,
+    mask_dset=None,
+    soma_placement="basic",
+    atlas_properties=None,
+    append_hemisphere=False,
+    jobs=1,
+    density_dtype=None,
+    mmap_densities=False,
+    curves=(),
+    cache_dir=None,
+    cache_max_size=DEFAULT_MAX_SIZE,
+    shard=None,
+):
+    """Generates the placed cells of several variants of the placement, with all their
+    properties, batch of cell groups by batch (see `iter_cell_groups`).
+
+    The atlas, the recipe and the density volumes are loaded and indexed once for all the
+    variants; with several variants, the voxels and the densities of every group are gathered
+    once as well (see `get_voxel_densities`), only the sampling of the cells is repeated.
+
+    The index of the voxel of every cell along each of the space-filling `curves` (see
+    `brainbuilder.space_filling_curves.CURVES`) is assigned as a property named after it.
+
+    With a `cache_dir`, the cells of the groups are cached there (see `CellGroupCache`), up to
+    `cache_max_size` bytes.
+
+    With a `shard` (index, count) pair, only the groups of this shard are placed, see
+    `_get_shard_groups`.
+
+    Args:
+        variants: list of the (seed, density_factor) pairs of the variants
+
+    Yields:
+        tuple of the seed and of the density factor of each variant, and of a generator of the
+        tuples of the indices of the groups of each batch, of the DataFrame of their cells and of
+        the cell count of each group; it must be consumed before the next variant.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    atlas = Atlas.open(atlas_url, cache_dir=atlas_cache)
+
+    recipe = load_cell_composition(composition_path)
+    conf_list = recipe["neurons"]
+    mtype_taxonomy = load_mtype_taxonomy(mtype_taxonomy_path)
+    if mini_frequencies_path is None:
+        mini_frequencies = None
+    else:
+        mini_frequencies = load_mini_frequencies(mini_frequencies_path)
+
+    region_index, density_cache = _load_placement_volumes(
+        atlas, region, mask_dset, density_dtype, mmap_densities
+    )
+
+    # the atlas datasets are loaded once, and the voxels of the cells of a batch are looked up
+    # once for all of them
+    atlas_lookup = AtlasLookup(np.empty((0, 3)), atlas)
+
+    cache = None if cache_dir is None else CellGroupCache(cache_dir, max_size=cache_max_size)
+
+    voxel_densities = {} if len(variants) > 1 else None
+
+    def _iter_batches(seed, density_factor, density_cache):
+        indices = None
+        if shard is not None:
+            L.info("Assigning cell groups to shard %d / %d...", *shard)
+            # the densities of all the groups are loaded for the estimate only: they are
+            # released before the placement, which loads the ones of the groups of the shard
+            estimate_cache = DensityCache(
+                atlas, dtype=density_dtype, mmap=mmap_densities, roi=density_cache.roi
+            )
+            cell_counts = estimate_cell_groups(
+                conf_list, estimate_cache, region_index, density_factor, soma_placement
+            )["cell_count"]
+            del estimate_cache
+            indices = _get_shard_groups(cell_counts.to_numpy(), *shard)
+
+        if voxel_densities is not None:
+            L.info("Gathering the voxel densities of the cell groups...")
+            get_voxel_densities(
+                conf_list,
+                range(len(conf_list)) if indices is None else indices,
+                density_cache,
+                region_index,
+                voxel_densities,
+            )
+
+        L.info("Creating cell groups...")
+        count = 0
+        for batch, cells, counts in iter_cell_groups(
+            conf_list,
+            density_cache,
+            region_index,
+            density_factor,
+            soma_placement,
+            seed,
+            jobs,
+            cache=cache,
+            indices=indices,
+            voxel_densities=voxel_densities,
+        ):
+            _assign_cell_properties(
+                cells,
+                atlas,
+                atlas_lookup.with_positions(cells[["x", "y", "z"]].to_numpy()),
+                mtype_taxonomy,
+                mini_frequencies,
+                atlas_properties,
+                append_hemisphere,
+                curves=curves,
+            )
+            count += len(cells)
+            L.debug("Created %d cells", count)
+            yield batch, cells, counts
+
+        L.info("Total cell count: %d", count)
+
+    for seed, density_factor in variants:
+        if len(variants) > 1:
+            L.info("Placing variant: seed %d, density factor %g", seed, density_factor)
+        yield seed, density_factor, _iter_batches(seed, density_factor, density_cache)
+
+
+def _iter_placed_cells(seed=0, density_factor=1.0, **kwargs):
+    """Generates the placed cells of a single placement, see `_iter_placed_variants`.
+
+    Yields:
+        tuple of the indices of the groups of each batch, of the DataFrame of their cells and of
+        the cell count of each group.
+    """
+    for _, _, batches in _iter_placed_variants([(seed, density_factor)], **kwargs):
+        yield from batches
+
+
+def _estimate_peak_memory(groups, region_index, density_cache, jobs):
+    """Helper function that estimates the peak memory (bytes) of a placement from the estimates
+    of its cell groups.
+
+    The atlas data and the densities are held for the whole placement, the groups of a batch are
+    placed at once (see `split_batches`), in `jobs` processes.
+
+    Returns:
+        tuple of the memory and of the number of processes placing the batches.
+    """
+    memory = region_index.brain_regions.raw.nbytes + region_index.voxels.nbytes
+    memory += sum(
+        volume.raw.nbytes
+        for volume in density_cache.volumes
+        if not isinstance(volume.raw, np.memmap)
+    )
+    batches = split_batches(np.arange(len(groups)), jobs)
+    nb_processes = 1 if jobs == 1 else min(effective_n_jobs(jobs), len(batches))
+    batch_memory = [int(np.sum(groups["memory"].to_numpy()[batch])) for batch in batches]
+    memory += sum(sorted(batch_memory)[-nb_processes:])
+    return int(memory), nb_processes
+
+
+def estimate_placement(
+    composition_path,
+    atlas_url,
+    atlas_cache=None,
+    region=None,
+    mask_dset=None,
+    soma_placement="basic",
+    density_factor=1.0,
+    jobs=1,
+    density_dtype=None,
+    mmap_densities=False,
+):
+    """Estimates the placement of the cells on the real atlas, without sampling them.
+
+    Returns:
+        tuple of the DataFrame of the estimates of each group (see `estimate_cell_groups`),
+        and of a dict of the totals: cell count, peak memory (bytes) and runtime (seconds).
+    """
+    # pylint: disable=too-many-arguments
+    region_index, density_cache = _load_placement_volumes(
+        Atlas.open(atlas_url, cache_dir=atlas_cache),
+        region,
+        mask_dset,
+        density_dtype,
+        mmap_densities,
+    )
+
+    L.info("Estimating cell groups...")
+    groups = estimate_cell_groups(
+        load_cell_composition(composition_path)["neurons"],
+        density_cache,
+        region_index,
+        density_factor,
+        soma_placement,
+    )
+    memory, nb_processes = _estimate_peak_memory(groups, region_index, density_cache, jobs)
+
+    return groups, {
+        "cell_count": int(groups["cell_count"].sum()),
+        "memory": memory,
+        "runtime": float(groups["runtime"].sum() / nb_processes),
+    }
+
+
+def place(
+    input_path,
+    composition_path,
+    mtype_taxonomy_path,
+    atlas_url,
+    mini_frequencies_path=None,
+    atlas_cache=None,
+    region=None,
+    mask_dset=None,
+    soma_placement="basic",
+    density_factor=1.0,
+    atlas_properties=None,
+    sort_by=None,
+    append_hemisphere=False,
+    seed=0,
+    jobs=1,
+    density_dtype=None,
+    mmap_densities=False,
+    cache_dir=None,
+    cache_max_size=DEFAULT_MAX_SIZE,
+):
+    """Places the cells of the recipe in the atlas, with all their properties.
+
+    The cells are sorted by the `sort_by` properties, which may include the indices of their
+    voxels along space-filling curves (see `brainbuilder.space_filling_curves.CURVES`). With an
+    `input_path`, the cells of this CellCollection are extended with the new cells; the
+    numerical properties missing from either of them are NaN.
+
+    Returns:
+        CellCollection of the cells.
+    """
+    # pylint: disable=too-many-arguments, too-many-locals
+    batches = _iter_placed_cells(
+        composition_path=composition_path,
+        mtype_taxonomy_path=mtype_taxonomy_path,
+        atlas_url=atlas_url,
+        mini_frequencies_path=mini_frequencies_path,
+        atlas_cache=atlas_cache,
+        region=region,
+        mask_dset=mask_dset,
+        soma_placement=soma_placement,
+        density_factor=density_factor,
+        atlas_properties=atlas_properties,
+        append_hemisphere=append_hemisphere,
+        seed=seed,
+        jobs=jobs,
+        density_dtype=density_dtype,
+        mmap_densities=mmap_densities,
+        curves=[key for key in sort_by or [] if key in CURVES],
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+    )
+    result = concat_cells(cells for _, cells, _ in batches)
+
+    if sort_by:
+        L.info("Sorting CellCollection...")
+        result.sort_values(sort_by, inplace=True)
+
+    L.info("Done!")
+
+    result.index = 1 + np.arange(len(result))
+    if input_path is None:
+        return CellCollection.from_dataframe(result)
+    input_cells = CellCollection.load(input_path)
+    result = concat_cells([input_cells.as_dataframe(), result])
+    result.index = 1 + np.arange(len(result))
+    out_cells = CellCollection.from_dataframe(result)
+    out_cells.population_name = input_cells.population_name
+    return out_cells
+
+
+def _get_shard_groups(cell_counts, shard, nb_shards):
+    """Returns the sorted indices of the cell groups placed by one of `nb_shards` shards.
+
+    The groups are assigned one by one, the largest expected cell count first, to the shard
+    with the fewest cells so far: the assignment only depends on the counts.
+    """
+    loads = np.zeros(nb_shards, dtype=np.int64)
+    assignment = np.empty(len(cell_counts), dtype=np.int64)
+    for i in np.argsort(-np.asarray(cell_counts), kind="stable"):
+        assignment[i] = np.argmin(loads)
+        loads[assignment[i]] += cell_counts[i]
+    return np.flatnonzero(assignment == shard)
+
+
+def _get_placement_key(kwargs):
+    """Returns a hash of the recipe and of the options the cells or their properties depend on,
+    to check that shards can be merged.
+
+    The files of the recipe, of the mtype taxonomy and of the mini frequencies are hashed by
+    content, the atlas by its URL and cache directory.
+    """
+    params = {
+        "recipe": load_cell_composition(kwargs["composition_path"]),
+        **{
+            name: None if kwargs.get(name) is None else Path(kwargs[name]).read_text("utf-8")
+            for name in ["mtype_taxonomy_path", "mini_frequencies_path"]
+        },
+        **{
+            name: kwargs.get(name)
+            for name in [
+                "atlas_url",
+                "atlas_cache",
+                "region",
+                "mask_dset",
+                "soma_placement",
+                "density_factor",
+                "atlas_properties",
+                "append_hemisphere",
+                "curves",
+                "seed",
+                "density_dtype",
+            ]
+        },
+    }
+    return hashlib.blake2b(
+        json.dumps(params, sort_keys=True, default=str).encode(), digest_size=20
+    ).hexdigest()
+
+
+def _copy_input_cells(input_path, output):
+    """Copies the SONATA file of the input cells to `output`, unless it is the same file."""
+    if not Path(output).exists() or not Path(output).samefile(input_path):
+        shutil.copyfile(input_path, output)
+
+
+def place_to_sonata(output, input_path=None, shard=None, **kwargs):
+    """Places the cells like `place` without sorting them, writing them to the SONATA file
+    `output` batch by batch instead of holding all of them in memory.
+
+    The cells of `input_path` are copied to `output` and extended with the new cells, as in
+    `place` the numerical properties missing from either of them are NaN.
+
+    With a `shard` (index, count) pair, only the cell groups of this shard are placed (see
+    `_get_shard_groups`); the indices and the cell counts of the groups are written to the
+    'shard' group of the population, for `merge_shards`.
+
+    Raises:
+        BrainBuilderError if the new cells do not have the properties of the input cells.
+    """
+    if input_path is None:
+        population_name, mode = CellCollection().population_name, "w"
+    else:
+        if shard is not None:
+            raise BrainBuilderError("Shards cannot extend input cells, merge them into these")
+        population_name, mode = get_population_name(input_path), "a"
+        _copy_input_cells(input_path, output)
+
+    groups, counts = [], []
+    with NodePopulationWriter(output, population_name, mode=mode) as writer:
+        for batch, cells, batch_counts in _iter_placed_cells(shard=shard, **kwargs):
+            writer.append(cells)
+            groups.append(batch)
+            counts.append(batch_counts)
+        L.info("Done! %d cells in '%s'", writer.size, population_name)
+
+        if shard is not None:
+            meta = writer.population.create_group("shard")
+            meta.attrs["placement_key"] = _get_placement_key(kwargs)
+            meta.attrs["shard"] = np.array(shard, dtype=np.int64)
+            meta.attrs["nb_groups"] = len(
+                load_cell_composition(kwargs["composition_path"])["neurons"]
+            )
+            meta.create_dataset("groups", data=np.concatenate(groups or [[]]).astype(np.int64))
+            meta.create_dataset(
+                "group_cell_counts", data=np.concatenate(counts or [[]]).astype(np.int64)
+            )
+
+
+def place_variants_to_sonata(output, variants, input_path=None, **kwargs):
+    """Places the cells of every (seed, density_factor) variant like `place_to_sonata`, the
+    atlas and the densities being loaded once for all of them (see `_iter_placed_variants`).
+
+    Args:
+        output: path of the SONATA output of the variants, formatted with their `seed` and
+            `density_factor` (e.g. 'nodes_{seed}_{density_factor}.h5')
+
+    Returns:
+        the paths of the outputs of the variants.
+
+    Raises:
+        BrainBuilderError if the variants do not have distinct outputs.
+    """
+    outputs = [
+        str(output).format(seed=seed, density_factor=density_factor)
+        for seed, density_factor in variants
+    ]
+    if len(set(outputs)) < len(outputs):
+        raise BrainBuilderError(
+            f"The variants do not have distinct outputs: '{output}', use the '{{seed}}' and"
+            " '{density_factor}' fields"
+        )
+
+    if input_path is None:
+        population_name, mode = CellCollection().population_name, "w"
+    else:
+        population_name, mode = get_population_name(input_path), "a"
+        # the input is copied before any variant is placed: one of them may extend it in place
+        for filepath in outputs:
+            _copy_input_cells(input_path, filepath)
+
+    for filepath, (_, _, batches) in zip(outputs, _iter_placed_variants(variants, **kwargs)):
+        with NodePopulationWriter(filepath, population_name, mode=mode) as writer:
+            for _, cells, _ in batches:
+                writer.append(cells)
+            L.info("Done! %d cells in '%s' of %s", writer.size, population_name, filepath)
+    return outputs
+
+
+def merge_shards(shard_paths, output, input_path=None):
+    """Concatenates the cells of the shards written by `place_to_sonata`, in recipe order.
+
+    The node ids are the ones of a single placement of all the groups.
+
+    Raises:
+        BrainBuilderError if the shards are not the complete set of the shards of a placement.
+    """
+    # pylint: disable=too-many-locals
+    with ExitStack() as stack:
+        shards = {}
+        for filepath in shard_paths:
+            h5f = stack.enter_context(h5py.File(filepath, "r"))
+            population = h5f[f"nodes/{get_population_name(filepath)}"]
+            if "shard" not in population:
+                raise BrainBuilderError(f"Not a shard of cells place: {filepath}")
+            meta = population["shard"]
+            index, count = (int(v) for v in meta.attrs["shard"])
+            if index in shards:
+                raise BrainBuilderError(f"Duplicate shard {index}: {filepath}")
+            shards[index] = (population, meta)
+
+        placements = {
+            (
+                str(meta.attrs["placement_key"]),
+                int(meta.attrs["nb_groups"]),
+                int(meta.attrs["shard"][1]),
+            )
+            for _, meta in shards.values()
+        }
+        if len(placements) > 1:
+            raise BrainBuilderError("The shards are not the ones of the same placement")
+        _, nb_groups, count = placements.pop()
+        if sorted(shards) != list(range(count)):
+            raise BrainBuilderError(f"Missing shards: {sorted(set(range(count)) - set(shards))}")
+
+        # the shard and the range of cells of each group
+        owners = np.full(nb_groups, -1, dtype=np.int64)
+        starts = np.zeros(nb_groups, dtype=np.int64)
+        stops = np.zeros(nb_groups, dtype=np.int64)
+        for index, (_, meta) in shards.items():
+            groups, counts = meta["groups"][()], meta["group_cell_counts"][()]
+            owners[groups] = index
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            starts[groups], stops[groups] = offsets[:-1], offsets[1:]
+        if np.any(owners < 0):
+            raise BrainBuilderError(f"Missing cell groups: {np.flatnonzero(owners < 0)}")
+
+        if input_path is None:
+            population_name, mode = shards[0][0].name.split("/")[-1], "w"
+        else:
+            population_name, mode = get_population_name(input_path), "a"
+            _copy_input_cells(input_path, output)
+
+        libraries = {index: load_libraries(population) for index, (population, _) in shards.items()}
+        with NodePopulationWriter(output, population_name, mode=mode) as writer:
+            # the consecutive groups of the same shard are consecutive in the shard
+            runs = np.flatnonzero(np.diff(owners, prepend=-1, append=-1))
+            for first, last in zip(runs[:-1], runs[1:]):
+                index = owners[first]
+                for start in range(starts[first], stops[last - 1], MERGE_CHUNK_SIZE):
+                    stop = min(start + MERGE_CHUNK_SIZE, stops[last - 1])
+                    writer.append(read_cells(shards[index][0], start, stop, libraries[index]))
+            L.info("Merged %d shards: %d cells in '%s'", count, writer.size, population_name)
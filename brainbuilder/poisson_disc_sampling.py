@@ -6,10 +6,40 @@ Credits:
 - https://github.com/IHautaI/poisson-disc
 """
 
+import itertools
+import logging
+import zlib
+from pathlib import Path
+
 import numpy as np
+from scipy.spatial import cKDTree
 from tqdm import tqdm
 
 from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.utils.random import get_rng
+
+L = logging.getLogger(__name__)
+
+# number of updates of the progress bar during the generation of the points
+PROGRESS_BAR_UPDATES = 1000
+
+# a SparseGrid is used when the fraction of the domain with nonzero density is below this value,
+# or when a dense Grid would need more memory than DENSE_GRID_MAX_BYTES
+SPARSE_GRID_MAX_NONZERO_FRACTION = 0.2
+DENSE_GRID_MAX_BYTES = 2 * 1024**3
+
+# expected number of points in a periodic pattern, see `get_periodic_pattern`
+PERIODIC_PATTERN_NB_POINTS = 4096
+# consecutive reseeds without any new point, after which a periodic pattern is complete
+PERIODIC_MAX_FAILED_RESEEDS = 10
+
+# adaptive trial budget: size of the regions, in grid cells along each axis, over which the
+# acceptance rate of the trials is tracked; acceptance rate below which the budget is lowered;
+# minimum budget; and maximum factor by which the reseeding budget of a region is escalated
+ADAPTIVE_REGION_SIZE = 8
+ADAPTIVE_MIN_ACCEPTANCE_RATE = 0.05
+ADAPTIVE_MIN_TRIALS = 4
+ADAPTIVE_MAX_RESEED_FACTOR = 16
 
 
 class Grid:
@@ -17,19 +47,49 @@ class Grid:
     contains one value:
         -1 : no sample present
         x, with 0 <= x : index of sample
+
+    Empty grid cells are drawn from a shuffled list of free cells, which is built with a full
+    scan of the grid only when it is exhausted; cells that got occupied in the meantime are
+    skipped lazily. The counters `nb_empty_cell_requests`, `nb_free_cells_scans` and
+    `nb_stale_free_cells` measure the number and the cost of these requests.
     """
 
-    def __init__(self, domain, cell_size):
+    def __init__(self, domain, cell_size, dtype=np.int64, rng=None):
         """Constructor
 
         Args:
             domain: (2, dim)-numpy.array
             cell_size: scalar
+            dtype: integer type of the stored sample indices
+            rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
         """
-        domain_size = domain[1, :] - domain[0, :]
-        self.grid = np.full((domain_size / cell_size + 1).astype(int), -1)
+        self.grid = np.full(get_grid_shape(domain, cell_size), -1, dtype=dtype)
         self.cell_size = cell_size
         self.domain = domain
+        self.rng = get_rng(rng)
+        self._free_cells = np.empty(0, dtype=np.int64)
+        self._free_cells_pos = 0
+        self.nb_empty_cell_requests = 0
+        self.nb_free_cells_scans = 0
+        self.nb_stale_free_cells = 0
+        self.fixed_points = None
+
+    @property
+    def shape(self):
+        """Number of grid cells along each dimension."""
+        return self.grid.shape
+
+    def set_fixed_points(self, points):
+        """Sets points, possibly outside the grid domain, that are not stored on the grid
+        but that new points must not collide with (e.g. samples of neighbouring domains)."""
+        self.fixed_points = cKDTree(points) if len(points) else None
+
+    def _no_collision_with_fixed_points(self, points, distances):
+        """Verifies that points do not lie closer than given distances to the fixed points."""
+        if self.fixed_points is None:
+            return np.ones(len(points), dtype=bool)
+        nearest, _ = self.fixed_points.query(points, distance_upper_bound=np.max(distances))
+        return nearest >= distances
 
     def get_grid_coords(self, point):
         """Returns grid coordinates of point."""
@@ -49,7 +109,7 @@ class Grid:
         # define neighbourhood
         nb_cells = int(np.ceil(distance / self.cell_size))
         min_corner = np.maximum(0, point_coords - nb_cells)
-        max_corner = np.minimum(self.grid.shape, point_coords + nb_cells + 1)
+        max_corner = np.minimum(self.shape, point_coords + nb_cells + 1)
         neighbourhood = self.grid[
             min_corner[0] : max_corner[0],
             min_corner[1] : max_corner[1],
@@ -63,28 +123,78 @@ class Grid:
         any other existing point.
 
         Args:
+            distance: minimum distance; an infinite distance (e.g. where no point is expected)
+                always collides, without any neighbourhood query
             sample_points: list of points that are already stored on this grid
         """
+        if not np.isfinite(distance):
+            return False
         neighbours = self.get_sample_indices_in_neighbourhood(point, distance)
 
-        return all((np.linalg.norm(sample_points[n] - point) >= distance) for n in neighbours)
+        return all(
+            (np.linalg.norm(sample_points[n] - point) >= distance) for n in neighbours
+        ) and bool(self._no_collision_with_fixed_points(point[np.newaxis], distance)[0])
+
+    def no_collision_batch(self, center, radius, points, distances, sample_points):
+        """Vectorized version of `no_collision` for a batch of candidate points.
+
+        Args:
+            center: point around which all the candidates lie
+            radius: radius of the ball around `center` that contains the neighbourhoods of
+                all the candidates (i.e. max distance to center + max candidate distance)
+            points: (N, dim)-numpy.array of candidate points
+            distances: (N,)-numpy.array of minimum distances of the candidates
+            sample_points: points that are already stored on this grid
+
+        Returns:
+            (N,)-numpy.array of booleans, True for candidates that do not collide
+        """
+        result = self._no_collision_with_fixed_points(points, distances)
+        neighbours = self.get_sample_indices_in_neighbourhood(center, radius)
+        if len(neighbours) == 0:
+            return result
+        neighbour_points = np.asarray(sample_points)[neighbours]
+        diff = points[:, np.newaxis, :] - neighbour_points[np.newaxis, :, :]
+        sq_dist = np.einsum("ijk,ijk->ij", diff, diff)
+        return result & np.all(sq_dist >= np.square(distances)[:, np.newaxis], axis=1)
 
     def domain_contains(self, point):
         """Verifies whether a given point is inside the grid domain."""
         return np.all((point >= self.domain[0, :]) & (point <= self.domain[1, :]))
 
+    def domain_contains_batch(self, points):
+        """Vectorized version of `domain_contains` for a (N, dim)-numpy.array of points."""
+        return np.all((points >= self.domain[0, :]) & (points <= self.domain[1, :]), axis=1)
+
+    def _scan_free_cells(self):
+        """Rebuilds the shuffled list of free cells from a full scan of the grid."""
+        free_cells = np.flatnonzero(self.grid == -1)
+        if free_cells.size and free_cells[-1] <= np.iinfo(np.int32).max:
+            free_cells = free_cells.astype(np.int32)
+        self.rng.shuffle(free_cells)
+        self._free_cells = free_cells
+        self._free_cells_pos = 0
+        self.nb_free_cells_scans += 1
+
     def get_random_empty_grid_cell(self):
         """Returns the grid coordinates of an empty grid cell.
 
+        Every empty cell is returned at most once between two scans of the grid.
+
         Raises:
             Error if no empty grid cells are present.
         """
-        indices = np.where(self.grid == -1)
-        if len(indices[0]):
-            choice = np.random.choice(len(indices[0]))
-            return indices[0][choice], indices[1][choice], indices[2][choice]
-        else:
-            raise BrainBuilderError("No empty cells present in this grid.")
+        self.nb_empty_cell_requests += 1
+        while True:
+            if self._free_cells_pos == len(self._free_cells):
+                self._scan_free_cells()
+                if not len(self._free_cells):
+                    raise BrainBuilderError("No empty cells present in this grid.")
+            flat_index = self._free_cells[self._free_cells_pos]
+            self._free_cells_pos += 1
+            if self.grid.flat[flat_index] == -1:
+                return np.unravel_index(flat_index, self.grid.shape)
+            self.nb_stale_free_cells += 1
 
     def generate_random_point_in_empty_grid_cell(self):
         """Generates a point in an empty grid cell according to a uniform
@@ -95,10 +205,149 @@ class Grid:
         """
         empty_grid_cell = np.array(self.get_random_empty_grid_cell())
         min_corner = self.domain[0, :] + self.cell_size * empty_grid_cell
-        return min_corner + self.cell_size * np.random.random(self.grid.ndim)
+        return min_corner + self.cell_size * self.rng.random(len(self.shape))
+
+
+class SparseGrid(Grid):
+    """Block-sparse version of `Grid`, for domains where the samples occupy a small fraction
+    of the bounding box.
+
+    The grid is split into cubic blocks of `block_size` cells per dimension, and only the blocks
+    in which samples are stored are allocated, as int32 arrays. Empty grid cells are found by
+    rejection sampling over the whole grid.
+    """
+
+    def __init__(self, domain, cell_size, block_size=8, rng=None):
+        """Constructor
 
+        Args:
+            domain: (2, dim)-numpy.array
+            cell_size: scalar
+            block_size: number of grid cells per dimension of a block
+            rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
+        """
+        # pylint: disable=super-init-not-called
+        self._shape = get_grid_shape(domain, cell_size)
+        self.cell_size = cell_size
+        self.domain = domain
+        self.rng = get_rng(rng)
+        self.block_size = block_size
+        self.blocks = {}
+        self.nb_occupied_cells = 0
+        self.nb_empty_cell_requests = 0
+        self.nb_free_cells_scans = 0
+        self.nb_stale_free_cells = 0
+        self.fixed_points = None
+
+    @property
+    def shape(self):
+        """Number of grid cells along each dimension."""
+        return self._shape
+
+    def _get_value(self, coords):
+        """Returns the value stored at given grid coordinates."""
+        block = self.blocks.get(tuple(c // self.block_size for c in coords))
+        if block is None:
+            return -1
+        return block[tuple(c % self.block_size for c in coords)]
 
-def generate_point_around(point, min_distance):
+    def update(self, point, index):
+        """Stores point index in grid."""
+        coords = self.get_grid_coords(point)
+        block_key = tuple(c // self.block_size for c in coords)
+        block = self.blocks.get(block_key)
+        if block is None:
+            block = np.full((self.block_size,) * len(coords), -1, dtype=np.int32)
+            self.blocks[block_key] = block
+        local_coords = tuple(c % self.block_size for c in coords)
+        if block[local_coords] == -1:
+            self.nb_occupied_cells += 1
+        block[local_coords] = index
+
+    def _get_block_keys(self, block_ranges):
+        """Returns the keys of the blocks within given ranges along each dimension; only the
+        allocated blocks are visited if there are fewer of them than blocks in the ranges."""
+        if np.prod([len(r) for r in block_ranges], dtype=np.float64) > len(self.blocks):
+            return [key for key in self.blocks if all(c in r for c, r in zip(key, block_ranges))]
+        return itertools.product(*block_ranges)
+
+    def get_sample_indices_in_neighbourhood(self, point, distance):
+        """Returns the indices of the samples that lie within a rectangular
+        neighbourhood of cells. The size of the rectangle is based on an input
+        distance."""
+        point_coords = np.array(self.get_grid_coords(point))
+
+        # define neighbourhood
+        nb_cells = int(np.ceil(distance / self.cell_size))
+        min_corner = np.maximum(0, point_coords - nb_cells)
+        max_corner = np.minimum(self.shape, point_coords + nb_cells + 1)
+
+        result = []
+        block_ranges = [
+            range(lo // self.block_size, (hi - 1) // self.block_size + 1)
+            for lo, hi in zip(min_corner, max_corner)
+        ]
+        for block_key in self._get_block_keys(block_ranges):
+            block = self.blocks.get(block_key)
+            if block is None:
+                continue
+            block_min = np.array(block_key) * self.block_size
+            lo = np.maximum(min_corner - block_min, 0)
+            hi = np.minimum(max_corner - block_min, self.block_size)
+            neighbourhood = block[tuple(slice(a, b) for a, b in zip(lo, hi))]
+            result.append(neighbourhood[neighbourhood > -1])
+
+        if not result:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(result)
+
+    def get_random_empty_grid_cell(self):
+        """Returns the grid coordinates of an empty grid cell.
+
+        Raises:
+            Error if no empty grid cells are present.
+        """
+        self.nb_empty_cell_requests += 1
+        if self.nb_occupied_cells >= np.prod(self.shape, dtype=np.int64):
+            raise BrainBuilderError("No empty cells present in this grid.")
+        while True:
+            coords = tuple(self.rng.integers(self.shape))
+            if self._get_value(coords) == -1:
+                return coords
+            self.nb_stale_free_cells += 1
+
+
+def get_grid_shape(domain, cell_size):
+    """Returns the number of grid cells along each dimension to cover a domain."""
+    domain_size = domain[1, :] - domain[0, :]
+    return tuple((domain_size / cell_size + 1).astype(int))
+
+
+def create_grid(domain, cell_size, nb_points, nonzero_fraction=None, rng=None):
+    """Create the spatial index used for the Poisson disc sampling.
+
+    A `SparseGrid` is used if the fraction of the domain with nonzero density is small, or if a
+    dense `Grid` would not fit in the memory budget; otherwise a dense `Grid` is used.
+
+    Args:
+        domain: (2, dim)-numpy.array
+        cell_size: scalar
+        nb_points: maximum number of sample points stored in the grid
+        nonzero_fraction: fraction of the domain with nonzero density, if known
+        rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
+    """
+    dtype = np.int32 if nb_points <= np.iinfo(np.int32).max else np.int64
+    dense_bytes = np.prod(get_grid_shape(domain, cell_size), dtype=np.float64)
+    dense_bytes *= np.dtype(dtype).itemsize
+    if dense_bytes > DENSE_GRID_MAX_BYTES or (
+        nonzero_fraction is not None and nonzero_fraction < SPARSE_GRID_MAX_NONZERO_FRACTION
+    ):
+        L.debug("Using a sparse grid (nonzero fraction: %s)", nonzero_fraction)
+        return SparseGrid(domain, cell_size, rng=rng)
+    return Grid(domain, cell_size, dtype=dtype, rng=rng)
+
+
+def generate_point_around(point, min_distance, rng=None):
     """Generate point in spherical shell around given point at minimum distance
     from the point, according a non-uniform distribution, which favours points
     closer to the inner sphere, leading to denser packings.
@@ -106,14 +355,16 @@ def generate_point_around(point, min_distance):
     Args:
         point: three-dimensional point
         min_distance: minimum distance between point and the generated point
+        rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
 
     Returns:
         A three-dimensional point at given minimum distance from the input
         point.
     """
-    radius = min_distance * (np.random.random() + 1)
-    angle1 = 2 * np.pi * np.random.random()
-    angle2 = 2 * np.pi * np.random.random()
+    rng = get_rng(rng)
+    radius = min_distance * (rng.random() + 1)
+    angle1 = 2 * np.pi * rng.random()
+    angle2 = 2 * np.pi * rng.random()
 
     d_x = np.cos(angle1) * np.sin(angle2)
     d_y = np.sin(angle1) * np.sin(angle2)
@@ -121,39 +372,215 @@ def generate_point_around(point, min_distance):
     return point + radius * np.array([d_x, d_y, d_z])
 
 
-def _get_seed(domain):
+def generate_points_around(point, min_distance, nb_points, rng=None):
+    """Vectorized version of `generate_point_around`, drawing `nb_points` candidates at once.
+
+    Args:
+        rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
+
+    Returns:
+        (nb_points, 3)-numpy.array of points at given minimum distance from the input point.
+    """
+    rng = get_rng(rng)
+    radius = min_distance * (rng.random(nb_points) + 1)
+    angle1 = 2 * np.pi * rng.random(nb_points)
+    angle2 = 2 * np.pi * rng.random(nb_points)
+
+    directions = np.column_stack(
+        [np.cos(angle1) * np.sin(angle2), np.sin(angle1) * np.sin(angle2), np.cos(angle2)]
+    )
+    return point + radius[:, np.newaxis] * directions
+
+
+def _get_seed(domain, rng):
     """Helper function that generates random seed according to a uniform
     distribution over a given domain."""
     domain_size = domain[1, :] - domain[0, :]
-    return domain[0, :] + np.random.random(domain[0, :].shape) * domain_size
+    return domain[0, :] + rng.random(domain[0, :].shape) * domain_size
+
+
+class SampleStore:
+    """Preallocated storage of the sample points, together with the set of active samples.
+
+    The active set is kept in an array of sample indices, the first `nb_active` of which are
+    active: picking and removing a random active sample is O(1) (swap-remove).
+    """
+
+    def __init__(self, capacity, dim, rng=None):
+        """Constructor
+
+        Args:
+            capacity: maximum number of sample points
+            dim: dimension of the sample points
+            rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
+        """
+        self._rng = get_rng(rng)
+        self.points = np.empty((capacity, dim))
+        self.size = 0
+        self._active = np.empty(capacity, dtype=np.int64)
+        self.nb_active = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        """Maximum number of sample points."""
+        return len(self.points)
+
+    def is_full(self):
+        """Whether the maximum number of sample points is reached."""
+        return self.size == self.capacity
+
+    def add(self, point):
+        """Stores an active sample point and returns its index."""
+        idx = self.size
+        self.points[idx] = point
+        self.size += 1
+        self._active[self.nb_active] = idx
+        self.nb_active += 1
+        return idx
+
+    def pop_random_active(self):
+        """Removes a random sample from the active set and returns its index."""
+        pos = self._rng.integers(self.nb_active)
+        idx = self._active[pos]
+        self.nb_active -= 1
+        self._active[pos] = self._active[self.nb_active]
+        return idx
+
+    def get_points(self):
+        """Returns the (size, dim)-numpy.array of stored sample points."""
+        return self.points[: self.size]
+
+
+class SamplingStats:
+    """Statistics of a run of `generate_points`."""
+
+    def __init__(self, nb_target=0):
+        """Constructor
+
+        Args:
+            nb_target: number of desired points
+        """
+        self.nb_target = nb_target
+        self.nb_points = 0
+        self.nb_trials = 0
+        self.nb_accepted = 0
+        self.nb_reseeds = 0
+
+    @property
+    def acceptance_rate(self):
+        """Fraction of the trials that resulted in a new point."""
+        return self.nb_accepted / self.nb_trials if self.nb_trials else 0.0
+
+    @property
+    def shortfall(self):
+        """Number of desired points that could not be generated."""
+        return self.nb_target - self.nb_points
+
+    def update(self, other):
+        """Adds the statistics of another run, e.g. of another tile of the same domain."""
+        self.nb_target += other.nb_target
+        self.nb_points += other.nb_points
+        self.nb_trials += other.nb_trials
+        self.nb_accepted += other.nb_accepted
+        self.nb_reseeds += other.nb_reseeds
+
+    def __str__(self):
+        return (
+            f"{self.nb_points} / {self.nb_target} points (shortfall: {self.shortfall}), "
+            f"{self.nb_trials} trials, acceptance rate: {self.acceptance_rate:.3f}, "
+            f"{self.nb_reseeds} reseeds"
+        )
+
 
+class TrialBudget:
+    """Number of trials around each active point, and of reseeding trials, per region.
 
-def _add_to_containers(point, sample_points, active_list, grid):
+    If adaptive, the domain is split in regions of ADAPTIVE_REGION_SIZE grid cells along each
+    axis, and the acceptance rate of the trials is tracked per region: once a region has seen
+    `nb_trials` trials, the budget of its points is lowered proportionally to the acceptance
+    rate, if it is below ADAPTIVE_MIN_ACCEPTANCE_RATE. The counts decay by half every time they
+    reach `ADAPTIVE_REGION_SIZE * nb_trials` trials, so that the rate follows the saturation of
+    the region.
+
+    Every region also has a reseeding budget: the number of consecutive failed reseeding trials
+    after which no new seed is tried in it. It starts at `nb_trials` and is doubled, up to
+    ADAPTIVE_MAX_RESEED_FACTOR * nb_trials, every time a seed is accepted in the region: the
+    reseeding is escalated where the shortfall is, not over the whole domain.
+    """
+
+    def __init__(self, nb_trials, grid, adaptive=True):
+        """Constructor
+
+        Args:
+            nb_trials: maximum number of trials around each point
+            grid: spatial index of the sampling
+            adaptive: if False, the budget is always `nb_trials`
+        """
+        self.nb_trials = nb_trials
+        self.grid = grid
+        self.adaptive = adaptive
+        # region -> [nb_trials, nb_accepted]
+        self._regions = {}
+        # region -> (reseeding budget, consecutive failed reseeding trials)
+        self._reseeds = {}
+
+    def get_region(self, point):
+        """Returns the region of the point."""
+        return tuple(np.floor_divide(self.grid.get_grid_coords(point), ADAPTIVE_REGION_SIZE))
+
+    def get(self, point):
+        """Returns the region of the point and the number of trials around it."""
+        if not self.adaptive:
+            return None, self.nb_trials
+        region = self.get_region(point)
+        nb_trials, nb_accepted = self._regions.get(region, (0, 0))
+        if nb_trials < self.nb_trials:
+            return region, self.nb_trials
+        rate = nb_accepted / nb_trials
+        budget = int(np.ceil(self.nb_trials * rate / ADAPTIVE_MIN_ACCEPTANCE_RATE))
+        return region, min(self.nb_trials, max(ADAPTIVE_MIN_TRIALS, budget))
+
+    def update(self, region, nb_trials, nb_accepted):
+        """Records the outcome of the trials around a point of the region."""
+        if region is None:
+            return
+        counts = self._regions.setdefault(region, [0, 0])
+        counts[0] += nb_trials
+        counts[1] += nb_accepted
+        if counts[0] >= ADAPTIVE_REGION_SIZE * self.nb_trials:
+            counts[0] /= 2
+            counts[1] /= 2
+
+    def can_reseed(self, region):
+        """Returns whether the reseeding budget of the region is not exhausted."""
+        budget, nb_failed = self._reseeds.get(region, (self.nb_trials, 0))
+        return nb_failed < budget
+
+    def update_reseed(self, region, accepted):
+        """Records the outcome of a reseeding trial in the region."""
+        budget, nb_failed = self._reseeds.get(region, (self.nb_trials, 0))
+        if accepted:
+            budget = min(2 * budget, ADAPTIVE_MAX_RESEED_FACTOR * self.nb_trials)
+            self._reseeds[region] = (budget, 0)
+        else:
+            self._reseeds[region] = (budget, nb_failed + 1)
+
+
+def _add_to_containers(point, samples, grid):
     """Helper function to update containers used for Poisson disc sampling."""
-    sample_points.append(point)
-    idx = len(sample_points) - 1
-    active_list.append(idx)
-    grid.update(point, idx)
+    grid.update(point, samples.add(point))
 
 
-# pylint: disable=R0913
-def _try_generate_point(
-    active_list,
-    nb_trials,
-    point,
-    min_distance,
-    grid,
-    sample_points,
-    nb_points,
-    progress_bar=None,
-    new_seed=False,
-):
+def _try_generate_point(nb_trials, point, min_distance, grid, samples, new_seed=False):
     """Helper function that generates a new sample point and updates the
     relevant containers. Trials are limited by a given number of trials.
     """
     for _ in range(nb_trials):
         if not new_seed:
-            new_pt = generate_point_around(point, min_distance(point))
+            new_pt = generate_point_around(point, min_distance(point), grid.rng)
         else:
             try:
                 new_pt = grid.generate_random_point_in_empty_grid_cell()
@@ -162,13 +589,95 @@ def _try_generate_point(
                 break
 
         if grid.domain_contains(new_pt) and grid.no_collision(
-            new_pt, min_distance(new_pt), sample_points
+            new_pt, min_distance(new_pt), samples.points
         ):
-            _add_to_containers(new_pt, sample_points, active_list, grid)
-            if progress_bar is not None:
-                progress_bar.update(1)
+            _add_to_containers(new_pt, samples, grid)
 
-        if len(sample_points) == nb_points:
+        if samples.is_full():
+            break
+
+
+def _try_reseed(budget, min_distance, grid, samples, stats):
+    """Helper function that tries seeds in random empty grid cells until one is accepted.
+
+    The seeds in the regions whose reseeding budget is exhausted are skipped (see
+    `TrialBudget`), until ADAPTIVE_MAX_RESEED_FACTOR * nb_trials of them were skipped: the seeds
+    are then tried wherever they fall. It gives up after ADAPTIVE_MAX_RESEED_FACTOR * nb_trials
+    consecutive seeds tried without a new point, i.e. never before the `nb_trials` failed seeds
+    of the non-adaptive reseeding.
+
+    Returns:
+        True if a new point was added.
+    """
+    max_trials = ADAPTIVE_MAX_RESEED_FACTOR * budget.nb_trials
+    nb_failed = 0
+    nb_skipped = 0
+    while nb_failed < max_trials:
+        try:
+            point = grid.generate_random_point_in_empty_grid_cell()
+        except BrainBuilderError:
+            # spatial grid is full -> stop trying
+            return False
+        region = budget.get_region(point)
+        if nb_skipped < max_trials and not budget.can_reseed(region):
+            nb_skipped += 1
+            continue
+        stats.nb_trials += 1
+        accepted = grid.domain_contains(point) and grid.no_collision(
+            point, min_distance(point), samples.points
+        )
+        budget.update_reseed(region, accepted)
+        if accepted:
+            _add_to_containers(point, samples, grid)
+            stats.nb_accepted += 1
+            return True
+        nb_failed += 1
+    return False
+
+
+def _select_non_colliding(candidates, distances, valid, period=None):
+    """Helper function that selects, in order, the valid candidates that do not collide with
+    each other; this reproduces the sequential acceptance of `_try_generate_point`.
+
+    If `period` is given, distances are computed in a periodic domain of that size.
+    """
+    diff = candidates[:, np.newaxis, :] - candidates[np.newaxis, :, :]
+    if period is not None:
+        diff -= period * np.round(diff / period)
+    # collides[i, j]: candidate j is too close to candidate i, from the point of view of j
+    collides = np.einsum("ijk,ijk->ij", diff, diff) < np.square(distances)[np.newaxis, :]
+    accepted = []
+    for j in np.flatnonzero(valid):
+        if not np.any(collides[accepted, j]):
+            accepted.append(j)
+    return accepted
+
+
+def _try_generate_points_batch(nb_trials, point, min_distance, grid, samples):
+    """Vectorized version of `_try_generate_point`: all the trials around `point` are drawn
+    and checked against the grid at once, and the valid ones are accepted in order.
+    """
+    distance = min_distance(point)
+    candidates = generate_points_around(point, distance, nb_trials, grid.rng)
+    valid = grid.domain_contains_batch(candidates)
+    if not np.any(valid):
+        return
+
+    distances = np.zeros(nb_trials)
+    distances[valid] = np.broadcast_to(min_distance(candidates[valid]), np.count_nonzero(valid))
+    # the candidates closer to `point` than their own minimum distance collide with it: they
+    # are dropped before the neighbourhood query, whose radius would otherwise follow the
+    # (arbitrarily large) distances of the candidates where no cell is expected
+    valid &= np.linalg.norm(candidates - point, axis=1) >= distances
+    if not np.any(valid):
+        return
+    radius = 2 * distance + np.max(distances[valid])
+    valid &= grid.no_collision_batch(point, radius, candidates, distances, samples.points)
+
+    for j in _select_non_colliding(candidates, distances, valid):
+        _add_to_containers(candidates[j], samples, grid)
+
+        if samples.is_full():
             break
 
 
@@ -180,6 +689,12 @@ def generate_points(
     nb_trials=30,
     display_progress=True,
     reseed_fraction=0.9,
+    vectorized=False,
+    nonzero_fraction=None,
+    existing_points=None,
+    adaptive=False,
+    stats=None,
+    rng=None,
 ):
     """Generate a number of points with Poisson disc sampling.
 
@@ -196,63 +711,242 @@ def generate_points(
         reseed_fraction: try generating a new seed if the point generation
                          stopped at an amount of points that does not exceed
                          reseed_fraction * nb_points.
+        vectorized: if True, the trials around an active point are drawn and checked as one
+                    batch; in that case `min_distance` must also accept a (N, dim)-numpy.array
+                    of points and return the (N,) distances.
+        nonzero_fraction: fraction of the domain with nonzero density, used to choose
+                          between a dense and a sparse spatial index.
+        existing_points: (M, dim)-numpy.array of already placed points, possibly outside the
+                         domain (e.g. in neighbouring domains); the generated points keep the
+                         minimum distance to them, and they are not part of the result.
+        adaptive: if True, the number of trials around each point is lowered where the
+                  acceptance rate collapses, the remaining trials being deferred until there
+                  are no active points left; and instead of stopping at `reseed_fraction`,
+                  the reseeding goes on where it succeeds, with a budget per region of the
+                  domain (see `TrialBudget` and `_try_reseed`). If False, `nb_trials` trials
+                  are made around every point and for every reseed.
+        stats: optional SamplingStats, to which the statistics of the run are added.
+        rng: numpy.random.Generator or seed, see `brainbuilder.utils.random.get_rng`
 
     Returns:
-        A list of points.
+        (N, dim)-numpy.array of points, with N <= nb_points.
     """
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-statements,too-many-branches
     # initialisation of helper containers
+    rng = get_rng(rng)
     domain = np.array([np.min(bbox, axis=0), np.max(bbox, axis=0)])
-    grid = Grid(
-        domain, min_distance() / np.sqrt(domain.shape[1])
-    )  # pylint: disable=unsubscriptable-object
+    grid = create_grid(
+        domain,
+        min_distance() / np.sqrt(domain.shape[1]),  # pylint: disable=unsubscriptable-object
+        nb_points,
+        nonzero_fraction,
+        rng,
+    )
 
-    active_list = []
-    sample_points = []
+    if existing_points is not None:
+        grid.set_fixed_points(existing_points)
+
+    samples = SampleStore(nb_points, domain.shape[1], rng)
 
     # first point is seed point
     if seed is None:
-        seed = _get_seed(domain)
-    if grid.domain_contains(seed):
-        _add_to_containers(seed, sample_points, active_list, grid)
+        seed = _get_seed(domain, rng)
+    if (
+        grid.domain_contains(seed)
+        and not samples.is_full()
+        and (existing_points is None or grid.no_collision(seed, min_distance(seed), samples.points))
+    ):
+        _add_to_containers(seed, samples, grid)
 
     # generate points
     if display_progress:
         progress_bar = tqdm(total=nb_points)
-        progress_bar.update(1)  # count the seed as the first
     else:
         progress_bar = None
+    # the progress bar is updated in batches, not for every generated point
+    progress_step = max(1, nb_points // PROGRESS_BAR_UPDATES)
+    progress = 0
+    stats = SamplingStats() if stats is None else stats
+    stats.nb_target += nb_points
+    budget = TrialBudget(nb_trials, grid, adaptive)
+    # points whose budget was lowered: (index, region, remaining trials)
+    deferred = []
+
+    while not samples.is_full():
+        if samples.nb_active:
+            idx = samples.pop_random_active()
+            region, point_trials = budget.get(samples.points[idx])
+            can_defer = point_trials < nb_trials
+        elif deferred:
+            # the remaining trials of the deferred points are only spent once there are no
+            # active points left, if the desired number of points is not reached yet
+            idx, region, point_trials = deferred.pop()
+            can_defer = False
+        else:
+            # re-seed if necessary
+            generated_fraction = 1.0 * len(samples) / nb_points
+            if not adaptive and generated_fraction >= reseed_fraction:
+                break
+            stats.nb_reseeds += 1
+            if adaptive:
+                if not _try_reseed(budget, min_distance, grid, samples, stats):
+                    break
+                continue
+            nb_samples = len(samples)
+            _try_generate_point(nb_trials, None, min_distance, grid, samples, new_seed=True)
+            stats.nb_trials += nb_trials
+            stats.nb_accepted += len(samples) - nb_samples
+            if not samples.nb_active:
+                break
+            continue
+
+        nb_samples = len(samples)
+        if vectorized:
+            _try_generate_points_batch(
+                point_trials, samples.points[idx], min_distance, grid, samples
+            )
+        else:
+            _try_generate_point(point_trials, samples.points[idx], min_distance, grid, samples)
+        nb_accepted = len(samples) - nb_samples
+        budget.update(region, point_trials, nb_accepted)
+        stats.nb_trials += point_trials
+        stats.nb_accepted += nb_accepted
+        if can_defer:
+            deferred.append((idx, region, nb_trials - point_trials))
+
+        if progress_bar is not None and len(samples) - progress >= progress_step:
+            progress_bar.update(len(samples) - progress)
+            progress = len(samples)
+
+    if progress_bar is not None:
+        progress_bar.update(len(samples) - progress)
+        progress_bar.close()
+
+    stats.nb_points += len(samples)
+    L.debug(
+        "Generated %s; %d empty cells requested, %d grid scans, %d stale free cells skipped",
+        stats,
+        grid.nb_empty_cell_requests,
+        grid.nb_free_cells_scans,
+        grid.nb_stale_free_cells,
+    )
+    return samples.get_points()
+
+
+def _periodic_no_collision(candidates, min_distance, grid, samples, center, side):
+    """Helper function that verifies that the candidates around `center` do not lie closer
+    than `min_distance` to the samples stored on the periodic `grid` of a cube of size `side`.
+    """
+    nb_cells = grid.shape[0]
+    cell_size = side / nb_cells
+    reach = int(np.ceil(3 * min_distance / cell_size))
+    center_coords = np.floor(center / cell_size).astype(int)
+    if 2 * reach + 1 >= nb_cells:
+        neighbourhood = grid
+    else:
+        ranges = [np.arange(c - reach, c + reach + 1) % nb_cells for c in center_coords]
+        neighbourhood = grid[np.ix_(*ranges)]
+    neighbours = neighbourhood[neighbourhood > -1]
+    if len(neighbours) == 0:
+        return np.ones(len(candidates), dtype=bool)
+    diff = candidates[:, np.newaxis, :] - samples.points[neighbours][np.newaxis, :, :]
+    diff -= side * np.round(diff / side)
+    return np.all(np.einsum("ijk,ijk->ij", diff, diff) >= min_distance**2, axis=1)
 
-    while active_list and (len(sample_points) < nb_points):
-        idx = np.random.choice(active_list)
-        point = sample_points[idx]  # pylint: disable=invalid-sequence-index
-        active_list.remove(idx)
-        _try_generate_point(
-            active_list,
-            nb_trials,
-            point,
-            min_distance,
-            grid,
-            sample_points,
-            nb_points,
-            progress_bar,
-        )
 
-        # re-seed if necessary
-        generated_fraction = 1.0 * len(sample_points) / nb_points
-        if not active_list and (generated_fraction < reseed_fraction):
-            _try_generate_point(
-                active_list,
-                nb_trials,
-                point,
-                min_distance,
-                grid,
-                sample_points,
-                nb_points,
-                progress_bar,
-                True,
+def generate_periodic_points(side, nb_points, min_distance, nb_trials=30, seed=0):
+    """Generate points with Poisson disc sampling in a periodic cube.
+
+    The minimum distance between points is kept across the faces of the cube, so that the
+    resulting pattern can be tiled by translation.
+
+    Args:
+        side: size of the cube [0, side)**3
+        nb_points: number of desired points
+        min_distance: minimum distance between points (scalar)
+        nb_trials: number of trials each time a new point is generated
+        seed: seed of the random generator; the pattern only depends on the arguments
+
+    Returns:
+        (N, 3)-numpy.array of points, with N <= nb_points.
+    """
+    # pylint: disable=too-many-locals
+    rng = np.random.default_rng(seed)
+    nb_cells = max(1, int(np.ceil(side * np.sqrt(3) / min_distance)))
+    grid = np.full((nb_cells,) * 3, -1, dtype=np.int32)
+    samples = SampleStore(nb_points, 3, rng)
+    distances = np.full(nb_trials, min_distance)
+
+    def _add(points):
+        for point in points:
+            grid[tuple(np.floor(point * nb_cells / side).astype(int) % nb_cells)] = samples.add(
+                point
             )
+            if samples.is_full():
+                break
 
-    if display_progress:
-        progress_bar.close()
+    nb_failed_reseeds = 0
+    while not samples.is_full() and nb_failed_reseeds < PERIODIC_MAX_FAILED_RESEEDS:
+        if samples.nb_active:
+            center = samples.points[samples.pop_random_active()]
+            candidates = generate_points_around(center, min_distance, nb_trials, rng) % side
+            valid = _periodic_no_collision(candidates, min_distance, grid, samples, center, side)
+        else:
+            # (re)seed with random points in the empty cells of the grid
+            empty_cells = np.flatnonzero(grid == -1)
+            if len(empty_cells) == 0:
+                break
+            cells = rng.choice(empty_cells, min(nb_trials, len(empty_cells)), replace=False)
+            candidates = (
+                np.column_stack(np.unravel_index(cells, grid.shape)) + rng.random((len(cells), 3))
+            ) * (side / nb_cells)
+            valid = np.array(
+                [
+                    _periodic_no_collision(c[np.newaxis], min_distance, grid, samples, c, side)[0]
+                    for c in candidates
+                ]
+            )
+            nb_failed_reseeds = 0 if np.any(valid) else nb_failed_reseeds + 1
+
+        accepted = _select_non_colliding(candidates, distances[: len(candidates)], valid, side)
+        _add(candidates[accepted])
+
+    return samples.get_points()
+
+
+#: in-memory cache of the periodic patterns, see `get_periodic_pattern`
+_PERIODIC_PATTERNS = {}
 
-    return sample_points
+
+def get_periodic_pattern(density, min_distance, cache_dir=None):
+    """Returns a tileable Poisson disc pattern for a constant density.
+
+    Patterns are built with `generate_periodic_points` and cached in memory and, if `cache_dir`
+    is given, as .npy files in that directory; they only depend on the arguments.
+
+    Args:
+        density: number of points per unit volume
+        min_distance: minimum distance between points
+        cache_dir: optional directory used to store and load the patterns
+
+    Returns:
+        tuple of the (N, 3)-numpy.array of points of the pattern and of the size of the cube
+        [0, side)**3 that can be tiled with it.
+    """
+    side = float(np.cbrt(PERIODIC_PATTERN_NB_POINTS / density))
+    key = f"{density:.9g}_{min_distance:.9g}"
+    if key not in _PERIODIC_PATTERNS:
+        path = None if cache_dir is None else Path(cache_dir, f"poisson_pattern_{key}.npy")
+        if path is not None and path.exists():
+            L.debug("Loading periodic pattern from %s", path)
+            points = np.load(path)
+        else:
+            L.debug("Generating periodic pattern for density %s", key)
+            points = generate_periodic_points(
+                side, PERIODIC_PATTERN_NB_POINTS, min_distance, seed=zlib.crc32(key.encode())
+            )
+            if path is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                np.save(path, points)
+        _PERIODIC_PATTERNS[key] = points
+    return _PERIODIC_PATTERNS[key], side
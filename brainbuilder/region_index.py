@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Index of the voxels of the regions of an annotation volume."""
+
+import numpy as np
+
+from brainbuilder.exceptions import BrainBuilderError
+
+
+def _get_depth_first_order(region_map):
+    """Helper function that orders the regions of the hierarchy depth-first.
+
+    Returns:
+        tuple of the region ids in depth-first order, and of the (exclusive) end of the subtree
+        of each region in this order.
+    """
+    parent_ids = region_map.as_dataframe()["parent_id"]
+    children = {}
+    for region_id, parent_id in parent_ids.items():
+        children.setdefault(parent_id, []).append(region_id)
+    roots = [
+        region_id for region_id, parent_id in parent_ids.items() if parent_id not in parent_ids
+    ]
+
+    order = []
+    subtree_end = {}
+    # iterative depth-first traversal; (region_id, True) marks the end of the subtree
+    stack = [(region_id, False) for region_id in sorted(roots, reverse=True)]
+    while stack:
+        region_id, done = stack.pop()
+        if done:
+            subtree_end[region_id] = len(order)
+            continue
+        order.append(region_id)
+        stack.append((region_id, True))
+        stack.extend((child, False) for child in sorted(children.get(region_id, []), reverse=True))
+
+    order = np.array(order, dtype=np.int64)
+    return order, np.array([subtree_end[region_id] for region_id in order], dtype=np.int64)
+
+
+class RegionIndex:
+    """Flat indices of the voxels of each region of an annotation volume.
+
+    The voxels are grouped by region, the regions being sorted depth-first in the hierarchy:
+    the voxels of a region and of all its descendants form one contiguous slice. Within a
+    region, the voxels are sorted by flat index. Voxels outside of the hierarchy (e.g. 0) are
+    not indexed.
+    """
+
+    def __init__(self, brain_regions, region_map, mask=None):
+        """Constructor
+
+        Args:
+            brain_regions(VoxelData): annotation volume, with the region id of each voxel
+            region_map(RegionMap): hierarchy of the regions
+            mask: optional boolean numpy.array with the shape of `brain_regions`; only the voxels
+                in the mask are indexed
+        """
+        self.brain_regions = brain_regions
+        self.region_map = region_map
+
+        #: region ids, in depth-first order
+        self.region_ids, self._subtree_end = _get_depth_first_order(region_map)
+        sorter = np.argsort(self.region_ids)
+
+        flat = brain_regions.raw.reshape(-1)
+        valid = flat != 0
+        if mask is not None:
+            valid &= mask.reshape(-1)
+        voxels = np.flatnonzero(valid)
+        pos = np.searchsorted(self.region_ids, flat[voxels], sorter=sorter)
+        pos = np.minimum(pos, len(sorter) - 1)
+        ranks = sorter[pos]
+        known = self.region_ids[ranks] == flat[voxels]
+        voxels, ranks = voxels[known], ranks[known]
+
+        # the stable sort keeps the voxels of every region sorted by flat index
+        order = np.argsort(ranks, kind="stable")
+        index_dtype = np.int32 if flat.size <= np.iinfo(np.int32).max else np.int64
+
+        #: flat indices of the indexed voxels, grouped by region
+        self.voxels = voxels[order].astype(index_dtype)
+        self._starts = np.searchsorted(ranks[order], np.arange(len(self.region_ids) + 1))
+
+    @property
+    def shape(self):
+        """Shape of the annotation volume."""
+        return self.brain_regions.shape
+
+    def get_voxels(self, value, attr="acronym", with_descendants=True):
+        """Returns the sorted flat indices of the voxels of the regions matching `value`.
+
+        The matching is the one of `RegionMap.find`.
+
+        Raises:
+            BrainBuilderError if no region matches `value`.
+        """
+        region_ids = self.region_map.find(value, attr=attr, with_descendants=False)
+        if not region_ids:
+            raise BrainBuilderError(f"Region not found: '{value}'")
+
+        ranks = np.flatnonzero(np.isin(self.region_ids, list(region_ids)))
+        ends = self._subtree_end[ranks] if with_descendants else ranks + 1
+        # merge the nested subtrees
+        ranges = []
+        for start, end in zip(ranks, ends):
+            if ranges and start < ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        result = np.concatenate(
+            [self.voxels[self._starts[start] : self._starts[end]] for start, end in ranges]
+        )
+        if len(ranges) > 1 or ranges[0][1] - ranges[0][0] > 1:
+            result.sort()
+        return result
+
+    def to_voxel_data(self, voxels, values):
+        """Returns a VoxelData cropped to the bounding box of the given voxels, with `values`
+        at the voxels and 0 elsewhere; it is in the frame of the annotation volume."""
+        ijk = np.unravel_index(voxels, self.shape)
+        start = np.array([np.min(idx) for idx in ijk])
+        stop = np.array([np.max(idx) for idx in ijk]) + 1
+        raw = np.zeros(stop - start, dtype=np.asarray(values).dtype)
+        raw[tuple(idx - s for idx, s in zip(ijk, start))] = values
+        result = self.brain_regions.with_data(raw)
+        result.offset = self.brain_regions.indices_to_positions(start)
+        return result
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Indices of voxels along space-filling curves, to order cells with spatial locality."""
+
+import numpy as np
+
+from brainbuilder.exceptions import BrainBuilderError
+
+
+def _get_bits(shape):
+    """Returns the number of bits of the voxel indices of a volume of the given shape."""
+    bits = max(int(np.max(shape)) - 1, 1).bit_length()
+    # the curve indices are uint64
+    if bits * len(shape) > 64:
+        raise BrainBuilderError(f"Volume too large for a space-filling curve: {shape}")
+    return bits
+
+
+def _interleave(indices, bits):
+    """Helper function that interleaves the bits of the indices, the first axis being the most
+    significant."""
+    result = np.zeros(len(indices), dtype=np.uint64)
+    for bit in range(bits - 1, -1, -1):
+        for axis in range(indices.shape[1]):
+            result <<= np.uint64(1)
+            result |= (indices[:, axis] >> np.uint64(bit)) & np.uint64(1)
+    return result
+
+
+def morton_indices(indices, shape):
+    """Returns the indices of voxels along the Morton (Z-order) curve of a volume.
+
+    Args:
+        indices: (N, ndim) integer numpy array of voxel indices
+        shape: shape of the volume
+
+    Returns:
+        uint64 numpy array of the index of each voxel along the curve.
+    """
+    return _interleave(np.asarray(indices, dtype=np.uint64), _get_bits(shape))
+
+
+def hilbert_indices(indices, shape):
+    """Returns the indices of voxels along the Hilbert curve of a volume.
+
+    The voxel indices are transformed to the "transposed" Hilbert index with the algorithm of
+    J. Skilling, "Programming the Hilbert curve" (2004), vectorized over the voxels.
+
+    Args:
+        indices: (N, ndim) integer numpy array of voxel indices
+        shape: shape of the volume
+
+    Returns:
+        uint64 numpy array of the index of each voxel along the curve.
+    """
+    bits = _get_bits(shape)
+    x = np.array(indices, dtype=np.uint64)
+    ndim = x.shape[1]
+
+    # inverse undo excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = np.uint64(q - 1)
+        for i in range(ndim):
+            high = (x[:, i] & np.uint64(q)) != 0
+            x[high, 0] ^= p
+            t = (x[~high, 0] ^ x[~high, i]) & p
+            x[~high, 0] ^= t
+            x[~high, i] ^= t
+        q >>= 1
+
+    # Gray encode
+    for i in range(1, ndim):
+        x[:, i] ^= x[:, i - 1]
+    t = np.zeros(len(x), dtype=np.uint64)
+    q = 1 << (bits - 1)
+    while q > 1:
+        t[(x[:, ndim - 1] & np.uint64(q)) != 0] ^= np.uint64(q - 1)
+        q >>= 1
+    x ^= t[:, np.newaxis]
+
+    return _interleave(x, bits)
+
+
+#: functions returning the indices of voxels along each space-filling curve
+CURVES = {
+    "hilbert": hilbert_indices,
+    "morton": morton_indices,
+}
@@ -6,6 +6,7 @@ import bluepysnap
 import voxcell
 from voxcell.nexus.voxelbrain import Atlas
 
+from brainbuilder.atlas_lookup import AtlasLookup
 from brainbuilder.exceptions import BrainBuilderError
 from brainbuilder.utils import load_yaml
 
@@ -138,10 +139,10 @@ def create_node_sets(cells, full_hierarchy, atlas, targets, allow_empty, populat
             _add_node_sets(query_based)
 
         if atlas_based is not None:
-            xyz = cells[list("xyz")]
+            atlas_lookup = AtlasLookup(cells[list("xyz")].to_numpy(), atlas)
             for name, dset in atlas_based.items():
-                mask = atlas.load_data(dset, cls=voxcell.ROIMask).lookup(xyz.to_numpy())
-                ids = xyz.index[mask] - 1  # CellCollection is 1 based, SONATA is 0 based
+                mask = atlas_lookup.lookup(dset, cls=voxcell.ROIMask)
+                ids = cells.index[mask] - 1  # CellCollection is 1 based, SONATA is 0 based
                 assert name not in result
                 result[name] = {"population": population, "node_id": ids.tolist()}
 
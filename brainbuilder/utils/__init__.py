@@ -1,8 +1,13 @@
 # SPDX-License-Identifier: Apache-2.0
-""" libraries of common functionality for circuit building """
+"""libraries of common functionality for circuit building"""
 
 import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import yaml
 
 
@@ -45,3 +50,40 @@ def dump_yaml(filepath, data):
     """Dump to YAML file."""
     with open(filepath, "w", encoding="utf-8") as f:
         yaml.safe_dump(data, f)
+
+
+def make_categorical(codes, categories):
+    """Return the categorical of the given codes (-1: missing value) over `categories`.
+
+    The categories are sorted, so that sorting by the categorical sorts by value.
+    """
+    categories = np.asarray(categories, dtype=object)
+    order = np.argsort(categories)
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    result = np.full(len(codes), -1, dtype=np.int64)
+    valid = codes >= 0
+    result[valid] = ranks[codes[valid]]
+    return pd.Categorical.from_codes(result, categories[order])
+
+
+@contextmanager
+def shared_arrays(*items):
+    """Context manager that temporarily replaces the given array attributes with read-only
+    memmaps, so that they are shared with the worker processes instead of being copied for
+    every task.
+
+    Args:
+        items: (object, attribute name) pairs
+    """
+    arrays = [getattr(obj, attr) for obj, attr in items]
+    with tempfile.TemporaryDirectory(prefix="brainbuilder-") as tmpdir:
+        try:
+            for i, (obj, attr) in enumerate(items):
+                filepath = Path(tmpdir, f"{i}.npy")
+                np.save(filepath, getattr(obj, attr))
+                setattr(obj, attr, np.load(filepath, mmap_mode="r"))
+            yield
+        finally:
+            for (obj, attr), array in zip(items, arrays):
+                setattr(obj, attr, array)
@@ -138,8 +138,15 @@ def write_property_targets(f, cells, prop, mapping=None):
         write_target(f, value, gids=gids)
 
 
-def assign_emodels(cells, morphdb):
-    """Assign electrical models to CellCollection based MorphDB."""
+def assign_emodels(cells, morphdb, rng=None):
+    """Assign electrical models to CellCollection based MorphDB.
+
+    Args:
+        cells: CellCollection
+        morphdb: MorphDB dataframe, see `load_extneurondb`
+        rng: (optional) numpy.random.Generator used to choose among several available
+            'me_combo'; the global numpy random state is used by default.
+    """
     df = cells.as_dataframe()
 
     ME_COMBO = "me_combo"
@@ -162,7 +169,7 @@ def assign_emodels(cells, morphdb):
         raise BrainBuilderError(f"Could not pick emodel for {not_assigned} cell(s)")
 
     # choose 'me_combo' randomly if several are available
-    df = df.sample(frac=1)
+    df = df.sample(frac=1, random_state=rng)
     df = df[~df.index.duplicated(keep="first")]
 
     df = df.sort_index()
@@ -3,6 +3,7 @@
 
 import json
 
+import numpy as np
 import scipy.stats
 
 
@@ -47,3 +48,17 @@ def parse_distr(value):
     else:
         # Try to instantiate a distribution directly from `scipy.stats`, w/o parameter guessing
         return getattr(scipy.stats, func)(**params)
+
+
+def get_rng(rng=None):
+    """Returns a `numpy.random.Generator`.
+
+    Args:
+        rng: a numpy.random.Generator, returned as is, or a seed (int or
+            numpy.random.SeedSequence) of a new Generator. If None, the new Generator is
+            seeded from the global numpy random state, so that ``np.random.seed`` still makes
+            the results reproducible.
+    """
+    if rng is None:
+        return np.random.default_rng(np.random.randint(np.iinfo(np.int64).max, dtype=np.int64))
+    return np.random.default_rng(rng)
@@ -0,0 +1,234 @@
+# SPDX-License-Identifier: Apache-2.0
+"""Streaming reading and writing of SONATA node populations."""
+
+import logging
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from brainbuilder import utils
+from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.utils import make_categorical
+
+L = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+
+
+def _is_string_column(series):
+    return isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(series)
+
+
+def _make_appendable(group, name, dtype=None):
+    """Helper function that replaces a fixed size dataset of `group` by an appendable one,
+    with the same values and attributes; the values are converted to `dtype`, if given."""
+    dset = group[name]
+    dtype = dset.dtype if dtype is None else np.dtype(dtype)
+    if dset.maxshape[0] is None and dtype == dset.dtype:
+        return dset
+    values, attrs = dset[()].astype(dtype), dict(dset.attrs)
+    del group[name]
+    utils.create_appendable_dataset(group, name, dtype, chunksize=CHUNK_SIZE)
+    dset = group[name]
+    if len(values) > 0:
+        utils.append_to_dataset(dset, values)
+    dset.attrs.update(attrs)
+    return dset
+
+
+def load_libraries(population):
+    """Returns the values of the `@library` of each property of a node population."""
+    libraries = population["0"].get("@library", {})
+    return {name: dset.asstr()[()] for name, dset in libraries.items()}
+
+
+def read_cells(population, start, stop, libraries=None):
+    """Returns the DataFrame of the properties of the cells [start, stop) of a node population.
+
+    Args:
+        population: h5py group of the node population
+        start, stop: range of the cells
+        libraries: the libraries of the population (default: loaded, see `load_libraries`)
+
+    Returns:
+        pandas.DataFrame with a column per property of the group "0" of the population; the
+        `@library` properties are categorical.
+    """
+    if libraries is None:
+        libraries = load_libraries(population)
+    columns = {}
+    for name, dset in population["0"].items():
+        if name == "@library":
+            continue
+        if not isinstance(dset, h5py.Dataset):
+            raise BrainBuilderError(f"Cannot read the property group: '{name}'")
+        if name in libraries:
+            columns[name] = make_categorical(dset[start:stop].astype(np.int64), libraries[name])
+        elif h5py.check_string_dtype(dset.dtype) is not None:
+            columns[name] = dset.asstr()[start:stop]
+        else:
+            columns[name] = dset[start:stop]
+    return pd.DataFrame(columns, index=pd.RangeIndex(max(stop - start, 0)))
+
+
+class NodePopulationWriter:
+    """Writer of a SONATA node population, appending the cells chunk by chunk.
+
+    The properties are written in the same layout as `voxcell.CellCollection.save_sonata`, in
+    the group "0" of the population; the string properties are written as `@library` codes.
+    The cells of every chunk are appended to the datasets of the properties, so that the whole
+    population never has to be held in memory.
+
+    When the population already exists (`mode="a"`), its datasets are extended.
+
+    As when concatenating DataFrames, the numerical properties missing from some chunks are NaN
+    for their cells, and the integer properties are converted to float to hold them.
+    """
+
+    def __init__(self, filepath, population_name, mode="w"):
+        """Constructor
+
+        Args:
+            filepath(str|Path): SONATA nodes file
+            population_name(str): name of the node population
+            mode(str): "w" to create the file, "a" to extend the population of an existing file
+        """
+        self._h5f = h5py.File(filepath, mode)
+        #: h5py group of the population
+        self.population = population = self._h5f.require_group(f"nodes/{population_name}")
+        self._group = population.require_group("0")
+        if "node_type_id" not in population:
+            utils.create_appendable_dataset(
+                population, "node_type_id", np.int64, chunksize=CHUNK_SIZE
+            )
+        self._node_type_id = _make_appendable(population, "node_type_id")
+
+        #: the values of the library of each string property, with their code
+        self._libraries = {}
+        self._names = None
+        self._empty = None
+        if len(self._node_type_id) > 0:
+            self._init_existing()
+
+    @property
+    def size(self):
+        """Number of cells of the population."""
+        return len(self._node_type_id)
+
+    def _init_existing(self):
+        """Makes the datasets of an existing non-empty population appendable."""
+        self._names = {name for name in self._group if name != "@library"}
+        for name in self._names:
+            if not isinstance(self._group[name], h5py.Dataset):
+                raise BrainBuilderError(f"Cannot extend the property group: '{name}'")
+            _make_appendable(self._group, name)
+        for name in self._group.get("@library", []):
+            library = _make_appendable(self._group["@library"], name)
+            self._libraries[name] = {value: code for code, value in enumerate(library.asstr()[()])}
+
+    def _init_datasets(self, cells):
+        """Creates the datasets of the properties of `cells`."""
+        self._names = set(cells.columns)
+        for name, series in cells.items():
+            if _is_string_column(series):
+                utils.create_appendable_dataset(self._group, name, np.uint32, chunksize=CHUNK_SIZE)
+                utils.create_appendable_dataset(
+                    self._group.require_group("@library"),
+                    name,
+                    h5py.string_dtype(),
+                    chunksize=CHUNK_SIZE,
+                )
+                self._libraries[name] = {}
+            else:
+                utils.create_appendable_dataset(
+                    self._group, name, series.dtype, chunksize=CHUNK_SIZE
+                )
+
+    def _get_codes(self, name, series):
+        """Returns the library codes of the string values of `series`, extending the library
+        with the new values."""
+        values = pd.Categorical(series)
+        if np.any(values.codes < 0):
+            raise BrainBuilderError(f"Missing '{name}' values")
+        library = self._libraries[name]
+        new_values = [value for value in values.categories if value not in library]
+        if new_values:
+            library.update(zip(new_values, range(len(library), len(library) + len(new_values))))
+            utils.append_to_dataset(self._group["@library"][name], new_values)
+        lookup = np.array([library[value] for value in values.categories], dtype=np.uint32)
+        return lookup[values.codes]
+
+    def _align(self, cells):
+        """Returns `cells` with all the properties of the population: the numerical properties
+        missing from `cells` are NaN, the new ones are created with NaN for the previous cells.
+
+        Raises:
+            BrainBuilderError if a missing property is a string one.
+        """
+        for name in self._names.symmetric_difference(cells.columns):
+            if (
+                name in self._libraries
+                or (name in cells and _is_string_column(cells[name]))
+                or (name in self._group and self._group[name].dtype.kind not in "biuf")
+            ):
+                raise BrainBuilderError(f"Missing '{name}' values")
+        for name in sorted(set(cells.columns) - self._names):
+            dtype = np.result_type(cells[name].dtype, np.float64)
+            utils.create_appendable_dataset(self._group, name, dtype, chunksize=CHUNK_SIZE)
+            utils.append_to_dataset(self._group[name], np.full(self.size, np.nan, dtype=dtype))
+            self._names.add(name)
+        return cells.assign(**{name: np.nan for name in sorted(self._names - set(cells.columns))})
+
+    def _get_values(self, name, series):
+        dset = self._group[name]
+        if name in self._libraries:
+            return self._get_codes(name, series)
+        if h5py.check_string_dtype(dset.dtype) is not None:
+            if series.isna().any():
+                raise BrainBuilderError(f"Missing '{name}' values")
+            return series.astype(str).to_numpy(dtype=object)
+        if _is_string_column(series) or series.dtype.kind not in "biuf":
+            raise BrainBuilderError(
+                f"Cannot write the '{series.dtype}' values of '{name}' as '{dset.dtype}'"
+            )
+        if not np.can_cast(series.dtype, dset.dtype, "same_kind"):
+            # e.g. NaN values of an integer property
+            dset = _make_appendable(self._group, name, np.result_type(series.dtype, dset.dtype))
+        return series.to_numpy(dtype=dset.dtype)
+
+    def append(self, cells):
+        """Appends the cells of a DataFrame, with a column per property, to the population.
+
+        Raises:
+            BrainBuilderError if string values are missing, or cannot be written.
+        """
+        if len(cells) == 0:
+            # the datasets are created from the first non-empty chunk, empty columns may not
+            # have the dtype of their values
+            self._empty = cells
+            return
+        if self._names is None:
+            self._init_datasets(cells)
+        elif self._names != set(cells.columns):
+            cells = self._align(cells)
+
+        # all the values are checked before any of them is written
+        values = {name: self._get_values(name, series) for name, series in cells.items()}
+        for name, value in values.items():
+            utils.append_to_dataset(self._group[name], value)
+        utils.append_to_dataset(self._node_type_id, np.full(len(cells), -1, dtype=np.int64))
+
+    def close(self):
+        """Closes the file, creating the datasets of the properties if no cell was written."""
+        if self._h5f:
+            if self._names is None and self._empty is not None:
+                self._init_datasets(self._empty)
+            self._h5f.close()
+            self._h5f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,11 +1,13 @@
 # SPDX-License-Identifier: Apache-2.0
 """test positions_and_orientations"""
 
+import os
 from unittest.mock import patch
 
 import h5py
 import numpy as np
 import numpy.testing as npt
+import pandas as pd
 from click.testing import CliRunner
 from voxcell import CellCollection, VoxelData  # type: ignore
 
@@ -13,7 +15,7 @@ import brainbuilder.app.cells as tested
 from brainbuilder.utils import dump_yaml
 
 
-def get_result(runner):
+def get_result(runner, *args):
     return runner.invoke(
         tested.positions_and_orientations,
         [
@@ -25,6 +27,7 @@ def get_result(runner):
             "config.yaml",
             "--output-path",
             "positions_and_orientations.h5",
+            *args,
         ],
     )
 
@@ -185,6 +188,42 @@ def test_positions_and_orientations_valid_input():
         )
 
 
+def test_positions_and_orientations_jobs(monkeypatch):
+    monkeypatch.setattr(tested, "ATLAS_CELLS_CHUNK_SIZE", 5)
+    input_ = create_input()
+    config = create_density_configuration()
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        dump_yaml("config.yaml", config)
+        for cell_type, path in config["inputDensityVolumePath"].items():
+            VoxelData(input_[cell_type] * (1e9 / 25**3), voxel_dimensions=[25] * 3).save_nrrd(path)
+        for input_voxel_data in ["annotation", "orientation"]:
+            VoxelData(input_[input_voxel_data], voxel_dimensions=[25] * 3).save_nrrd(
+                input_voxel_data + ".nrrd"
+            )
+        results = []
+        for args in [[], ["--jobs", "2"], ["--seed", "1"]]:
+            result = get_result(runner, *args)
+            assert result.exit_code == 0, result.output
+            results.append(CellCollection.load_sonata("positions_and_orientations.h5"))
+            os.remove("positions_and_orientations.h5")
+
+        expected = results[0].as_dataframe()
+        assert len(expected) == 43
+        # the cell types are in config order (sorted by dump_yaml), with the count of their density
+        cell_types = sorted(config["inputDensityVolumePath"])
+        assert list(expected["cell_type"].unique()) == cell_types
+        npt.assert_array_equal(
+            expected.groupby("cell_type", observed=True).size()[cell_types], [17, 12, 2, 3, 9]
+        )
+        pd.testing.assert_frame_equal(results[1].as_dataframe(), expected)
+        # another seed moves the cells, not their types
+        assert not np.allclose(results[2].positions, results[0].positions)
+        pd.testing.assert_series_equal(
+            results[2].as_dataframe()["cell_type"], expected["cell_type"]
+        )
+
+
 def test_positions_and_orientations_invalid_input():
     config = create_density_configuration()
     input_ = create_input()
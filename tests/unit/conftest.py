@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: Apache-2.0
+import json
+
+import numpy as np
+import pytest
+import voxcell
+
+
+@pytest.fixture
+def atlas_dir(tmp_path):
+    hierarchy = {
+        "id": 1,
+        "acronym": "root",
+        "name": "root",
+        "children": [
+            {"id": 2, "acronym": "A", "name": "A", "children": []},
+            {"id": 3, "acronym": "B", "name": "B", "children": []},
+        ],
+    }
+    (tmp_path / "hierarchy.json").write_text(json.dumps(hierarchy))
+
+    raw = np.zeros((12, 12, 12), dtype=np.int32)
+    raw[1:6, 1:11, 1:11] = 2
+    raw[6:11, 1:11, 1:11] = 3
+    brain_regions = voxcell.VoxelData(raw, voxel_dimensions=(25, 25, 25))
+    brain_regions.save_nrrd(str(tmp_path / "brain_regions.nrrd"))
+    brain_regions.with_data(np.linspace(0, 1e5, 12**3).reshape(raw.shape)).save_nrrd(
+        str(tmp_path / "gradient.nrrd")
+    )
+
+    (tmp_path / "composition.yaml").write_text("""version: v2.0
+neurons:
+  - density: 100000
+    region: A
+    traits:
+      layer: A
+      mtype: L1_DAC
+      etype:
+        bNAC: 0.5
+        cNAC: 0.5
+  - density: '{gradient}'
+    region: root
+    traits:
+      layer: root
+      mtype: L1_HAC
+      etype: bNAC
+  - density: 50000
+    region: B
+    traits:
+      layer: B
+      mtype: L1_DAC
+      etype: cNAC
+""")
+    (tmp_path / "mtypes.tsv").write_text("mtype mClass sClass\nL1_DAC INT INH\nL1_HAC INT INH\n")
+    return tmp_path
@@ -5,7 +5,7 @@ from unittest.mock import Mock
 import numpy as np
 import pandas as pd
 
-import brainbuilder.app.cells as test_module
+import brainbuilder.placement as test_module
 
 DATA_PATH = Path(__file__).resolve().parent / "data"
 
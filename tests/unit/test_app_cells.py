@@ -1,9 +1,11 @@
 # SPDX-License-Identifier: Apache-2.0
 import numpy as np
+import pytest
 import voxcell
 
 from brainbuilder.app import cells as test_module
 from brainbuilder.cell_positions import _get_cell_count
+from brainbuilder.exceptions import BrainBuilderError
 
 
 def test_load_density__dangerously_low_densities(tmp_path):
@@ -55,3 +57,28 @@ def test_load_density__near_zero_values_are_ignored(tmp_path):
 
     # Sanity check for the remaining entries
     assert np.count_nonzero(result) == 18
+
+
+def test_parse_shard():
+    assert test_module._parse_shard("1/3") == (1, 3)
+    for value in ["3/3", "-1/2", "1", "a/b"]:
+        with pytest.raises(BrainBuilderError, match="Invalid shard"):
+            test_module._parse_shard(value)
+
+
+def test_load_variants(tmp_path):
+    assert test_module._load_variants() == []
+    sweep_path = tmp_path / "sweep.yaml"
+    sweep_path.write_text("seed: [1, 2]\ndensity_factor: [0.5, 1]\n")
+    assert test_module._load_variants([(0, 2)], sweep_path) == [
+        (0, 2.0),
+        (1, 0.5),
+        (1, 1.0),
+        (2, 0.5),
+        (2, 1.0),
+    ]
+    sweep_path.write_text("seed: 3\n")
+    assert test_module._load_variants(sweep_path=sweep_path) == [(3, 1.0)]
+    sweep_path.write_text("seeds: [1, 2]\n")
+    with pytest.raises(BrainBuilderError, match="Invalid sweep spec"):
+        test_module._load_variants(sweep_path=sweep_path)
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: Apache-2.0
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+from voxcell import RegionMap, ROIMask, VoxcellError, VoxelData, values_to_region_attribute
+
+import brainbuilder.atlas_lookup as test_module
+from brainbuilder.exceptions import BrainBuilderError
+
+DATA_PATH = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def region_map():
+    return RegionMap.load_json(DATA_PATH / "hierarchy.json")
+
+
+@pytest.fixture
+def brain_regions(region_map):
+    region_ids = list(region_map.find("root", attr="acronym", with_descendants=True))
+    raw = np.random.RandomState(0).choice(region_ids, (10, 20, 30))
+    return VoxelData(raw.astype(np.int32), voxel_dimensions=(25, 25, 25), offset=(10, 20, 30))
+
+
+@pytest.fixture
+def positions(brain_regions):
+    rng = np.random.default_rng(0)
+    return rng.uniform(brain_regions.bbox[0], brain_regions.bbox[1], (1000, 3))
+
+
+def test_lookup(brain_regions, positions):
+    atlas_lookup = test_module.AtlasLookup(positions, chunk_size=300)
+    npt.assert_array_equal(atlas_lookup.lookup(brain_regions), brain_regions.lookup(positions))
+
+    # the voxel indices are shared by the datasets with the same geometry
+    payload = brain_regions.with_data(np.random.default_rng(0).random(brain_regions.shape + (4,)))
+    npt.assert_array_equal(atlas_lookup.lookup(payload), payload.lookup(positions))
+    assert len(atlas_lookup._indices) == 1
+
+    other = VoxelData(np.arange(8.0).reshape((2, 2, 2)), voxel_dimensions=(1000, 1000, 1000))
+    npt.assert_array_equal(atlas_lookup.lookup(other), other.lookup(positions))
+    assert len(atlas_lookup._indices) == 2
+
+    with pytest.raises(VoxcellError):
+        test_module.AtlasLookup(positions - 1000).lookup(brain_regions)
+
+
+def test_lookup__atlas(brain_regions, positions):
+    mask = ROIMask(
+        (brain_regions.raw % 2).astype(bool), voxel_dimensions=(25, 25, 25), offset=(10, 20, 30)
+    )
+    atlas = Mock()
+    atlas.load_data.return_value = mask
+
+    atlas_lookup = test_module.AtlasLookup(positions, atlas)
+    for _ in range(2):
+        npt.assert_array_equal(atlas_lookup.lookup("mask", cls=ROIMask), mask.lookup(positions))
+    atlas.load_data.assert_called_once_with("mask", cls=ROIMask)
+
+
+def test_lookup_region_attribute(brain_regions, region_map, positions):
+    atlas_lookup = test_module.AtlasLookup(positions)
+    result = atlas_lookup.lookup_region_attribute(brain_regions, region_map=region_map)
+
+    expected = values_to_region_attribute(brain_regions.lookup(positions), region_map)
+    npt.assert_array_equal(result.astype(str), expected)
+    assert list(result.categories) == sorted(set(expected))
+
+    brain_regions.raw[:] = 123456789
+    with pytest.raises(BrainBuilderError, match="Region ids not in the hierarchy"):
+        atlas_lookup.lookup_region_attribute(brain_regions, region_map=region_map)
+
+
+def test_lookup_hemisphere(brain_regions, positions):
+    hemisphere = brain_regions.with_data(brain_regions.raw % 3)
+    result = test_module.AtlasLookup(positions).lookup_hemisphere(hemisphere)
+
+    expected = np.array(test_module.HEMISPHERES)[hemisphere.lookup(positions)]
+    npt.assert_array_equal(result.astype(str), expected)
+
+    with pytest.raises(BrainBuilderError, match="Invalid hemisphere values"):
+        test_module.AtlasLookup(positions).lookup_hemisphere(brain_regions)
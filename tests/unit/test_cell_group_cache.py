@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: Apache-2.0
+import os
+
+import numpy as np
+import pandas as pd
+
+import brainbuilder.cell_group_cache as test_module
+
+
+def _cells(n):
+    return pd.DataFrame(
+        {
+            "x": np.arange(n, dtype=float),
+            "layer": np.arange(n),
+            "mtype": pd.Categorical(["b", "a"] * (n // 2)),
+        }
+    )
+
+
+def test_cell_group_cache(tmp_path):
+    cache = test_module.CellGroupCache(tmp_path / "cache")
+    assert "key" not in cache
+    assert cache.get("key") is None
+
+    cells = _cells(4)
+    cache.put("key", cells)
+    assert "key" in cache
+    pd.testing.assert_frame_equal(cache.get("key"), cells)
+
+    # the columns of mixed object values are not cached
+    cache.put("other", cells.assign(etype=["a", 1, "b", 2.0]))
+    assert "other" not in cache
+
+
+def test_cell_group_cache__evict(tmp_path):
+    cache = test_module.CellGroupCache(tmp_path)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, _cells(100))
+        os.utime(tmp_path / f"{key}.npz", (i, i))
+    size = (tmp_path / "a.npz").stat().st_size
+
+    assert cache.evict() == 0
+
+    # the entry read last is kept
+    assert "a" in cache
+    cache.max_size = 2 * size
+    assert cache.evict() == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.npz", "c.npz"]
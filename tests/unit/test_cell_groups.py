@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+from voxcell.nexus.voxelbrain import Atlas
+
+from brainbuilder import cell_groups as test_module
+from brainbuilder.density_cache import DensityCache
+from brainbuilder.region_index import RegionIndex
+
+
+def test_search_cdfs():
+    cdfs = [np.array([1.0, 1.0, 4.0]), np.array([0.5])]
+    group_ids = np.array([0, 0, 0, 1, 1])
+    uniforms = np.array([0.1, 0.3, 0.9999999999999999, 0.0, 0.9999999999999999])
+    npt.assert_array_equal(test_module._search_cdfs(cdfs, group_ids, uniforms), [0, 2, 2, 3, 3])
+
+
+@pytest.mark.parametrize("soma_placement", ["basic", "multinomial"])
+def test_create_cell_groups_batch(atlas_dir, soma_placement):
+    atlas = Atlas.open(str(atlas_dir))
+    region_index = RegionIndex(atlas.load_data("brain_regions"), atlas.load_region_map())
+    density_cache = DensityCache(atlas)
+    conf_list = [
+        {"density": 100000, "region": "A", "traits": {"mtype": "L1_DAC", "layer": 1}},
+        {"density": 10000, "region": "B", "traits": {"mtype": {"L1_DAC": 0.5, "L1_HAC": 0.5}}},
+        {"density": "{gradient}", "region": "root", "traits": {"mtype": {"L1_HAC": 1.0}}},
+    ]
+
+    result = test_module._create_cell_groups_batch(
+        conf_list,
+        density_cache,
+        region_index,
+        1.0,
+        soma_placement,
+        test_module._get_group_rngs(0, conf_list),
+    )
+
+    # the batch is the same as the groups created one by one, with their own generator
+    expected = test_module.concat_cells(
+        test_module._create_cell_group(conf, density_cache, region_index, 1.0, soma_placement, rng)
+        for conf, rng in zip(conf_list, test_module._get_group_rngs(0, conf_list))
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result.columns) == ["x", "y", "z", "mtype", "layer"]
+    assert set(result["mtype"]) == {"L1_DAC", "L1_HAC"}
+    # the trait missing from some groups is NaN for their cells
+    assert set(result["layer"].dropna()) == {1}
+    assert result["layer"].isna().any()
+    assert "sampling_stats" not in result.attrs
+
+
+@pytest.mark.parametrize("soma_placement", ["basic", "multinomial"])
+def test_create_cell_groups_batch__negative_densities(atlas_dir, soma_placement):
+    atlas = Atlas.open(str(atlas_dir))
+    raw = np.full((12, 12, 12), 100000.0)
+    raw[3, 3, 3] = -100000.0
+    atlas.load_data("brain_regions").with_data(raw).save_nrrd(str(atlas_dir / "negative.nrrd"))
+    region_index = RegionIndex(atlas.load_data("brain_regions"), atlas.load_region_map())
+    conf_list = [{"density": "{negative}", "region": "A", "traits": {"mtype": "L1_DAC"}}]
+
+    with pytest.raises(ValueError, match="Found negative densities"):
+        test_module._create_cell_groups_batch(
+            conf_list,
+            DensityCache(atlas),
+            region_index,
+            1.0,
+            soma_placement,
+            test_module._get_group_rngs(0, conf_list),
+        )
+
+
+def test_create_cell_groups_batch__sampling_stats(atlas_dir):
+    atlas = Atlas.open(str(atlas_dir))
+    region_index = RegionIndex(atlas.load_data("brain_regions"), atlas.load_region_map())
+    density_cache = DensityCache(atlas)
+    conf_list = [
+        {"density": 100000, "region": "A", "traits": {"mtype": "L1_DAC"}},
+        {"density": 10000, "region": "B", "traits": {"mtype": "L1_HAC"}},
+    ]
+
+    result, counts = test_module._create_cell_groups_batch(
+        conf_list,
+        density_cache,
+        region_index,
+        1.0,
+        "poisson_disc",
+        test_module._get_group_rngs(0, conf_list),
+        return_counts=True,
+    )
+
+    # the statistics of the sampling are attached to the result, per group
+    stats = result.attrs["sampling_stats"]
+    assert len(stats) == len(conf_list)
+    assert [s.nb_points for s in stats] == list(counts)
+    assert all(s.nb_target >= s.nb_points for s in stats)
+
+
+def test_get_group_rngs():
+    group_a = {"density": 1000, "region": "A", "traits": {"mtype": "L1_DAC"}}
+    group_b = {"density": 1000, "region": "B", "traits": {"mtype": "L1_DAC"}}
+
+    rngs = test_module._get_group_rngs(0, [group_a, group_b, group_a])
+    values = [rng.random() for rng in rngs]
+    assert len(set(values)) == 3
+
+    # the generator of a group does not depend on its position in the recipe
+    rngs = test_module._get_group_rngs(0, [group_b, group_a])
+    assert [rng.random() for rng in rngs] == [values[1], values[0]]
+    assert test_module._get_group_rngs(1, [group_a])[0].random() != values[0]
+
+
+def test_concat_cells():
+    result = test_module.concat_cells(
+        [
+            pd.DataFrame({"x": [1.0], "mtype": pd.Categorical(["b"])}),
+            pd.DataFrame({"x": [2.0, 3.0], "mtype": pd.Categorical(["a", "c"]), "layer": [1, 2]}),
+            pd.DataFrame({"x": [4.0]}),
+        ]
+    )
+    assert list(result["mtype"].cat.categories) == ["a", "b", "c"]
+    assert list(result["mtype"].astype(object)) == ["b", "a", "c", np.nan]
+    npt.assert_array_equal(result["layer"], [np.nan, 1, 2, np.nan])
@@ -41,3 +41,10 @@ def test_apply_random_rotation():
     A = np.random.random((2, 3, 3))
     A2 = test_module.apply_random_rotation(A, "x", distr=("uniform", {"low": 0, "high": np.pi}))
     assert A2.shape == A.shape
+    A3 = test_module.apply_random_rotation(
+        A, "x", distr=("uniform", {"low": 0, "high": np.pi}), rng=np.random.default_rng(0)
+    )
+    A4 = test_module.apply_random_rotation(
+        A, "x", distr=("uniform", {"low": 0, "high": np.pi}), rng=np.random.default_rng(0)
+    )
+    npt.assert_array_equal(A3, A4)
@@ -6,6 +6,7 @@ from pytest import raises
 from voxcell import VoxelData
 
 import brainbuilder.cell_positions as test_module
+from brainbuilder.poisson_disc_sampling import SamplingStats
 
 
 def test_create_cell_positions_1():
@@ -145,3 +146,269 @@ def test_get_bbox_nonzero_entries():
     result = test_module.get_bbox_nonzero_entries(data, bbox, voxel_dimensions)
 
     assert np.array_equal(result, bbox_nonzero)
+
+
+def test_create_cell_positions_poisson_disc_vectorized():
+    density = VoxelData(1000 * np.ones((3, 3, 3)), voxel_dimensions=(100, 100, 100))
+    density.raw[1, 1, 1] = 4000
+    max_expected_nb_points = 30
+
+    result = test_module.create_cell_positions(density, method="poisson_disc_vectorized", seed=0)
+
+    assert 0 < result.shape[0] <= max_expected_nb_points
+    assert np.all((result >= 0) & (result <= 3 * 100))
+
+    min_distance = 0.84 * 100.0 / np.power(4.0, 1.0 / 3.0)
+    min_distance_between_pts = np.min(distance.pdist(result).flatten())
+    assert min_distance <= min_distance_between_pts
+
+
+def test_create_cell_positions_poisson_disc_adaptive():
+    density = VoxelData(20000 * np.ones((6, 6, 6)), voxel_dimensions=(25, 25, 25))
+    density.raw[:3] = 80000
+    _, cell_count = test_module._get_cell_count(density, 1.0)
+
+    stats = SamplingStats()
+    result = test_module.create_cell_positions(
+        density, method="poisson_disc_adaptive", seed=0, stats=stats
+    )
+
+    assert 0 < result.shape[0] <= cell_count
+    assert np.all((result >= 0) & (result <= 6 * 25))
+    min_distance = 0.84 * 25 / np.power(80000 * 25**3 / 1e9, 1.0 / 3.0)
+    assert min_distance <= np.min(distance.pdist(result))
+    assert stats.nb_target == cell_count
+    assert stats.nb_points == result.shape[0]
+    # the poisson disc sampling is not adaptive by default
+    npt.assert_array_equal(
+        test_module.create_cell_positions(density, method="poisson_disc", seed=0),
+        test_module._create_cell_positions_poisson_disc(
+            density, 1.0, adaptive=False, rng=np.random.default_rng(0)
+        ),
+    )
+
+
+def test_create_cell_positions_poisson_disc_parallel():
+    density = VoxelData(20000 * np.ones((6, 6, 6)), voxel_dimensions=(25, 25, 25))
+    density.raw[:3] = 80000
+    _, cell_count = test_module._get_cell_count(density, 1.0)
+
+    np.random.seed(0)
+    stats = SamplingStats()
+    result = test_module._create_cell_positions_poisson_disc_parallel(
+        density, 1.0, tile_size=2, n_jobs=1, stats=stats
+    )
+
+    assert 0 < result.shape[0] <= cell_count
+    # the statistics of the tiles are added up
+    assert stats.nb_target == cell_count
+    assert stats.nb_points == result.shape[0]
+    assert np.all((result >= 0) & (result <= 6 * 25))
+    # minimum distance is kept across the tile borders
+    min_distance = 0.84 * 25 / np.power(80000 * 25**3 / 1e9, 1.0 / 3.0)
+    assert min_distance <= np.min(distance.pdist(result))
+
+    # the result does not depend on the number of workers
+    np.random.seed(0)
+    result_2 = test_module._create_cell_positions_poisson_disc_parallel(
+        density, 1.0, tile_size=2, n_jobs=2
+    )
+    npt.assert_array_equal(result, result_2)
+
+
+def test_create_cell_positions_poisson_disc_pattern(monkeypatch):
+    monkeypatch.setattr(test_module.poisson_disc_sampling, "PERIODIC_PATTERN_NB_POINTS", 500)
+    density = VoxelData(80000 * np.ones((12, 12, 12)), voxel_dimensions=(25, 25, 25))
+    density.raw[:2] = 20000
+    density.raw[-1] = 0
+    _, cell_count = test_module._get_cell_count(density, 1.0)
+
+    np.random.seed(0)
+    result = test_module.create_cell_positions(density, method="poisson_disc_pattern")
+
+    assert 0.9 * cell_count < result.shape[0] <= cell_count
+    assert np.all((result >= 0) & (result <= 12 * 25))
+    assert np.all(result[:, 0] <= 11 * 25)
+    # minimum distance is kept between the pattern and the sampled positions
+    min_distance = 0.84 * 25 / np.power(80000 * 25**3 / 1e9, 1.0 / 3.0)
+    assert min_distance <= np.min(distance.pdist(result)) * (1 + 1e-6)
+    assert np.count_nonzero(result[:, 0] < 2 * 25) < 0.3 * result.shape[0]
+
+
+def test_create_cell_positions_poisson_disc_pattern__shortfall(monkeypatch):
+    monkeypatch.setattr(test_module.poisson_disc_sampling, "PERIODIC_PATTERN_NB_POINTS", 500)
+    tile_periodic_pattern = test_module._tile_periodic_pattern
+    # the pattern misses 200 cells of the constant density region
+    monkeypatch.setattr(
+        test_module, "_tile_periodic_pattern", lambda *args: tile_periodic_pattern(*args)[200:]
+    )
+    generate_poisson_disc_positions = test_module._generate_poisson_disc_positions
+    cell_counts = []
+
+    def _generate(density, cell_count_per_voxel, cell_count, **kwargs):
+        cell_counts.append(cell_count)
+        return generate_poisson_disc_positions(density, cell_count_per_voxel, cell_count, **kwargs)
+
+    monkeypatch.setattr(test_module, "_generate_poisson_disc_positions", _generate)
+    density = VoxelData(80000 * np.ones((12, 12, 12)), voxel_dimensions=(25, 25, 25))
+    density.raw[:2] = 20000
+
+    result = test_module.create_cell_positions(
+        density, method="poisson_disc_pattern", rng=np.random.default_rng(0)
+    )
+
+    # the other voxels keep their own cell count
+    assert cell_counts == [np.round(2 * 12 * 12 * 20000 * 25**3 / 1e9)]
+    assert len(result) <= 10 * 12 * 12 * 80000 * 25**3 / 1e9 - 200 + cell_counts[0]
+
+
+def test_distribute_cell_count():
+    result = test_module._distribute_cell_count(np.array([0.5, 1.4, 2.6, 0.5]), 5)
+    npt.assert_array_equal(result, [1, 1, 3, 0])
+
+
+def test_local_distance_field():
+    density = VoxelData(np.zeros((5, 5, 5)), voxel_dimensions=(10, 10, 10), offset=(-5, 0, 5))
+    density.raw[1:3, 2, 2:4] = [[1.0, 8.0], [27.0, 1.0]]
+    field = test_module.LocalDistanceField(density, density.raw)
+
+    assert field.distances.dtype == np.float32
+    assert field.distances.shape == (2, 1, 2)
+    npt.assert_allclose(field(), 0.84 * 10 / 3)
+    npt.assert_allclose(field.max_distance, 0.84 * 10)
+    assert field.nonzero_fraction == 1.0
+
+    points = np.array([[6.0, 21.0, 26.0], [20.0, 25.0, 30.0], [15.0, 30.0, 45.0]])
+    npt.assert_allclose(field(points), [0.84 * 10, 0.84 * 10 / 3, 0.84 * 10], rtol=1e-6)
+    npt.assert_allclose(field(points[1]), 0.84 * 10 / 3, rtol=1e-6)
+    assert np.all(field(points).astype(np.float64) >= 0.84 * 10 / np.cbrt([1, 27, 1]))
+
+    # no cell is expected outside the nonzero voxels
+    density.raw[1, 2, 3] = 0
+    field = test_module.LocalDistanceField(density, density.raw)
+    assert field.nonzero_fraction == 0.75
+    assert field(np.array([10.0, 25.0, 40.0])) == np.inf
+    npt.assert_allclose(field.max_distance, 0.84 * 10)
+
+
+def test_create_cell_positions_poisson_disc_shell(monkeypatch):
+    # a spherical shell: most of the bounding box has no density
+    ijk = np.indices((20, 20, 20)) - 9.5
+    radius = np.sqrt(np.sum(ijk**2, axis=0))
+    density = VoxelData(
+        np.where((radius > 7) & (radius < 9), 80000.0, 0.0), voxel_dimensions=(25, 25, 25)
+    )
+    cell_count_per_voxel, _ = test_module._get_cell_count(density, 1.0)
+    max_distance = test_module.LocalDistanceField(density, cell_count_per_voxel).max_distance
+
+    queried = []
+    get_sample_indices_in_neighbourhood = (
+        test_module.poisson_disc_sampling.Grid.get_sample_indices_in_neighbourhood
+    )
+
+    def spy(grid, point, distance):
+        queried.append(distance)
+        return get_sample_indices_in_neighbourhood(grid, point, distance)
+
+    monkeypatch.setattr(
+        test_module.poisson_disc_sampling.Grid, "get_sample_indices_in_neighbourhood", spy
+    )
+    for method in ("poisson_disc", "poisson_disc_vectorized"):
+        queried.clear()
+        result = test_module.create_cell_positions(density, method=method, seed=0)
+
+        assert len(result) > 0
+        assert np.all(density.lookup(result) > 0)
+        # the neighbourhood queries never cover the whole grid
+        assert 0 < max(queried) <= 4 * max_distance
+
+
+def test_iter_cell_positions():
+    density = VoxelData(np.zeros((4, 4, 4)), voxel_dimensions=(10, 10, 10), offset=(-20, 0, 5))
+    density.raw[0, 1, 2] = 1000 * 1e9 / 1000
+    density.raw[3, 3, 3] = 500 * 1e9 / 1000
+
+    chunks = list(test_module.iter_cell_positions(density, chunk_size=400, seed=0))
+
+    # a voxel is never split between chunks
+    assert len(chunks) == 2
+    assert sum(len(chunk) for chunk in chunks) == 1500
+    assert all(chunk.dtype == np.float32 for chunk in chunks)
+    npt.assert_array_equal(density.positions_to_indices(chunks[0]), [[0, 1, 2]] * len(chunks[0]))
+    npt.assert_array_equal(density.positions_to_indices(chunks[1]), [[3, 3, 3]] * len(chunks[1]))
+
+    chunks = list(
+        test_module.iter_cell_positions(density, chunk_size=400, seed=0, return_voxels=True)
+    )
+    assert len(chunks) == 2
+    npt.assert_array_equal(chunks[0][1], np.ravel_multi_index((0, 1, 2), (4, 4, 4)))
+    npt.assert_array_equal(chunks[1][1], np.ravel_multi_index((3, 3, 3), (4, 4, 4)))
+    assert [len(voxels) for _, voxels in chunks] == [len(positions) for positions, _ in chunks]
+
+
+def test_iter_cell_positions_chunks():
+    density = VoxelData(1000 * np.ones((10, 10, 10)), voxel_dimensions=(100, 100, 100))
+    chunks = list(test_module.iter_cell_positions(density, chunk_size=100, seed=0))
+
+    assert sum(len(chunk) for chunk in chunks) == 1000
+    assert len(chunks) > 5
+    result = np.concatenate(chunks)
+    assert np.all((result >= 0) & (result <= 10 * 100))
+
+
+def test_iter_cell_positions__zero_counts():
+    density = VoxelData(np.zeros((3, 3, 3)), voxel_dimensions=(10, 10, 10))
+    assert list(test_module.iter_cell_positions(density)) == []
+
+
+def test_create_cell_positions_multinomial():
+    density = VoxelData(1000 * np.ones((3, 3, 3)), voxel_dimensions=(100, 100, 100))
+    result = test_module.create_cell_positions(density, method="multinomial", seed=0)
+    assert result.shape == (27, 3) and result.dtype == np.float32
+    assert np.all((result >= 0) & (result <= 3 * 100))
+
+    npt.assert_array_equal(
+        result, test_module.create_cell_positions(density, method="multinomial", seed=0)
+    )
+
+    density.raw[:] = 0
+    result = test_module.create_cell_positions(density, method="multinomial")
+    assert result.shape == (0, 3) and result.dtype == np.float32
+
+
+def test_create_cell_positions_stratified():
+    density = VoxelData(8000 * np.ones((3, 3, 3)), voxel_dimensions=(100, 100, 100))
+    density.raw[1, 1, 1] = 3000
+    density.raw[0, 0, 0] = 0
+    result = test_module.create_cell_positions(density, method="stratified", seed=0)
+
+    assert result.shape == (8 * 25 + 3, 3) and result.dtype == np.float32
+    indices = density.positions_to_indices(result)
+    counts = np.zeros(density.shape, dtype=int)
+    np.add.at(counts, tuple(indices.T), 1)
+    npt.assert_array_equal(counts, np.round(density.raw * 1e-3))
+
+    # each cell is in its own stratum
+    strata = np.floor(result[np.all(indices == [2, 2, 2], axis=1)] / 50)
+    assert len(np.unique(strata, axis=0)) == 8
+    strata = np.floor(result[np.all(indices == [1, 1, 1], axis=1)] / 50)
+    assert len(np.unique(strata, axis=0)) == 3
+
+    npt.assert_array_equal(
+        result, test_module.create_cell_positions(density, method="stratified", seed=0)
+    )
+
+
+def test_create_cell_positions_stratified_fractional():
+    density = VoxelData(1500 * np.ones((4, 4, 4)), voxel_dimensions=(100, 100, 100))
+    result = test_module.create_cell_positions(density, method="stratified", seed=0)
+
+    assert result.shape == (96, 3)
+    counts = np.bincount(np.ravel_multi_index(density.positions_to_indices(result).T, (4, 4, 4)))
+    assert set(counts) == {1, 2}
+
+
+def test_create_cell_positions__zero_counts__stratified():
+    density = VoxelData(np.zeros((3, 3, 3)), voxel_dimensions=(10, 10, 10))
+    result = test_module.create_cell_positions(density, method="stratified")
+    assert result.shape == (0, 3) and result.dtype == np.float32
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import numpy.testing as npt
+import pytest
+import voxcell
+
+from brainbuilder import density_cache as test_module
+from brainbuilder.exceptions import BrainBuilderError
+
+
+def test_check_density_values(monkeypatch):
+    monkeypatch.setattr(test_module, "DENSITY_CHECK_CHUNK_SIZE", 4)
+
+    values = np.array([1.0, 1e-8, -1e-8, 2.0, 0.0, 1e-8, 3.0, -2.0, 1e-9, 5.0])
+    test_module.check_density_values(values)
+    npt.assert_array_equal(values, [1.0, 0.0, 0.0, 2.0, 0.0, 0.0, 3.0, -2.0, 0.0, 5.0])
+
+    values[-1] = np.nan
+    with pytest.raises(BrainBuilderError, match="NaN density values"):
+        test_module.check_density_values(values)
+
+
+def test_mmap_nrrd(tmp_path):
+    raw = np.arange(24, dtype=np.float32).reshape((2, 3, 4))
+    expected = voxcell.VoxelData(raw, voxel_dimensions=(10, 20, 30), offset=(1, 2, 3))
+
+    expected.save_nrrd(str(tmp_path / "gzip.nrrd"))
+    assert test_module._mmap_nrrd(str(tmp_path / "gzip.nrrd")) is None
+
+    expected.save_nrrd(str(tmp_path / "raw.nrrd"), encoding="raw")
+    result = test_module._mmap_nrrd(str(tmp_path / "raw.nrrd"))
+    assert isinstance(result.raw, np.memmap)
+    npt.assert_array_equal(result.raw, raw)
+    npt.assert_array_equal(result.voxel_dimensions, expected.voxel_dimensions)
+    npt.assert_array_equal(result.offset, expected.offset)
+
+
+def test_density_cache(tmp_path, monkeypatch):
+    raw = np.linspace(0, 1, 24).reshape((2, 3, 4))
+    voxcell.VoxelData(raw, voxel_dimensions=(10, 10, 10)).save_nrrd(
+        str(tmp_path / "density.nrrd"), encoding="raw"
+    )
+    filepath = str(tmp_path / "density.nrrd")
+    voxels = np.array([1, 5, 23])
+
+    cache = test_module.DensityCache(atlas=None)
+    npt.assert_array_equal(cache.get_values(filepath, voxels), raw.flat[voxels])
+    npt.assert_array_equal(cache.get_values(1000, voxels), [1000, 1000, 1000])
+
+    # every volume is loaded once
+    monkeypatch.setattr(test_module, "_get_density_path", None)
+    assert cache.get(filepath) is cache.get(filepath)
+    assert len(cache) == 1
+    monkeypatch.undo()
+
+    cache = test_module.DensityCache(atlas=None, dtype="float32", mmap=True)
+    assert cache.get(filepath).raw.dtype == np.float32
+    npt.assert_allclose(cache.get_values(filepath, voxels), raw.flat[voxels], rtol=1e-6)
+
+    cache = test_module.DensityCache(atlas=None, mmap=True)
+    assert isinstance(cache.get(filepath).raw, np.memmap)
+    assert cache.get_values(filepath, voxels).dtype == np.float64
+
+
+def test_get_roi():
+    mask = np.zeros((4, 5, 6), dtype=bool)
+    mask[1, 2, 3] = mask[2, 3, 1] = True
+    assert test_module.get_roi(mask) == (slice(1, 3), slice(2, 4), slice(1, 4))
+
+    with pytest.raises(BrainBuilderError, match="Empty region of interest"):
+        test_module.get_roi(np.zeros((4, 5, 6), dtype=bool))
+
+
+def test_crop():
+    voxel_data = voxcell.VoxelData(
+        np.arange(60).reshape((3, 4, 5)), voxel_dimensions=(10, 20, 30), offset=(1, 2, 3)
+    )
+    roi = (slice(1, 3), slice(0, 2), slice(2, 5))
+    result = test_module.crop(voxel_data, roi)
+
+    npt.assert_array_equal(result.raw, voxel_data.raw[roi])
+    npt.assert_array_equal(result.offset, [11, 2, 63])
+    npt.assert_array_equal(result.lookup([[15, 25, 70]]), voxel_data.lookup([[15, 25, 70]]))
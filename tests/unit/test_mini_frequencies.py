@@ -7,7 +7,7 @@ from pathlib import Path
 
 import pandas as pd
 
-from brainbuilder.app.cells import _assign_mini_frequencies, load_mini_frequencies
+from brainbuilder.placement import _assign_mini_frequencies, load_mini_frequencies
 
 DATA_PATH = Path(Path(__file__).parent, "data")
 
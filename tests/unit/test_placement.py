@@ -0,0 +1,380 @@
+# SPDX-License-Identifier: Apache-2.0
+import shutil
+
+import h5py
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+import voxcell
+from voxcell.nexus.voxelbrain import Atlas
+
+from brainbuilder import cell_groups
+from brainbuilder import placement as test_module
+from brainbuilder.density_cache import DensityCache
+from brainbuilder.exceptions import BrainBuilderError
+from brainbuilder.region_index import RegionIndex
+from brainbuilder.utils.bbp import load_cell_composition
+from brainbuilder.utils.sonata.curate import get_population_name
+
+
+def _place(atlas_dir, **kwargs):
+    return test_module.place(
+        None,
+        str(atlas_dir / "composition.yaml"),
+        str(atlas_dir / "mtypes.tsv"),
+        str(atlas_dir),
+        **kwargs,
+    ).as_dataframe()
+
+
+def test_place(atlas_dir):
+    result = _place(atlas_dir, seed=0)
+
+    assert len(result) > 0
+    assert set(result["mtype"]) == {"L1_DAC", "L1_HAC"}
+    assert set(result[result["layer"] == "A"]["subregion"]) == {"A"}
+    assert set(result[result["layer"] == "B"]["subregion"]) == {"B"}
+    assert set(result["morph_class"]) == {"INT"}
+    pd.testing.assert_frame_equal(result, _place(atlas_dir, seed=0))
+    assert not result.equals(_place(atlas_dir, seed=1))
+
+
+def test_place__jobs(atlas_dir):
+    expected = _place(atlas_dir, seed=0, region="root")
+    pd.testing.assert_frame_equal(expected, _place(atlas_dir, seed=0, region="root", jobs=2))
+
+
+def test_place__mmap_densities(atlas_dir):
+    expected = _place(atlas_dir, seed=0)
+    gradient = voxcell.VoxelData.load_nrrd(str(atlas_dir / "gradient.nrrd"))
+    gradient.save_nrrd(str(atlas_dir / "gradient.nrrd"), encoding="raw")
+
+    pd.testing.assert_frame_equal(expected, _place(atlas_dir, seed=0, mmap_densities=True))
+    pd.testing.assert_frame_equal(
+        expected, _place(atlas_dir, seed=0, region="root", mmap_densities=True, jobs=2)
+    )
+
+
+def test_place__region(atlas_dir, monkeypatch):
+    result = _place(atlas_dir, seed=0, region="root")
+    assert set(result["subregion"]) == {"A", "B"}
+
+    # the atlas data is cropped to the region without changing the result
+    monkeypatch.setattr(test_module, "get_roi", lambda mask: tuple(slice(0, n) for n in mask.shape))
+    pd.testing.assert_frame_equal(result, _place(atlas_dir, seed=0, region="root"))
+
+
+def test_place_to_sonata(atlas_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(cell_groups, "CELL_GROUP_BATCH_SIZE", 1)
+    kwargs = {
+        "composition_path": str(atlas_dir / "composition.yaml"),
+        "mtype_taxonomy_path": str(atlas_dir / "mtypes.tsv"),
+        "atlas_url": str(atlas_dir),
+        "seed": 0,
+    }
+    test_module.place(None, **kwargs).save(tmp_path / "expected.h5")
+    test_module.place_to_sonata(tmp_path / "result.h5", **kwargs)
+    pd.testing.assert_frame_equal(
+        voxcell.CellCollection.load(tmp_path / "result.h5").as_dataframe(),
+        voxcell.CellCollection.load(tmp_path / "expected.h5").as_dataframe(),
+        check_like=True,
+        check_categorical=False,
+    )
+
+    # the cells are appended to the ones of the input
+    test_module.place(tmp_path / "expected.h5", **kwargs).save(tmp_path / "expected2.h5")
+    test_module.place_to_sonata(
+        tmp_path / "result2.h5", input_path=tmp_path / "expected.h5", **kwargs
+    )
+    pd.testing.assert_frame_equal(
+        voxcell.CellCollection.load(tmp_path / "result2.h5").as_dataframe(),
+        voxcell.CellCollection.load(tmp_path / "expected2.h5").as_dataframe(),
+        check_like=True,
+        check_categorical=False,
+    )
+
+    # the input can be extended in place
+    shutil.copyfile(tmp_path / "expected.h5", tmp_path / "result3.h5")
+    test_module.place_to_sonata(
+        tmp_path / "result3.h5", input_path=tmp_path / "result3.h5", **kwargs
+    )
+    pd.testing.assert_frame_equal(
+        voxcell.CellCollection.load(tmp_path / "result3.h5").as_dataframe(),
+        voxcell.CellCollection.load(tmp_path / "expected2.h5").as_dataframe(),
+        check_like=True,
+        check_categorical=False,
+    )
+
+    # the numerical properties missing from the new cells are NaN, as with `place`
+    input_cells = voxcell.CellCollection.load(tmp_path / "expected.h5")
+    input_cells.properties["depth"] = np.arange(len(input_cells.properties), dtype=float)
+    input_cells.save(tmp_path / "input.h5")
+    expected = test_module.place(tmp_path / "input.h5", **kwargs).as_dataframe()
+    test_module.place_to_sonata(tmp_path / "result4.h5", input_path=tmp_path / "input.h5", **kwargs)
+    result = voxcell.CellCollection.load(tmp_path / "result4.h5").as_dataframe()
+    pd.testing.assert_frame_equal(result, expected, check_like=True, check_categorical=False)
+    assert result["depth"].isna().any()
+
+
+def test_place__cell_group_cache(atlas_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(cell_groups, "CELL_GROUP_BATCH_SIZE", 2)
+    cache_dir = tmp_path / "cache"
+    expected = _place(atlas_dir, seed=0)
+
+    pd.testing.assert_frame_equal(expected, _place(atlas_dir, seed=0, cache_dir=cache_dir))
+    assert len(list(cache_dir.glob("*.npz"))) == 3
+
+    # the cached groups are not placed again
+    calls = []
+    create_cell_groups_batch = cell_groups._create_cell_groups_batch
+    monkeypatch.setattr(
+        cell_groups,
+        "_create_cell_groups_batch",
+        lambda conf_list, *args, **kwargs: calls.append(len(conf_list))
+        or create_cell_groups_batch(conf_list, *args, **kwargs),
+    )
+    pd.testing.assert_frame_equal(expected, _place(atlas_dir, seed=0, cache_dir=cache_dir))
+    assert calls == []
+
+    composition = atlas_dir / "composition.yaml"
+    composition.write_text(composition.read_text().replace("density: 50000", "density: 40000"))
+    result = _place(atlas_dir, seed=0, cache_dir=cache_dir)
+    assert calls == [1]
+    pd.testing.assert_frame_equal(result, _place(atlas_dir, seed=0))
+    pd.testing.assert_frame_equal(
+        result[result["layer"] != "B"], expected[expected["layer"] != "B"]
+    )
+    assert len(list(cache_dir.glob("*.npz"))) == 4
+    pd.testing.assert_frame_equal(result, _place(atlas_dir, seed=0, cache_dir=cache_dir, jobs=2))
+
+
+@pytest.mark.parametrize("soma_placement", ["basic", "poisson_disc_vectorized"])
+def test_estimate_placement(atlas_dir, soma_placement):
+    groups, total = test_module.estimate_placement(
+        str(atlas_dir / "composition.yaml"), str(atlas_dir), soma_placement=soma_placement
+    )
+    cells = _place(atlas_dir, seed=0)
+
+    npt.assert_array_equal(groups["region"], ["A", "root", "B"])
+    # the first and the last groups do not share the same layer
+    assert groups["cell_count"][0] == np.count_nonzero(cells["layer"] == "A")
+    assert groups["cell_count"][2] == np.count_nonzero(cells["layer"] == "B")
+    assert total["cell_count"] == groups["cell_count"].sum()
+    assert np.all(groups["nonzero_voxels"] > 0)
+    assert groups["bbox_min"][0] == (25.0, 25.0, 25.0)
+    assert groups["bbox_max"][0] == (150.0, 275.0, 275.0)
+    assert total["memory"] > groups["memory"].max()
+    assert total["runtime"] > 0
+    assert (groups["grid_shape"][0] is None) == (soma_placement == "basic")
+
+
+def test_get_shard_groups():
+    counts = [10, 1, 5, 5, 0]
+    npt.assert_array_equal(test_module._get_shard_groups(counts, 0, 2), [0, 1])
+    npt.assert_array_equal(test_module._get_shard_groups(counts, 1, 2), [2, 3, 4])
+    npt.assert_array_equal(test_module._get_shard_groups(counts, 0, 1), [0, 1, 2, 3, 4])
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_place_variants_to_sonata(atlas_dir, tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(cell_groups, "CELL_GROUP_BATCH_SIZE", 1)
+    kwargs = {
+        "composition_path": str(atlas_dir / "composition.yaml"),
+        "mtype_taxonomy_path": str(atlas_dir / "mtypes.tsv"),
+        "atlas_url": str(atlas_dir),
+    }
+    variants = [(0, 1.0), (1, 1.0), (0, 0.5)]
+    outputs = test_module.place_variants_to_sonata(
+        str(tmp_path / "result_{seed}_{density_factor}.h5"), variants, jobs=jobs, **kwargs
+    )
+    assert outputs == [
+        str(tmp_path / name) for name in ["result_0_1.0.h5", "result_1_1.0.h5", "result_0_0.5.h5"]
+    ]
+    for output, (seed, density_factor) in zip(outputs, variants):
+        test_module.place_to_sonata(
+            tmp_path / "expected.h5", seed=seed, density_factor=density_factor, **kwargs
+        )
+        pd.testing.assert_frame_equal(
+            voxcell.CellCollection.load(output).as_dataframe(),
+            voxcell.CellCollection.load(tmp_path / "expected.h5").as_dataframe(),
+        )
+
+    with pytest.raises(BrainBuilderError, match="do not have distinct outputs"):
+        test_module.place_variants_to_sonata(str(tmp_path / "result_{seed}.h5"), variants, **kwargs)
+
+    # a variant can extend the input in place, the other ones extend the original input
+    shutil.copyfile(outputs[0], tmp_path / "input_0_1.0.h5")
+    inplace = test_module.place_variants_to_sonata(
+        str(tmp_path / "input_{seed}_{density_factor}.h5"),
+        variants[:2],
+        input_path=tmp_path / "input_0_1.0.h5",
+        **kwargs,
+    )
+    sizes = [len(voxcell.CellCollection.load(output).properties) for output in outputs]
+    assert [len(voxcell.CellCollection.load(output).properties) for output in inplace] == [
+        2 * sizes[0],
+        sizes[0] + sizes[1],
+    ]
+
+
+def test_place_to_sonata__shard_densities(atlas_dir, tmp_path, monkeypatch):
+    caches = []
+
+    class DensityCache(test_module.DensityCache):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            caches.append(self)
+
+    monkeypatch.setattr(test_module, "DensityCache", DensityCache)
+    kwargs = {
+        "composition_path": str(atlas_dir / "composition.yaml"),
+        "mtype_taxonomy_path": str(atlas_dir / "mtypes.tsv"),
+        "atlas_url": str(atlas_dir),
+        "seed": 0,
+    }
+    for shard in range(2):
+        caches.clear()
+        test_module.place_to_sonata(tmp_path / "shard.h5", shard=(shard, 2), **kwargs)
+        with h5py.File(tmp_path / "shard.h5", "r") as h5f:
+            groups = list(h5f[f"nodes/{get_population_name(tmp_path / 'shard.h5')}/shard/groups"])
+        # the '{gradient}' density of the group 1 is only held for its shard, the densities
+        # of all the groups are loaded in a separate cache for the estimate
+        placement_cache, estimate_cache = caches
+        assert len(estimate_cache) == 1
+        assert len(placement_cache) == (1 in groups)
+
+
+@pytest.mark.parametrize("nb_shards", [2, 4])
+def test_merge_shards(atlas_dir, tmp_path, monkeypatch, nb_shards):
+    monkeypatch.setattr(cell_groups, "CELL_GROUP_BATCH_SIZE", 1)
+    monkeypatch.setattr(test_module, "MERGE_CHUNK_SIZE", 100)
+    kwargs = {
+        "composition_path": str(atlas_dir / "composition.yaml"),
+        "mtype_taxonomy_path": str(atlas_dir / "mtypes.tsv"),
+        "atlas_url": str(atlas_dir),
+        "seed": 0,
+    }
+    test_module.place_to_sonata(tmp_path / "expected.h5", **kwargs)
+    shard_paths = [tmp_path / f"shard{i}.h5" for i in range(nb_shards)]
+    for i, shard_path in enumerate(shard_paths):
+        test_module.place_to_sonata(shard_path, shard=(i, nb_shards), **kwargs)
+
+    test_module.merge_shards(shard_paths[::-1], tmp_path / "result.h5")
+    pd.testing.assert_frame_equal(
+        voxcell.CellCollection.load(tmp_path / "result.h5").as_dataframe(),
+        voxcell.CellCollection.load(tmp_path / "expected.h5").as_dataframe(),
+        check_like=True,
+        check_categorical=False,
+    )
+
+    # the shards can be merged into the input cells in place
+    shutil.copyfile(tmp_path / "expected.h5", tmp_path / "result2.h5")
+    test_module.merge_shards(shard_paths, tmp_path / "result2.h5", tmp_path / "result2.h5")
+    expected = voxcell.CellCollection.load(tmp_path / "expected.h5").as_dataframe()
+    pd.testing.assert_frame_equal(
+        voxcell.CellCollection.load(tmp_path / "result2.h5").as_dataframe(),
+        pd.concat([expected, expected]).set_axis(1 + np.arange(2 * len(expected))),
+        check_like=True,
+        check_categorical=False,
+    )
+
+    with pytest.raises(BrainBuilderError, match="Missing shards"):
+        test_module.merge_shards(shard_paths[1:], tmp_path / "result.h5")
+    (tmp_path / "mtypes2.tsv").write_text("mtype mClass sClass\nL1_DAC INT INH\nL1_HAC PYR EXC\n")
+    for options in [
+        {"seed": 1},
+        {"mtype_taxonomy_path": str(tmp_path / "mtypes2.tsv")},
+        {"atlas_cache": str(tmp_path / "atlas_cache")},
+        {"curves": ["hilbert"]},
+    ]:
+        test_module.place_to_sonata(shard_paths[0], shard=(0, nb_shards), **{**kwargs, **options})
+        with pytest.raises(BrainBuilderError, match="not the ones of the same placement"):
+            test_module.merge_shards(shard_paths, tmp_path / "result.h5")
+
+
+def test_place__atlas_properties(atlas_dir):
+    raw = np.ones((12, 12, 12), dtype=np.int32)
+    raw[:, :, 6:] = 2
+    voxcell.VoxelData(raw, voxel_dimensions=(25, 25, 25)).save_nrrd(
+        str(atlas_dir / "hemisphere.nrrd")
+    )
+    (atlas_dir / "mini.tsv").write_text(
+        "layer\texc_mini_frequency\tinh_mini_frequency\nA\t0.1\t0.2\nB\t0.3\t0.4\nroot\t0.5\t0.6\n"
+    )
+
+    result = _place(
+        atlas_dir,
+        seed=0,
+        mini_frequencies_path=str(atlas_dir / "mini.tsv"),
+        atlas_properties=[("hemisphere", "hemisphere"), ("region", "~brain_regions")],
+        append_hemisphere=True,
+        sort_by=["region"],
+    )
+
+    for prop in ["mtype", "subregion", "morph_class", "hemisphere", "region"]:
+        assert isinstance(result[prop].dtype, pd.CategoricalDtype)
+    expected = result["subregion"].astype(str) + "@" + result["hemisphere"].astype(str)
+    npt.assert_array_equal(result["region"].astype(str), expected)
+    assert result["region"].astype(str).is_monotonic_increasing
+    npt.assert_array_equal(
+        result["exc_mini_frequency"], result["layer"].map({"A": 0.1, "B": 0.3, "root": 0.5})
+    )
+
+
+@pytest.mark.parametrize("curve", ["hilbert", "morton"])
+def test_place__sort_by_curve(atlas_dir, curve):
+    result = _place(atlas_dir, seed=0, sort_by=["layer", curve])
+
+    assert result[curve].dtype == np.uint64
+    expected = result.sort_values(["layer", curve])
+    npt.assert_array_equal(result.index, expected.index)
+    pd.testing.assert_frame_equal(
+        result.drop(columns=curve).sort_values(["x", "y", "z"]),
+        _place(atlas_dir, seed=0)
+        .sort_values(["x", "y", "z"])
+        .set_axis(result.sort_values(["x", "y", "z"]).index),
+    )
+
+
+def test_load_mtype_taxonomy(tmp_path):
+    filepath = tmp_path / "mtypes.tsv"
+    filepath.write_text("mtype mClass sClass\nL1_DAC INT INH\nL2_PC PYR EXC\n")
+    result = test_module.load_mtype_taxonomy(filepath)
+    assert list(result.index) == ["L1_DAC", "L2_PC"]
+    assert list(result["sClass"]) == ["INH", "EXC"]
+
+    filepath.write_text("mtype mClass\nL1_DAC INT\n")
+    with pytest.raises(BrainBuilderError, match=r"Missing columns \['sClass'\]"):
+        test_module.load_mtype_taxonomy(filepath)
+
+    filepath.write_text("mtype mClass sClass\nL1_DAC INT INH\nL1_DAC PYR EXC\n")
+    with pytest.raises(BrainBuilderError, match=r"Duplicate mtypes \['L1_DAC'\]"):
+        test_module.load_mtype_taxonomy(filepath)
+
+
+def test_join_categorical():
+    left = pd.Categorical(["b", "a", None, "b"])
+    right = pd.Categorical(["x", "y", "x", "x"])
+    result = test_module._join_categorical(left, right, "@")
+    assert list(result.categories) == ["a@y", "b@x"]
+    assert list(result.astype(object)) == ["b@x", "a@y", np.nan, "b@x"]
+
+
+def test_place__regenerate_group(atlas_dir):
+    result = _place(atlas_dir, seed=0)
+
+    # a single group is regenerated with its own generator
+    atlas = Atlas.open(str(atlas_dir))
+    recipe = load_cell_composition(str(atlas_dir / "composition.yaml"))
+    group_conf = recipe["neurons"][2]
+    rng = cell_groups._get_group_rngs(0, [group_conf])[0]
+    region_index = RegionIndex(atlas.load_data("brain_regions"), atlas.load_region_map())
+    density_cache = DensityCache(atlas)
+    group = cell_groups._create_cell_group(
+        group_conf, density_cache, region_index, 1.0, "basic", rng
+    )
+
+    npt.assert_array_equal(
+        result[result["layer"] == "B"][["x", "y", "z"]].to_numpy(), group[["x", "y", "z"]]
+    )
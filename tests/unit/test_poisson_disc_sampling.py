@@ -1,5 +1,8 @@
 # SPDX-License-Identifier: Apache-2.0
+import itertools
+
 import numpy as np
+import numpy.testing as npt
 import pytest
 import scipy.spatial.distance as distance
 
@@ -146,3 +149,350 @@ def test_generate_points_random_seed_neg_domain_2(setup_func):
     for point in points:
         assert (point[0] <= domain[0, 0]) and (point[0] >= domain[1, 0])
         assert np.all(point[1:] >= domain[0, 1:]) and np.all(point[1:] <= domain[1, 1:])
+
+
+def test_generate_points_around():
+    point = np.array([1.0, 2.0, 3.0])
+    points = test_module.generate_points_around(point, 5, 100)
+
+    assert points.shape == (100, 3)
+    dist = np.linalg.norm(points - point, axis=1)
+    assert np.all((dist >= 5 - 1e-9) & (dist <= 10 + 1e-9))
+
+
+def test_no_collision_batch():
+    domain = np.array([[0, 0, 0], [100, 100, 100]])
+    grid = test_module.Grid(domain, 10)
+    sample_points = [np.array([50.0, 50.0, 50.0])]
+    grid.update(sample_points[0], 0)
+
+    points = np.array([[52.0, 50.0, 50.0], [60.0, 50.0, 50.0], [50.0, 50.0, 80.0]])
+    result = grid.no_collision_batch(sample_points[0], 40, points, np.full(3, 5.0), sample_points)
+
+    assert result.tolist() == [False, True, True]
+    assert result.tolist() == [grid.no_collision(p, 5.0, sample_points) for p in points]
+    # an infinite distance always collides
+    assert not grid.no_collision(points[1], np.inf, sample_points)
+
+
+def test_generate_points_vectorized(setup_func):
+    domain = np.array([[0, 0, 0], [100, 200, 500]])
+    nb_points = 200
+    min_distance = 5
+    seed = np.array([0, 0, 0])
+
+    def min_distance_func(point=None):
+        return min_distance
+
+    points = test_module.generate_points(
+        domain, nb_points, min_distance_func, seed, vectorized=True
+    )
+
+    assert len(points) == nb_points
+    assert np.all(np.equal(seed, points[0]))
+    min_distance_between_pts = np.min(distance.pdist(points).flatten())
+    assert min_distance <= min_distance_between_pts
+    for point in points:
+        assert np.all(point >= domain[0, :]) and np.all(point <= domain[1, :])
+
+
+def test_try_generate_points_batch_large_distances(monkeypatch):
+    domain = np.array([[0, 0, 0], [100, 100, 100]])
+    grid = test_module.Grid(domain, 1, rng=0)
+    samples = test_module.SampleStore(100, 3, rng=0)
+    point = np.array([50.0, 50.0, 50.0])
+    test_module._add_to_containers(point, samples, grid)
+
+    def min_distance_func(points=None):
+        if points is None or points.ndim == 1:
+            return 2.0
+        # no cell is expected where x > 50
+        return np.where(points[:, 0] > 50, 200.0, 2.0)
+
+    radii = []
+    no_collision_batch = grid.no_collision_batch
+
+    def no_collision_batch_spy(center, radius, *args):
+        radii.append(radius)
+        return no_collision_batch(center, radius, *args)
+
+    monkeypatch.setattr(grid, "no_collision_batch", no_collision_batch_spy)
+    test_module._try_generate_points_batch(30, point, min_distance_func, grid, samples)
+
+    # the neighbourhood query does not cover the whole grid
+    assert radii == [6.0]
+    assert len(samples) > 1
+    assert np.all(samples.get_points()[1:, 0] <= 50)
+
+
+def test_generate_points_vectorized_too_many(setup_func):
+    domain = np.array([[0, 0, 0], [10, 20, 5]])
+    nb_points = 1000
+    min_distance = 1
+
+    def min_distance_func(point=None):
+        return min_distance
+
+    points = test_module.generate_points(domain, nb_points, min_distance_func, vectorized=True)
+
+    assert len(points) < nb_points
+    min_distance_between_pts = np.min(distance.pdist(points).flatten())
+    assert min_distance <= min_distance_between_pts
+
+
+def test_sample_store(setup_func):
+    samples = test_module.SampleStore(3, 2)
+    assert len(samples) == 0 and not samples.is_full()
+
+    for k in range(3):
+        assert samples.add(np.array([k, k])) == k
+
+    assert samples.is_full()
+    assert samples.nb_active == 3
+    popped = {samples.pop_random_active() for _ in range(3)}
+    assert popped == {0, 1, 2}
+    assert samples.nb_active == 0
+    npt.assert_array_equal(samples.get_points(), [[0, 0], [1, 1], [2, 2]])
+
+
+def test_grid_empty_cells_all_returned_once(setup_func):
+    domain = np.array([[0, 0, 0], [100, 200, 500]])
+    grid = test_module.Grid(domain, 100)
+    grid.grid[0, 0, 0] = 0
+    nb_empty = grid.grid.size - 1
+
+    cells = {grid.get_random_empty_grid_cell() for _ in range(nb_empty)}
+
+    assert len(cells) == nb_empty
+    assert (0, 0, 0) not in cells
+    assert grid.nb_free_cells_scans == 1
+
+    # occupied cells are skipped lazily after the list of free cells is rebuilt
+    grid.get_random_empty_grid_cell()
+    grid.grid[:, :, :] = 0
+    grid.grid[1, 1, 1] = -1
+    assert grid.get_random_empty_grid_cell() == (1, 1, 1)
+    assert grid.nb_empty_cell_requests == nb_empty + 2
+    assert grid.nb_stale_free_cells > 0
+
+
+def test_sparse_grid_neighbourhood():
+    domain = np.array([[0, 0, 0], [100, 200, 500]])
+    dense = test_module.Grid(domain, 10)
+    sparse = test_module.SparseGrid(domain, 10, block_size=4)
+    points = np.array([[5.0, 5.0, 5.0], [35.0, 45.0, 55.0], [95.0, 195.0, 495.0]])
+    for idx, point in enumerate(points):
+        dense.update(point, idx)
+        sparse.update(point, idx)
+
+    assert sparse.shape == dense.shape
+    assert sparse.nb_occupied_cells == 3
+    for point in points:
+        for dist in (5, 50, 500):
+            npt.assert_array_equal(
+                np.sort(sparse.get_sample_indices_in_neighbourhood(point, dist)),
+                np.sort(dense.get_sample_indices_in_neighbourhood(point, dist)),
+            )
+
+
+def test_sparse_grid_empty_cell(setup_func):
+    domain = np.array([[0, 0, 0], [10, 10, 10]])
+    grid = test_module.SparseGrid(domain, 10)
+    grid.update(np.array([1.0, 1.0, 1.0]), 0)
+
+    for _ in range(10):
+        assert grid.get_random_empty_grid_cell() != (0, 0, 0)
+
+    for point in itertools.product([1.0, 11.0], repeat=3):
+        grid.update(np.array(point), 0)
+    with pytest.raises(BrainBuilderError):
+        grid.get_random_empty_grid_cell()
+
+
+def test_create_grid():
+    domain = np.array([[0, 0, 0], [100, 200, 500]])
+    assert type(test_module.create_grid(domain, 10, 100)) is test_module.Grid
+    assert test_module.create_grid(domain, 10, 100).grid.dtype == np.int32
+    assert isinstance(test_module.create_grid(domain, 10, 100, 0.01), test_module.SparseGrid)
+
+
+def test_generate_points_sparse(setup_func):
+    domain = np.array([[0, 0, 0], [100, 200, 500]])
+    nb_points = 200
+    min_distance = 5
+
+    def min_distance_func(point=None):
+        return min_distance
+
+    points = test_module.generate_points(
+        domain, nb_points, min_distance_func, nonzero_fraction=0.01, vectorized=True
+    )
+
+    assert len(points) == nb_points
+    min_distance_between_pts = np.min(distance.pdist(points).flatten())
+    assert min_distance <= min_distance_between_pts
+
+
+def test_generate_points_existing_points(setup_func):
+    domain = np.array([[0, 0, 0], [50, 50, 50]])
+    existing_points = np.array([[25.0, 25.0, 25.0], [55.0, 25.0, 25.0], [25.0, -3.0, 25.0]])
+    nb_points = 5000
+    min_distance = 5
+
+    def min_distance_func(point=None):
+        return min_distance
+
+    for vectorized in (False, True):
+        points = test_module.generate_points(
+            domain,
+            nb_points,
+            min_distance_func,
+            seed=existing_points[0],
+            vectorized=vectorized,
+            existing_points=existing_points,
+        )
+        assert 0 < len(points) < nb_points
+        assert min_distance <= np.min(distance.pdist(np.concatenate([points, existing_points])))
+
+
+def test_trial_budget():
+    grid = test_module.Grid(np.array([[0, 0, 0], [100, 100, 100]]), 1)
+    budget = test_module.TrialBudget(30, grid)
+    region, nb_trials = budget.get(np.array([1.0, 1.0, 1.0]))
+    assert region == (0, 0, 0)
+    assert nb_trials == 30
+
+    # the budget is lowered where the acceptance rate collapses
+    budget.update(region, 30, 3)
+    assert budget.get(np.array([2.0, 2.0, 2.0])) == (region, 30)
+    budget.update(region, 30, 0)
+    assert budget.get(np.array([2.0, 2.0, 2.0])) == (region, 30)
+    budget.update(region, 60, 0)
+    assert budget.get(np.array([2.0, 2.0, 2.0])) == (region, 15)
+    budget.update(region, 500, 0)
+    assert budget.get(np.array([2.0, 2.0, 2.0])) == (region, test_module.ADAPTIVE_MIN_TRIALS)
+    # other regions are not affected
+    assert budget.get(np.array([20.0, 2.0, 2.0])) == ((2, 0, 0), 30)
+
+    assert test_module.TrialBudget(30, grid, adaptive=False).get(np.zeros(3)) == (None, 30)
+
+
+def test_trial_budget_reseed():
+    grid = test_module.Grid(np.array([[0, 0, 0], [100, 100, 100]]), 1)
+    budget = test_module.TrialBudget(2, grid)
+    region, other = (0, 0, 0), (2, 0, 0)
+    assert budget.get_region(np.array([20.0, 2.0, 2.0])) == other
+
+    # the reseeding budget of a region is exhausted by consecutive failures
+    budget.update_reseed(region, False)
+    assert budget.can_reseed(region)
+    budget.update_reseed(region, False)
+    assert not budget.can_reseed(region)
+    # other regions are not affected
+    assert budget.can_reseed(other)
+
+    # a success resets the failures and doubles the budget, up to the maximum factor
+    for _ in range(10):
+        budget.update_reseed(other, True)
+    for _ in range(2 * test_module.ADAPTIVE_MAX_RESEED_FACTOR - 1):
+        budget.update_reseed(other, False)
+    assert budget.can_reseed(other)
+    budget.update_reseed(other, False)
+    assert not budget.can_reseed(other)
+
+
+def test_try_reseed():
+    grid = test_module.Grid(np.array([[0, 0, 0], [7, 7, 7]]), 1, rng=0)
+    budget = test_module.TrialBudget(2, grid)
+    assert grid.shape == (test_module.ADAPTIVE_REGION_SIZE,) * 3
+    samples = test_module.SampleStore(10, 3, rng=0)
+    stats = test_module.SamplingStats()
+
+    # the seeds are still tried when the reseeding budget of the only region is exhausted
+    budget.update_reseed((0, 0, 0), False)
+    budget.update_reseed((0, 0, 0), False)
+    assert not budget.can_reseed((0, 0, 0))
+    assert test_module._try_reseed(budget, lambda point: 1.0, grid, samples, stats)
+    assert len(samples) == 1
+    assert stats.nb_accepted == 1
+    nb_trials = stats.nb_trials
+
+    # it gives up after ADAPTIVE_MAX_RESEED_FACTOR * nb_trials failed seeds
+    assert not test_module._try_reseed(budget, lambda point: 100.0, grid, samples, stats)
+    assert len(samples) == 1
+    assert stats.nb_trials == nb_trials + 2 * test_module.ADAPTIVE_MAX_RESEED_FACTOR
+
+
+def test_generate_points_adaptive(setup_func):
+    domain = np.array([[0, 0, 0], [50, 50, 50]])
+    nb_points = 1000
+    min_distance = 5
+
+    def min_distance_func(point=None):
+        return min_distance
+
+    for vectorized in (False, True):
+        stats = test_module.SamplingStats()
+        points = test_module.generate_points(
+            domain,
+            nb_points,
+            min_distance_func,
+            vectorized=vectorized,
+            adaptive=True,
+            stats=stats,
+        )
+        assert 0 < len(points) < nb_points
+        assert min_distance <= np.min(distance.pdist(points))
+        assert stats.nb_target == nb_points
+        assert stats.nb_points == len(points)
+        assert stats.shortfall == nb_points - len(points)
+        assert 0 < stats.acceptance_rate < 1
+        assert stats.nb_reseeds > 0
+        assert f"{len(points)} / {nb_points} points" in str(stats)
+
+
+def test_generate_points_not_adaptive_default(setup_func):
+    domain = np.array([[0, 0, 0], [50, 50, 50]])
+
+    def min_distance_func(point=None):
+        return 5
+
+    stats = test_module.SamplingStats()
+    points = test_module.generate_points(domain, 1000, min_distance_func, rng=0, stats=stats)
+    npt.assert_array_equal(
+        points,
+        test_module.generate_points(domain, 1000, min_distance_func, rng=0, adaptive=False),
+    )
+    # the statistics of several runs are added
+    test_module.generate_points(domain, 10, min_distance_func, rng=0, stats=stats)
+    assert stats.nb_target == 1010
+    assert stats.nb_points == len(points) + 10
+
+
+def test_generate_periodic_points():
+    side = 10.0
+    min_distance = 1.5
+    points = test_module.generate_periodic_points(side, 1000, min_distance, seed=0)
+
+    assert 0 < len(points) < 1000
+    assert np.all((points >= 0) & (points < side))
+    # the minimum distance is kept when the pattern is tiled
+    tiled = np.concatenate([points + np.array(offset) * side for offset in np.ndindex(2, 2, 2)])
+    assert min_distance <= np.min(distance.pdist(tiled))
+    npt.assert_array_equal(
+        points, test_module.generate_periodic_points(side, 1000, min_distance, seed=0)
+    )
+
+
+def test_get_periodic_pattern(tmp_path, monkeypatch):
+    monkeypatch.setattr(test_module, "PERIODIC_PATTERN_NB_POINTS", 100)
+    monkeypatch.setattr(test_module, "_PERIODIC_PATTERNS", {})
+    points, side = test_module.get_periodic_pattern(2.0, 0.6, cache_dir=tmp_path)
+
+    npt.assert_allclose(side, np.cbrt(50))
+    assert 0 < len(points) <= 100
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+    # the pattern is loaded from the cache
+    monkeypatch.setattr(test_module, "_PERIODIC_PATTERNS", {})
+    npt.assert_array_equal(points, test_module.get_periodic_pattern(2.0, 0.6, tmp_path)[0])
@@ -1,4 +1,6 @@
 # SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import numpy.testing as npt
 import pytest
 
 import brainbuilder.utils.random as test_module
@@ -32,3 +34,15 @@ def test_parse_distr_raises():
         test_module.parse_distr(("norm", {"loc": 2}))
     with pytest.raises(AttributeError):
         test_module.parse_distr(("foo", None))
+
+
+def test_get_rng():
+    rng = np.random.default_rng(0)
+    assert test_module.get_rng(rng) is rng
+    npt.assert_array_equal(test_module.get_rng(42).random(3), test_module.get_rng(42).random(3))
+
+    # without rng, the generator is seeded from the global numpy random state
+    np.random.seed(0)
+    expected = test_module.get_rng().random(3)
+    np.random.seed(0)
+    npt.assert_array_equal(test_module.get_rng().random(3), expected)
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: Apache-2.0
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+from voxcell import RegionMap, VoxelData
+from voxcell.math_utils import isin
+
+import brainbuilder.region_index as test_module
+from brainbuilder.exceptions import BrainBuilderError
+
+DATA_PATH = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def region_map():
+    return RegionMap.load_json(DATA_PATH / "hierarchy.json")
+
+
+@pytest.fixture
+def brain_regions(region_map):
+    region_ids = list(region_map.find("root", attr="acronym", with_descendants=True))
+    raw = np.random.RandomState(0).choice(region_ids + [0] * 100 + [123456789], (20, 30, 40))
+    return VoxelData(raw.astype(np.int32), voxel_dimensions=(25, 25, 25), offset=(10, 20, 30))
+
+
+def test_get_voxels(brain_regions, region_map):
+    region_index = test_module.RegionIndex(brain_regions, region_map)
+
+    for value in ["root", "Isocortex", "SSp", "VISp1", "@^MO"]:
+        for with_descendants in (True, False):
+            region_ids = list(region_map.find(value, "acronym", with_descendants=with_descendants))
+            npt.assert_array_equal(
+                region_index.get_voxels(value, with_descendants=with_descendants),
+                np.flatnonzero(isin(brain_regions.raw, region_ids)),
+            )
+
+    npt.assert_array_equal(
+        region_index.get_voxels(315, attr="id"),
+        np.flatnonzero(
+            isin(brain_regions.raw, list(region_map.find(315, "id", with_descendants=True)))
+        ),
+    )
+
+    with pytest.raises(BrainBuilderError, match="Region not found"):
+        region_index.get_voxels("unknown")
+
+
+def test_get_voxels__mask(brain_regions, region_map):
+    mask = np.zeros(brain_regions.shape, dtype=bool)
+    mask[:5] = True
+    region_index = test_module.RegionIndex(brain_regions, region_map, mask=mask)
+
+    region_ids = list(region_map.find("Isocortex", "acronym", with_descendants=True))
+    npt.assert_array_equal(
+        region_index.get_voxels("Isocortex"),
+        np.flatnonzero(isin(brain_regions.raw, region_ids) & mask),
+    )
+
+
+def test_to_voxel_data(brain_regions, region_map):
+    region_index = test_module.RegionIndex(brain_regions, region_map)
+    voxels = region_index.get_voxels("SSp")
+    values = np.arange(1, len(voxels) + 1, dtype=np.float64)
+
+    result = region_index.to_voxel_data(voxels, values)
+
+    expected = np.zeros(brain_regions.shape)
+    expected.flat[voxels] = values
+    ijk = np.unravel_index(voxels, brain_regions.shape)
+    start = [np.min(idx) for idx in ijk]
+    npt.assert_array_equal(
+        result.raw, expected[tuple(slice(a, np.max(idx) + 1) for a, idx in zip(start, ijk))]
+    )
+    npt.assert_allclose(result.offset, brain_regions.indices_to_positions(start))
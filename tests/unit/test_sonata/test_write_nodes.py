@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: Apache-2.0
+import h5py
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import pytest
+from voxcell import CellCollection
+
+import brainbuilder.utils.sonata.write_nodes as test_module
+from brainbuilder.exceptions import BrainBuilderError
+
+
+def _cells(mtypes, depth):
+    return pd.DataFrame({"mtype": pd.Categorical(mtypes), "depth": np.array(depth, dtype=float)})
+
+
+def test_node_population_writer(tmp_path):
+    filepath = tmp_path / "nodes.h5"
+    with test_module.NodePopulationWriter(filepath, "default") as writer:
+        writer.append(_cells(["b", "a"], [1, 2]))
+        writer.append(_cells([], []))
+        writer.append(_cells(["c", "b"], [3, 4]))
+        assert writer.size == 4
+
+    with h5py.File(filepath, "r") as h5f:
+        group = h5f["nodes/default/0"]
+        assert list(group["@library/mtype"].asstr()[()]) == ["a", "b", "c"]
+        npt.assert_array_equal(group["mtype"], [1, 0, 2, 1])
+        npt.assert_array_equal(h5f["nodes/default/node_type_id"], [-1, -1, -1, -1])
+
+    cells = CellCollection.load(filepath)
+    assert list(cells.properties["mtype"]) == ["b", "a", "c", "b"]
+    npt.assert_array_equal(cells.properties["depth"], [1, 2, 3, 4])
+
+
+def test_node_population_writer__append(tmp_path):
+    filepath = tmp_path / "nodes.h5"
+    cells = CellCollection.from_dataframe(
+        _cells(["a", "a", "a"], [1, 2, 3]).set_index(1 + np.arange(3))
+    )
+    cells.population_name = "pop"
+    cells.save(filepath)
+
+    with test_module.NodePopulationWriter(filepath, "pop", mode="a") as writer:
+        writer.append(_cells(["b", "a"], [4, 5]))
+        with pytest.raises(BrainBuilderError, match="Missing 'mtype' values"):
+            writer.append(_cells([None], [6]))
+        with pytest.raises(BrainBuilderError, match="Missing 'mtype' values"):
+            writer.append(pd.DataFrame({"depth": [6.0]}))
+        with pytest.raises(BrainBuilderError, match="Missing 'etype' values"):
+            writer.append(_cells(["b"], [6]).assign(etype=pd.Categorical(["x"])))
+
+    cells = CellCollection.load(filepath)
+    assert cells.population_name == "pop"
+    assert list(cells.properties["mtype"]) == ["a", "a", "a", "b", "a"]
+    npt.assert_array_equal(cells.properties["depth"], [1, 2, 3, 4, 5])
+
+
+def test_node_population_writer__missing_properties(tmp_path):
+    filepath = tmp_path / "nodes.h5"
+    with test_module.NodePopulationWriter(filepath, "default") as writer:
+        writer.append(_cells(["a", "b"], [1, 2]))
+        # the new numerical properties are NaN for the previous cells, and vice versa
+        writer.append(_cells(["b"], [3]).assign(layer=np.array([1], dtype=np.int64)))
+        writer.append(pd.DataFrame({"mtype": pd.Categorical(["c"]), "layer": [2]}))
+
+    # same as concatenating the DataFrames
+    expected = pd.concat(
+        [
+            _cells(["a", "b"], [1, 2]),
+            _cells(["b"], [3]).assign(layer=np.array([1], dtype=np.int64)),
+            pd.DataFrame({"mtype": ["c"], "layer": [2]}),
+        ],
+        ignore_index=True,
+    )
+    cells = CellCollection.load(filepath).as_dataframe().reset_index(drop=True)
+    assert list(cells["mtype"]) == list(expected["mtype"])
+    for name in ["depth", "layer"]:
+        assert cells[name].dtype == np.float64
+        npt.assert_array_equal(cells[name], expected[name])
+
+    # the integer properties are converted to float to hold the NaN values
+    with test_module.NodePopulationWriter(filepath, "default") as writer:
+        writer.append(pd.DataFrame({"layer": np.array([1, 2], dtype=np.int64)}))
+        writer.append(pd.DataFrame({"depth": [3.0]}))
+    cells = CellCollection.load(filepath).as_dataframe()
+    npt.assert_array_equal(cells["layer"], [1, 2, np.nan])
+    npt.assert_array_equal(cells["depth"], [np.nan, np.nan, 3])
+
+
+def test_node_population_writer__empty(tmp_path):
+    filepath = tmp_path / "nodes.h5"
+    with test_module.NodePopulationWriter(filepath, "default") as writer:
+        writer.append(_cells([], []))
+
+    cells = CellCollection.load(filepath)
+    assert len(cells.properties) == 0
+    assert set(cells.properties) == {"mtype", "depth"}
+
+
+def test_read_cells(tmp_path):
+    filepath = tmp_path / "nodes.h5"
+    with test_module.NodePopulationWriter(filepath, "default") as writer:
+        writer.append(_cells(["b", "a", "c"], [1, 2, 3]))
+
+    with h5py.File(filepath, "r") as h5f:
+        result = test_module.read_cells(h5f["nodes/default"], 1, 3)
+    assert list(result["mtype"]) == ["a", "c"]
+    npt.assert_array_equal(result["depth"], [2, 3])
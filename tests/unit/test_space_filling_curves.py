@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+import brainbuilder.space_filling_curves as test_module
+from brainbuilder.exceptions import BrainBuilderError
+
+
+def _all_indices(shape):
+    return np.stack(np.unravel_index(np.arange(np.prod(shape)), shape), axis=1)
+
+
+def test_morton_indices():
+    npt.assert_array_equal(
+        test_module.morton_indices(
+            [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 1]], (2, 2, 2)
+        ),
+        [0, 4, 2, 1, 7],
+    )
+    npt.assert_array_equal(test_module.morton_indices([[2, 3, 1]], (4, 4, 4)), [0b110011])
+
+
+@pytest.mark.parametrize("shape", [(8, 8, 8), (16, 16, 16)])
+def test_hilbert_indices(shape):
+    indices = _all_indices(shape)
+    result = test_module.hilbert_indices(indices, shape)
+    assert result.dtype == np.uint64
+    npt.assert_array_equal(np.sort(result), np.arange(np.prod(shape)))
+
+    # consecutive voxels along the curve are neighbours
+    ordered = indices[np.argsort(result)]
+    npt.assert_array_equal(np.abs(np.diff(ordered, axis=0)).sum(axis=1), 1)
+
+
+def test_hilbert_indices__not_cubic():
+    shape = (5, 7, 3)
+    result = test_module.hilbert_indices(_all_indices(shape), shape)
+    assert len(np.unique(result)) == np.prod(shape)
+    assert result.max() < 8**3
+
+
+def test_too_large():
+    with pytest.raises(BrainBuilderError, match="Volume too large"):
+        test_module.morton_indices([[0, 0, 0]], (1 << 22, 1, 1))